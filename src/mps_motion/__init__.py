@@ -1,30 +1,97 @@
-"""Top-level package for MPS Motion Tracking."""
+"""Top-level package for MPS Motion Tracking.
 
+The submodules and the classes exported here are imported when they
+are first used (PEP 562), so importing the package is fast and e.g
+the command line interface only pays for the modules it needs.
+"""
+
+import importlib as _importlib
 import logging as _logging
 from importlib.metadata import metadata
+from typing import TYPE_CHECKING
 
 import daiquiri as _daiquiri
 
-from . import block_matching
-from . import dualtvl1
-from . import farneback
-from . import filters
-from . import frame_sequence
-from . import lucas_kanade
-from . import mechanics
-from . import motion_tracking
-from . import scaling
-from . import stats
-from . import utils
-from . import visu
-from .frame_sequence import FrameSequence
-from .frame_sequence import TensorFrameSequence
-from .frame_sequence import VectorFrameSequence
-from .mechanics import Mechanics
-from .motion_tracking import FLOW_ALGORITHMS
-from .motion_tracking import list_optical_flow_algorithm
-from .motion_tracking import OpticalFlow
-from .utils import MPSData
+_SUBMODULES = [
+    "algorithms",
+    "block_matching",
+    "cache",
+    "dualtvl1",
+    "execution",
+    "farneback",
+    "filters",
+    "frame_sequence",
+    "lucas_kanade",
+    "mechanics",
+    "motion_tracking",
+    "pipeline",
+    "profiling",
+    "readers",
+    "scaling",
+    "stats",
+    "utils",
+    "visu",
+]
+
+# Name of the exported attributes and the submodule defining them
+_ATTRIBUTES = {
+    "FieldCache": "cache",
+    "ExecutionConfig": "execution",
+    "FrameSequence": "frame_sequence",
+    "TensorFrameSequence": "frame_sequence",
+    "VectorFrameSequence": "frame_sequence",
+    "Mechanics": "mechanics",
+    "FLOW_ALGORITHMS": "algorithms",
+    "list_optical_flow_algorithm": "algorithms",
+    "OpticalFlow": "motion_tracking",
+    "MPSData": "utils",
+}
+
+if TYPE_CHECKING:
+    from . import algorithms
+    from . import block_matching
+    from . import cache
+    from . import dualtvl1
+    from . import execution
+    from . import farneback
+    from . import filters
+    from . import frame_sequence
+    from . import lucas_kanade
+    from . import mechanics
+    from . import motion_tracking
+    from . import pipeline
+    from . import profiling
+    from . import readers
+    from . import scaling
+    from . import stats
+    from . import utils
+    from . import visu
+    from .algorithms import FLOW_ALGORITHMS
+    from .algorithms import list_optical_flow_algorithm
+    from .cache import FieldCache
+    from .execution import ExecutionConfig
+    from .frame_sequence import FrameSequence
+    from .frame_sequence import TensorFrameSequence
+    from .frame_sequence import VectorFrameSequence
+    from .mechanics import Mechanics
+    from .motion_tracking import OpticalFlow
+    from .utils import MPSData
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return _importlib.import_module(f"{__name__}.{name}")
+    if name in _ATTRIBUTES:
+        value = getattr(_importlib.import_module(f"{__name__}.{_ATTRIBUTES[name]}"), name)
+        # Cache the attribute, so that this is only called once
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
 
 meta = metadata("mps-motion")
 __version__ = meta["Version"]
@@ -35,21 +102,9 @@ __program_name__ = meta["Name"]
 
 
 def set_log_level(level):
-    for logger in [
-        block_matching.logger,
-        dualtvl1.logger,
-        farneback.logger,
-        lucas_kanade.logger,
-        mechanics.logger,
-        motion_tracking.logger,
-        scaling.logger,
-        utils.logger,
-        visu.logger,
-        frame_sequence.logger,
-        filters.logger,
-        stats.logger,
-    ]:
-        logger.setLevel(level)
+    # Set the level by name, which does not import the submodules
+    for name in _SUBMODULES:
+        _logging.getLogger(f"{__name__}.{name}").setLevel(level)
 
 
 _daiquiri.setup(level=_logging.INFO)
@@ -76,4 +131,12 @@ __all__ = [
     "TensorFrameSequence",
     "stats",
     "list_optical_flow_algorithm",
+    "cache",
+    "FieldCache",
+    "pipeline",
+    "profiling",
+    "execution",
+    "ExecutionConfig",
+    "readers",
+    "algorithms",
 ]
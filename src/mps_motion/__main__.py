@@ -1,12 +1,15 @@
 from pathlib import Path
 from textwrap import dedent
+from typing import List
 from typing import Optional
 
-import mps
 import typer
 
-from .cli import main as _main
-from .motion_tracking import FLOW_ALGORITHMS
+# The heavy modules are imported inside the commands, so that
+# e.g `mps-motion --version` starts quickly
+from .algorithms import FLOW_ALGORITHMS
+from .execution import ExecutionConfig
+from .execution import Scheduler
 
 app = typer.Typer(help="Estimate motion in stack of images")
 
@@ -29,6 +32,26 @@ def license_callback(show_license: bool):
         raise typer.Exit()
 
 
+@app.callback()
+def callback(
+    version: bool = typer.Option(
+        None,
+        "--version",
+        callback=version_callback,
+        is_eager=True,
+        help="Show version",
+    ),
+    license: bool = typer.Option(
+        None,
+        "--license",
+        callback=license_callback,
+        is_eager=True,
+        help="Show license",
+    ),
+):
+    pass
+
+
 @app.command(
     help="Run motion analysis on a single file and output results in a directory",
 )
@@ -182,7 +205,72 @@ def analyze(
         "--end-t",
         help="End time.",
     ),
+    cache: bool = typer.Option(
+        False,
+        "--cache",
+        help=dedent(
+            """
+            Keep the decoded frames in a chunked HDF5 file next to the recording,
+            so that analysing other regions or time windows later only reads the
+            selected frames.""",
+        ),
+    ),
+    overwrite: bool = typer.Option(
+        False,
+        "--overwrite",
+        help=dedent(
+            """
+            Recompute everything. By default the stages of an earlier analysis in the
+            output directory are reused if their inputs and settings are unchanged.""",
+        ),
+    ),
+    scheduler: Optional[Scheduler] = typer.Option(
+        None,
+        "--scheduler",
+        help=dedent(
+            """
+            Scheduler used for the parallel computations. By default threads are used
+            for most computations and processes for the ones holding the GIL.""",
+        ),
+    ),
+    num_workers: Optional[int] = typer.Option(
+        None,
+        "--num-workers",
+        help="Number of threads or processes used in the computations, by default the number of cores.",
+    ),
+    threads_per_worker: Optional[int] = typer.Option(
+        None,
+        "--threads-per-worker",
+        help="Number of threads used inside each worker by OpenCV, numba and BLAS.",
+    ),
+    chunk_size: Optional[int] = typer.Option(
+        None,
+        "--chunk-size",
+        help="Number of frames in each chunk of the lazy arrays.",
+    ),
+    memory_limit: Optional[str] = typer.Option(
+        None,
+        "--memory-limit",
+        help=dedent(
+            """
+            Approximate memory budget, e.g '8GB'. It limits the size of the caches
+            and of the chunks.""",
+        ),
+    ),
+    jobs: int = typer.Option(
+        1,
+        "--jobs",
+        "-j",
+        help=dedent(
+            """
+            Number of files analyzed in parallel when the path is a directory.
+            Completed files are recorded in a manifest.json file and skipped
+            when the directory is analyzed again.""",
+        ),
+    ),
 ):
+    from .cli import main as _main
+
     _main(
         filename=filename,
         algorithm=algorithm,
@@ -206,6 +294,16 @@ def analyze(
         end_y=end_y,
         start_t=start_t,
         end_t=end_t,
+        cache=cache,
+        jobs=jobs,
+        overwrite=overwrite,
+        execution=ExecutionConfig(
+            scheduler=scheduler,
+            num_workers=num_workers,
+            threads_per_worker=threads_per_worker,
+            chunk_size=chunk_size,
+            memory_limit=memory_limit,
+        ),
     )
 
 
@@ -234,6 +332,23 @@ def gui(
     sp.run(["streamlit", "run", gui_path.as_posix(), "--", path.as_posix()])
 
 
+@app.command(help="Compile the numba kernels and cache them on disk")
+def warmup(
+    dtypes: Optional[List[str]] = typer.Option(
+        None,
+        "--dtype",
+        help=dedent(
+            """
+            Type of the frames to compile the kernels for. Can be given several
+            times, by default uint8, uint16, float32 and float64.""",
+        ),
+    ),
+):
+    from . import utils
+
+    utils.warmup(dtypes or utils.WARMUP_DTYPES)
+
+
 @app.command(help="Print info about the file")
 def info(
     path: Path = typer.Argument(
@@ -250,6 +365,8 @@ def info(
         ),
     ),
 ):
+    import mps
+
     data = mps.MPS(path)
 
     try:
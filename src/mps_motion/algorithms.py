@@ -0,0 +1,17 @@
+"""Names of the optical flow algorithms.
+
+This module has no heavy dependencies, so that e.g the command
+line interface can list the algorithms without importing them.
+"""
+from enum import Enum
+
+
+class FLOW_ALGORITHMS(str, Enum):
+    farneback = "farneback"
+    dualtvl1 = "dualtvl1"
+    lucas_kanade = "lucas_kanade"
+    block_matching = "block_matching"
+
+
+def list_optical_flow_algorithm():
+    return FLOW_ALGORITHMS._member_names_
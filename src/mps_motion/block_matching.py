@@ -24,7 +24,7 @@
 # SIMULA RESEARCH LABORATORY MAKES NO REPRESENTATIONS AND EXTENDS NO
 # WARRANTIES OF ANY KIND, EITHER IMPLIED OR EXPRESSED, INCLUDING, BUT
 # NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY OR FITNESS
-import concurrent.futures
+import itertools
 import logging
 from typing import Tuple
 from typing import Union
@@ -32,6 +32,8 @@ from typing import Union
 import numpy as np
 import tqdm
 
+from . import execution
+from . import profiling
 from . import scaling
 from . import utils
 
@@ -98,7 +100,7 @@ def flow(
     return vectors
 
 
-@utils.jit(nopython=True)
+@utils.jit(nopython=True, cache=True)
 def _flow(
     image: np.ndarray,
     reference_image: np.ndarray,
@@ -288,9 +290,13 @@ def get_displacements(
     shape = (max(y_size // block_size, 1), max(x_size // block_size, 1))
     flows = np.zeros((shape[0], shape[1], num_frames, 2))
 
-    with concurrent.futures.ProcessPoolExecutor() as executor:
+    with profiling.stage("block_matching", num_frames=num_frames), execution.executor() as executor:
+        # The first frame is computed here before the workers are started, so
+        # that the kernel is compiled (or loaded from the cache) only once and
+        # the workers load it from the cache instead of all compiling it
+        first = [flow_map(a) for a in itertools.islice(args, 1)]
         for i, uv in tqdm.tqdm(
-            enumerate(executor.map(flow_map, args)),
+            enumerate(itertools.chain(first, executor.map(flow_map, args))),
             desc="Compute displacement",
             total=num_frames,
         ):
@@ -0,0 +1,163 @@
+import logging
+import shutil
+import tempfile
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import Hashable
+from typing import Iterator
+from typing import Optional
+
+import numpy as np
+
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+
+def nbytes(value: Any) -> int:
+    """Number of bytes held in memory by `value`.
+
+    Only numpy arrays (and frame sequences backed by numpy arrays)
+    are counted. Lazy dask arrays and memory mapped arrays do not
+    hold the data in memory and are counted as zero bytes.
+    """
+    if isinstance(value, np.memmap):
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    array = getattr(value, "_array", None)
+    if isinstance(array, np.ndarray):
+        return nbytes(array)
+    return 0
+
+
+class FieldCache:
+    """Least recently used cache for derived fields.
+
+    The cache keeps track of the memory used by the values that
+    are stored and evicts the least recently used values when the
+    memory exceeds `max_bytes`. If `spill_dir` is given, numpy
+    arrays are written to disk instead of being dropped, and are
+    read back as memory mapped arrays.
+
+    Parameters
+    ----------
+    max_bytes : Optional[int], optional
+        Memory budget in bytes, by default None, meaning
+        that no values are evicted
+    spill_dir : Optional[utils.PathLike], optional
+        Directory where evicted arrays are stored, by default None.
+        The files are removed when the cache is cleared or
+        garbage collected.
+    """
+
+    def __init__(
+        self,
+        max_bytes: Optional[int] = None,
+        spill_dir: Optional[utils.PathLike] = None,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._sizes: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._spill_dir: Optional[Path] = None
+        self._finalizer = None
+        self._num_spilled = 0
+        if spill_dir is not None:
+            Path(spill_dir).mkdir(parents=True, exist_ok=True)
+            self._spill_dir = Path(tempfile.mkdtemp(prefix="mps_motion_", dir=spill_dir))
+            self._finalizer = weakref.finalize(self, shutil.rmtree, self._spill_dir, True)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(list(self._data))
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self._data[key]
+        self._data.move_to_end(key)
+        self._sizes.move_to_end(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        self._data[key] = value
+        self._sizes[key] = nbytes(value)
+        self._data.move_to_end(key)
+        self._sizes.move_to_end(key)
+        self._evict()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(num_items={len(self)}, nbytes={self.nbytes}, max_bytes={self.max_bytes})"
+
+    @property
+    def nbytes(self) -> int:
+        """Number of bytes held in memory by the cache"""
+        return sum(self._sizes.values())
+
+    @property
+    def spill_dir(self) -> Optional[Path]:
+        return self._spill_dir
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        if key not in self:
+            return default
+        return self[key]
+
+    def get_or_compute(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        """Return the value stored for `key`, or compute it
+        with `func` and store it if it is not in the cache"""
+        if key in self:
+            return self[key]
+        value = func()
+        self[key] = value
+        return value
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        self._sizes.pop(key, None)
+        value = self._data.pop(key, default)
+        if isinstance(value, np.memmap) and self._spill_dir is not None:
+            path = Path(value.filename)
+            if path.parent == self._spill_dir:
+                path.unlink(missing_ok=True)
+        return value
+
+    def pop_prefix(self, prefix: Hashable) -> None:
+        """Remove all values with a tuple key starting with `prefix`"""
+        for key in self:
+            if isinstance(key, tuple) and key[:1] == (prefix,):
+                self.pop(key)
+
+    def clear(self) -> None:
+        for key in self:
+            self.pop(key)
+
+    def _evict(self) -> None:
+        if self.max_bytes is None:
+            return
+        # Never evict the most recently used value
+        for key in list(self._sizes)[:-1]:
+            if self.nbytes <= self.max_bytes:
+                break
+            if self._sizes[key] == 0:
+                continue
+            value = self._data[key]
+            if self._spill_dir is not None and isinstance(value, np.ndarray):
+                self._data[key] = self._spill(value)
+                self._sizes[key] = 0
+            else:
+                logger.debug(f"Evict {key} from cache")
+                self.pop(key)
+
+    def _spill(self, value: np.ndarray) -> np.memmap:
+        assert self._spill_dir is not None
+        self._num_spilled += 1
+        path = self._spill_dir / f"field_{self._num_spilled}.npy"
+        logger.debug(f"Spill array of {value.nbytes} bytes to {path}")
+        np.save(path, value)
+        return np.load(path, mmap_mode="r")
@@ -2,10 +2,14 @@ __doc__ = """
 Motion tracking of MPS data
 This is software to estimate motion in Brightfield images.
 """
+import concurrent.futures
 import datetime
 import logging
+import multiprocessing
+import os
+import time
 from pathlib import Path
-from typing import Any, Dict, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import ap_features as apf
 import numpy as np
@@ -14,15 +18,23 @@ import matplotlib.patches as patches
 import json
 import mps
 
-from . import Mechanics, OpticalFlow
+from . import Mechanics, OpticalFlow, VectorFrameSequence
+from .execution import ExecutionConfig
 from . import motion_tracking as mt
 from . import utils
 from . import stats
 from . import visu
+from . import pipeline
+from . import profiling
+from . import readers
 from . import scaling
 
 logger = logging.getLogger(__name__)
 
+RECORDING_EXTENSIONS = mps.load.valid_extensions + [".npy"]
+# Name of the file keeping track of analyzed files in a directory
+MANIFEST_NAME = "manifest.json"
+
 
 def print_dict(d: Dict[str, Any], fmt="{:<10}: {}"):
     s = ""
@@ -59,8 +71,10 @@ class JSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, Path):
             return obj.as_posix()
-        elif isinstance(mt.FLOW_ALGORITHMS):
+        elif isinstance(obj, mt.FLOW_ALGORITHMS):
             return str(obj)
+        elif isinstance(obj, (np.ndarray, np.generic)):
+            return obj.tolist()
         # Let the base class default method raise the TypeError
         return json.JSONEncoder.default(self, obj)
 
@@ -170,10 +184,18 @@ def main(  # noqa: C901
     end_y: Optional[int] = None,
     start_t: Optional[float] = None,
     end_t: Optional[float] = None,
-):
+    cache: bool = False,
+    jobs: int = 1,
+    overwrite: bool = False,
+    execution: Optional[ExecutionConfig] = None,
+) -> Optional[int]:
     """
     Estimate motion in stack of images
 
+    The wall time, CPU time, peak memory and throughput of each stage
+    are written to `timings.json` next to `settings.json`, see
+    :mod:`mps_motion.profiling`.
+
     Parameters
     ----------
     filename : str
@@ -210,8 +232,24 @@ def main(  # noqa: C901
     verbose : bool, optional
         Print more to the console, by default False
     overwrite : bool, optional
-        If `outdir` allready exist an contains the relevant files then set this to false to
-        use that data, by default True
+        If False, reuse the results of the stages of an earlier analysis in `outdir`
+        (reference frame, displacement, traces, features and videos) whose inputs
+        and settings are unchanged. If True, recompute everything, by default False
+    cache : bool, optional
+        If True, keep the decoded frames in a chunked HDF5 file next to the recording
+        so that the selection can be read without decoding the whole file again,
+        by default False
+    jobs : int, optional
+        Number of files analyzed in parallel when `filename` is a directory,
+        see :func:`analyze_directory`, by default 1
+    execution : Optional[ExecutionConfig], optional
+        Configuration of the parallel execution and the resources used,
+        by default None which uses the default configuration
+
+    Returns
+    -------
+    Optional[int]
+        Number of analyzed frames, or None if `filename` is not a recording
 
     Raises
     ------
@@ -231,41 +269,43 @@ def main(  # noqa: C901
 
     filename_ = Path(filename)
     if filename_.is_dir():
-        # Traverse recursively
-        for f in filename_.iterdir():
-            main(
-                filename=f,
-                algorithm=algorithm,
-                reference_frame=reference_frame,
-                estimate_reference_frame=estimate_reference_frame,
-                outdir=outdir,
-                scale=scale,
-                apply_filter=apply_filter,
-                spacing=spacing,
-                compute_xy_components=compute_xy_components,
-                make_displacement_video=make_displacement_video,
-                make_velocity_video=make_velocity_video,
-                verbose=verbose,
-                video_disp_scale=video_disp_scale,
-                video_disp_step=video_disp_step,
-                video_vel_scale=video_vel_scale,
-                video_vel_step=video_vel_step,
-                suppress_error=True,
-                start_x=start_x,
-                end_x=end_x,
-                start_y=start_y,
-                end_y=end_y,
-                start_t=start_t,
-                end_t=end_t,
-            )
+        analyze_directory(
+            filename_,
+            jobs=jobs,
+            outdir=outdir,
+            algorithm=algorithm,
+            reference_frame=reference_frame,
+            estimate_reference_frame=estimate_reference_frame,
+            scale=scale,
+            apply_filter=apply_filter,
+            spacing=spacing,
+            compute_xy_components=compute_xy_components,
+            make_displacement_video=make_displacement_video,
+            make_velocity_video=make_velocity_video,
+            verbose=verbose,
+            video_disp_scale=video_disp_scale,
+            video_disp_step=video_disp_step,
+            video_vel_scale=video_vel_scale,
+            video_vel_step=video_vel_step,
+            start_x=start_x,
+            end_x=end_x,
+            start_y=start_y,
+            end_y=end_y,
+            start_t=start_t,
+            end_t=end_t,
+            cache=cache,
+            overwrite=overwrite,
+            execution=execution,
+        )
+        return None
 
-    if filename_.suffix not in mps.load.valid_extensions + [".npy"]:
-        return
+    if filename_.suffix not in RECORDING_EXTENSIONS:
+        return None
     try:
-        data = mps.MPS(filename_)
+        reader = readers.open_reader(filename_, cache=cache)
     except Exception:
         if suppress_error:
-            return
+            return None
         raise
     logger.info(f"Analyze {filename_.absolute()}")
 
@@ -292,6 +332,7 @@ def main(  # noqa: C901
     logger.debug("\nSettings : \n{}".format(print_dict(settings)))
 
     settings_file = outdir_.joinpath("settings.json")
+    timings_file = outdir_.joinpath("timings.json")
     results_file = outdir_.joinpath("results.csv")
     features_file = outdir_.joinpath("features.csv")
 
@@ -301,133 +342,360 @@ def main(  # noqa: C901
     if not (0 < scale <= 1.0):
         raise ValueError("Scale has to be between 0 and 1.0")
 
-    logger.info(f"Analyze motion in file {filename}...")
-    Nx, Ny, Nt = data.frames.shape
-    original_frame = data.frames[:, :, 0].T
-    start_x = start_x or 0
-    end_x = end_x or Nx
-    start_y = start_y or 0
-    end_y = end_y or Ny
-
-    def find_time_index(t_star, default):
-        index = default
-        if t_star is None:
-            return index
-        try:
-            index = next(i for i, t in enumerate(data.time_stamps) if t >= t_star)
-        except StopIteration:
-            pass
-        return index
-
-    t0 = find_time_index(start_t, default=0)
-    t1 = find_time_index(end_t, default=Nt)
-
-    data = utils.MPSData(
-        frames=data.frames[start_x:end_x, start_y:end_y, t0:t1],
-        time_stamps=data.time_stamps[t0:t1],
-        info=data.info,
-        metadata=data.metadata,
-    )
+    if execution is None:
+        execution = ExecutionConfig()
+
+    with execution, profiling.Profiler() as profiler:
+        logger.info(f"Analyze motion in file {filename}...")
+        Nx, Ny, Nt = reader.shape
+        with profiling.stage("load"):
+            original_frame = np.asarray(reader.read(t=slice(0, 1)))[:, :, 0].T
+            start_x = start_x or 0
+            end_x = end_x or Nx
+            start_y = start_y or 0
+            end_y = end_y or Ny
+
+            # Only the selection is read from the file
+            data = readers.load_data(
+                reader,
+                start_x=start_x,
+                end_x=end_x,
+                start_y=start_y,
+                end_y=end_y,
+                start_t=start_t,
+                end_t=end_t,
+            )
 
-    if scale < 1.0:
-        data = scaling.resize_data(data, scale=scale)
+            if scale < 1.0:
+                data = scaling.resize_data(data, scale=scale)
 
-    opt_flow = OpticalFlow(
-        data,
-        flow_algorithm=algorithm,
-    )
+        opt_flow = OpticalFlow(
+            data,
+            flow_algorithm=algorithm,
+            execution=execution,
+        )
+        checkpoints = pipeline.Checkpoints(outdir_, overwrite=overwrite)
+
+        def estimate_reference():
+            if not estimate_reference_frame:
+                return reference_frame
+            logger.info("Estimating reference frame")
+            v = opt_flow.get_velocities(spacing=5)
+            v_norm = v.norm().mean().compute()
+            reference_frame_index = mt.estimate_referece_image_from_velocity(
+                t=data.time_stamps[:-5],
+                v=v_norm,
+            )
+            reference_time = float(data.time_stamps[reference_frame_index])
+            logger.info(
+                f"Found reference frame at index {reference_frame_index} and time {reference_time:.2f}",
+            )
+            return reference_time
+
+        reference_file = checkpoints.path("reference.json")
+        reference_frame = checkpoints.run(
+            "reference",
+            inputs={
+                "file": readers.file_stamp(filename_),
+                "selection": [start_x, end_x, start_y, end_y, start_t, end_t],
+                "scale": scale,
+                "algorithm": algorithm,
+                "reference_frame": reference_frame,
+                "estimate_reference_frame": estimate_reference_frame,
+            },
+            compute=estimate_reference,
+            save=lambda ref: reference_file.write_text(json.dumps({"reference_frame": ref})),
+            load=lambda: pipeline.load_json(reference_file)["reference_frame"],
+        )
 
-    if estimate_reference_frame:
-        logger.info("Estimating reference frame")
-        v = opt_flow.get_velocities(spacing=5)
-        v_norm = v.norm().mean().compute()
-        reference_frame_index = mt.estimate_referece_image_from_velocity(
-            t=data.time_stamps[:-5],
-            v=v_norm,
+        displacement_file = checkpoints.path("displacement.npy")
+        u = checkpoints.run(
+            "displacement",
+            inputs={},
+            compute=lambda: opt_flow.get_displacements(reference_frame=reference_frame),
+            save=lambda u: u.save(displacement_file),
+            load=lambda: VectorFrameSequence.from_file(displacement_file),
+            upstream=["reference"],
         )
-        reference_frame = data.time_stamps[reference_frame_index]
-        logger.info(
-            f"Found reference frame at index {reference_frame_index} and time {reference_frame:.2f}",
+        factor = 1000.0 if data.info["time_unit"] == "ms" else 1.0
+
+        def velocity():
+            return Mechanics(u, t=data.time_stamps / factor, execution=execution).velocity(spacing=spacing)
+
+        def compute_traces():
+            v = velocity()
+            traces = {"time": data.time_stamps}
+            if apply_filter:
+                logger.info("Apply filter")
+                u_norm_max = u.norm().max().compute()
+                traces["mask"] = mask = u_norm_max < u_norm_max.mean()
+                v.apply_mask(mask)
+                u.apply_mask(mask)
+
+            logger.info("Compute displacement norm")
+            traces["u_original"] = u.norm().mean().compute()
+            logger.info("Compute velocity norm")
+            traces["v_original"] = v.norm().mean().compute()
+
+            if compute_xy_components:
+                logger.info("Compute displacement x component")
+                traces["u_x"] = u.x.mean().compute()
+                logger.info("Compute displacement y component")
+                traces["u_y"] = u.y.mean().compute()
+                logger.info("Compute velocity x component")
+                traces["v_x"] = v.x.mean().compute()
+                logger.info("Compute velocity y component")
+                traces["v_y"] = v.y.mean().compute()
+            return traces
+
+        traces_file = checkpoints.path("traces.npz")
+        results = checkpoints.run(
+            "traces",
+            inputs={
+                "spacing": spacing,
+                "apply_filter": apply_filter,
+                "compute_xy_components": compute_xy_components,
+            },
+            compute=compute_traces,
+            save=lambda traces: np.savez(traces_file, **traces),
+            load=lambda: dict(np.load(traces_file)),
+            upstream=["displacement"],
         )
+        mask = results.pop("mask", None)
+        if mask is not None:
+            # Applying the same mask again does not change anything
+            u.apply_mask(mask)
+
+        def compute_analysis():
+            logger.info("Compute average")
+            u_data, intervals = analyze_motion_array(
+                y=results["u_original"],
+                t=data.time_stamps,
+            )
+            v_data, _ = analyze_motion_array(
+                y=results["v_original"],
+                t=data.time_stamps[:-spacing],
+                intervals=intervals,
+            )
+            averages = {}
+            for key in ["corrected", "average_trace", "average_time"]:
+                averages[f"u_{key}"] = u_data[key]
+                averages[f"v_{key}"] = v_data[key]
+
+            logger.info("Compute features")
+            features = stats.compute_features(
+                u=results["u_original"],
+                v=results["v_original"],
+                t=data.time_stamps,
+            )
+            return {"averages": averages, "features": features}
+
+        analysis_file = checkpoints.path("analysis.json")
+        analysis = checkpoints.run(
+            "analysis",
+            inputs={},
+            compute=compute_analysis,
+            save=lambda analysis: analysis_file.write_text(json.dumps(analysis, cls=JSONEncoder)),
+            load=lambda: pipeline.load_json(analysis_file),
+            upstream=["traces"],
+        )
+        results.update(analysis["averages"])
+        features = analysis["features"]
+
+        outdir_.mkdir(exist_ok=True, parents=True)
+        with profiling.stage("plots"):
+            plot_selection(
+                fname=outdir_ / "selection.png",
+                frame=original_frame,
+                start_x=start_x,
+                start_y=start_y,
+                end_x=end_x,
+                end_y=end_y,
+            )
+            plot_traces(results=results, outdir=outdir_, time_unit=data.info["time_unit"])
+
+        settings_file.write_text(json.dumps(settings, cls=JSONEncoder, indent=2))
+
+        mps.utils.to_csv(results, results_file)
+        mps.utils.to_csv(features, features_file)
+
+        if make_displacement_video:
+            displacement_movie = outdir_.joinpath("displacement_movie")
+            checkpoints.run(
+                "displacement_video",
+                inputs={"step": video_disp_step, "vector_scale": video_disp_scale},
+                compute=lambda: visu.quiver_video(
+                    data,
+                    u,
+                    displacement_movie,
+                    step=video_disp_step,
+                    vector_scale=video_disp_scale,
+                ),
+                save=lambda _: None,
+                load=lambda: pipeline.require_file(displacement_movie.with_suffix(".mp4")),
+                upstream=["traces"],
+            )
+
+        if make_velocity_video:
+            velocity_movie = outdir_.joinpath("velocity_movie")
+
+            def velocity_video():
+                v = velocity()
+                if mask is not None:
+                    v.apply_mask(mask)
+                visu.quiver_video(
+                    data,
+                    v,
+                    velocity_movie,
+                    step=video_vel_step,
+                    vector_scale=video_vel_scale,
+                    offset=spacing,
+                )
+
+            checkpoints.run(
+                "velocity_video",
+                inputs={"step": video_vel_step, "vector_scale": video_vel_scale},
+                compute=velocity_video,
+                save=lambda _: None,
+                load=lambda: pipeline.require_file(velocity_movie.with_suffix(".mp4")),
+                upstream=["traces"],
+            )
+
+    profiler.save(timings_file)
+    logger.debug(f"\nTimings : \n{profiler.summary()}")
+    return data.num_frames
 
-    u = opt_flow.get_displacements(reference_frame=reference_frame)
-    factor = 1000.0 if data.info["time_unit"] == "ms" else 1.0
-    v = Mechanics(u, t=data.time_stamps / factor).velocity(spacing=spacing)
-    if apply_filter:
-        logger.info("Apply filter")
-        u_norm_max = u.norm().max().compute()
-        mask = u_norm_max < u_norm_max.mean()
-        v.apply_mask(mask)
-        u.apply_mask(mask)
-
-    results = {"time": data.time_stamps}
-    logger.info("Compute displacement norm")
-    results["u_original"] = u.norm().mean().compute()
-    logger.info("Compute velocity norm")
-    results["v_original"] = v.norm().mean().compute()
-
-    if compute_xy_components:
-        logger.info("Compute displacement x component")
-        results["u_x"] = u.x.mean().compute()
-        logger.info("Compute displacement y component")
-        results["u_y"] = u.y.mean().compute()
-        logger.info("Compute velocity x component")
-        results["v_x"] = v.x.mean().compute()
-        logger.info("Compute velocity y component")
-        results["v_y"] = v.y.mean().compute()
-
-    logger.info("Compute average")
-    u_data, intervals = analyze_motion_array(
-        y=results["u_original"],
-        t=data.time_stamps,
-    )
-    v_data, _ = analyze_motion_array(
-        y=results["v_original"],
-        t=data.time_stamps[:-spacing],
-        intervals=intervals,
-    )
-    for key in ["corrected", "average_trace", "average_time"]:
-        results[f"u_{key}"] = u_data[key]
-        results[f"v_{key}"] = v_data[key]
-
-    outdir_.mkdir(exist_ok=True, parents=True)
-    plot_selection(
-        fname=outdir_ / "selection.png",
-        frame=original_frame,
-        start_x=start_x,
-        start_y=start_y,
-        end_x=end_x,
-        end_y=end_y,
-    )
-    plot_traces(results=results, outdir=outdir_, time_unit=data.info["time_unit"])
 
-    logger.info("Compute features")
-    features = stats.compute_features(
-        u=results["u_original"],
-        v=results["v_original"],
-        t=data.time_stamps,
+def find_recordings(path: Path) -> List[Path]:
+    """Find all recordings in `path` and its subdirectories. Files in
+    output directories from earlier runs (i.e directories containing
+    a `settings.json` file) are skipped."""
+    return sorted(
+        f
+        for f in path.rglob("*")
+        if f.is_file() and f.suffix in RECORDING_EXTENSIONS and not f.parent.joinpath("settings.json").is_file()
     )
 
-    settings_file.write_text(json.dumps(settings, cls=JSONEncoder, indent=2))
 
-    mps.utils.to_csv(results, results_file)
-    mps.utils.to_csv(features, features_file)
+def load_manifest(path: Path) -> Dict[str, Dict[str, Any]]:
+    if path.is_file():
+        return json.loads(path.read_text())
+    return {"completed": {}, "failed": {}}
 
-    if make_displacement_video:
-        visu.quiver_video(
-            data,
-            u,
-            outdir_.joinpath("displacement_movie"),
-            step=video_disp_step,
-            vector_scale=video_disp_scale,
-        )
 
-    if make_velocity_video:
-        visu.quiver_video(
-            data,
-            v,
-            outdir_.joinpath("velocity_movie"),
-            step=video_vel_step,
-            vector_scale=video_vel_scale,
-            offset=spacing,
+def save_manifest(path: Path, manifest: Dict[str, Dict[str, Any]]) -> None:
+    path.parent.mkdir(exist_ok=True, parents=True)
+    # Write to a temporary file first so that an interrupted
+    # run never leaves a broken manifest behind
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(manifest, cls=JSONEncoder, indent=2))
+    os.replace(tmp_path, path)
+
+
+def _analyze_file(kwargs: Dict[str, Any]) -> Tuple[Optional[int], float]:
+    t0 = time.perf_counter()
+    num_frames = main(**kwargs)
+    return num_frames, time.perf_counter() - t0
+
+
+def analyze_directory(
+    path: Path,
+    jobs: int = 1,
+    outdir: Optional[str] = None,
+    **kwargs,
+) -> Dict[str, Dict[str, Any]]:
+    """Analyze all recordings in a directory.
+
+    The files are analyzed in `jobs` processes, with the cores shared
+    between the processes. Completed and failed files are recorded in
+    the manifest file `manifest.json` in the output directory, and files
+    that are completed (and still have their results) are skipped when
+    the directory is analyzed again.
+
+    Parameters
+    ----------
+    path : Path
+        The directory
+    jobs : int, optional
+        Number of files analyzed in parallel, by default 1
+    outdir : Optional[str], optional
+        Directory where to store the results. The results for each file
+        are stored in a subfolder with the same relative path as the file.
+        If not provided, the results are stored next to each file, see :func:`main`
+    kwargs : dict
+        Other arguments passed to :func:`main`
+
+    Returns
+    -------
+    Dict[str, Dict[str, Any]]
+        The manifest
+    """
+    root = Path(outdir) if outdir is not None else path
+    manifest_file = root.joinpath(MANIFEST_NAME)
+    manifest = load_manifest(manifest_file)
+
+    def file_outdir(f: Path) -> Path:
+        if outdir is None:
+            return f.with_suffix("").joinpath("motion")
+        return root.joinpath(f.relative_to(path).with_suffix(""))
+
+    todo = []
+    for f in find_recordings(path):
+        key = f.relative_to(path).as_posix()
+        if key in manifest["completed"] and file_outdir(f).joinpath("results.csv").is_file():
+            logger.debug(f"Skip {f} which is already analyzed")
+            continue
+        todo.append(dict(kwargs, filename=f, outdir=file_outdir(f).as_posix(), suppress_error=False))
+    logger.info(f"Analyze {len(todo)} files in {path} using {jobs} job(s)")
+
+    num_done = 0
+    num_frames = 0
+    t0 = time.perf_counter()
+
+    def record(job: Dict[str, Any], result=None, error=None) -> None:
+        nonlocal num_done, num_frames
+        key = Path(job["filename"]).relative_to(path).as_posix()
+        if error is None:
+            frames, seconds = result
+            manifest["completed"][key] = {"num_frames": frames, "seconds": seconds}
+            manifest["failed"].pop(key, None)
+            num_frames += frames or 0
+        else:
+            logger.error(f"Failed to analyze {job['filename']}: {error}")
+            manifest["failed"][key] = repr(error)
+        save_manifest(manifest_file, manifest)
+
+        num_done += 1
+        elapsed = time.perf_counter() - t0
+        logger.info(
+            f"{num_done}/{len(todo)} files done "
+            f"({num_done / elapsed:.2f} files/s, {num_frames / elapsed:.1f} frames/s)",
         )
+
+    if jobs <= 1:
+        for job in todo:
+            try:
+                result = _analyze_file(job)
+            except Exception as e:
+                record(job, error=e)
+            else:
+                record(job, result=result)
+        return manifest
+
+    # Share the cores between the processes to avoid oversubscription
+    threads_per_job = max((os.cpu_count() or 1) // jobs, 1)
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=utils.limit_threads,
+        initargs=(threads_per_job,),
+    ) as executor:
+        futures = {executor.submit(_analyze_file, job): job for job in todo}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                record(futures[future], error=e)
+            else:
+                record(futures[future], result=result)
+    return manifest
@@ -17,6 +17,8 @@ import dask.array as da
 import numpy as np
 from dask.diagnostics import ProgressBar
 
+from . import execution
+from . import profiling
 from . import utils
 
 
@@ -113,14 +115,19 @@ def get_displacements(
         logger.warning(f"Unknown arguments {kwargs!r} - ignoring")
     logger.info("Get displacements using Dual TV-L 1")
 
+    # Convert once here instead of once per frame inside each task
+    frames, reference_image = utils.frames_to_uint8(frames, reference_image)
+
     all_flows = []
     for im in np.rollaxis(frames, 2):
         all_flows.append(
             dask.delayed(flow)(im, reference_image, tau, lmbda, theta, nscales, warps),
         )
 
-    with ProgressBar(out=utils.LoggerWrapper(logger, logging.INFO)):
-        arr = da.compute(all_flows)
+    with profiling.stage("dualtvl1", num_frames=frames.shape[-1]), ProgressBar(
+        out=utils.LoggerWrapper(logger, logging.INFO),
+    ):
+        arr = execution.compute(all_flows)
     flows = np.stack(*arr, axis=2)  # type:ignore
 
     logger.info("Done running Dual TV-L 1 algorithm")
@@ -0,0 +1,215 @@
+"""Control over the parallel execution and the resources used.
+
+All parallel computations in this package (the dask computations as
+well as the process pools) are configured by the active
+:class:`ExecutionConfig`, which is activated by using it as a
+context manager::
+
+    with ExecutionConfig(scheduler="threads", num_workers=4, memory_limit="8GB"):
+        u = opt_flow.get_displacements()
+
+It can also be passed to :class:`OpticalFlow` and :class:`Mechanics`,
+which activate it when computing.
+"""
+import concurrent.futures
+import contextlib
+import logging
+import os
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any
+from typing import Callable
+from typing import ContextManager
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import TYPE_CHECKING
+from typing import Union
+
+if TYPE_CHECKING:
+    import dask.array as da
+
+# dask is imported when it is needed, so that the command line
+# interface can use this module without importing dask
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler(str, Enum):
+    threads = "threads"
+    processes = "processes"
+    synchronous = "synchronous"
+
+
+class SerialExecutor(concurrent.futures.Executor):
+    """Executor running the tasks in the calling thread"""
+
+    def submit(self, fn: Callable, /, *args, **kwargs) -> concurrent.futures.Future:
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+@dataclass(frozen=True)
+class ExecutionConfig:
+    """Execution configuration
+
+    Parameters
+    ----------
+    scheduler : Optional[Scheduler], optional
+        Scheduler used for all parallel computations. By default None,
+        in which case the dask computations use threads and the
+        algorithms holding the GIL (block matching and the radial basis
+        function interpolation) use processes.
+    num_workers : Optional[int], optional
+        Number of threads or processes, by default the number of cores
+    threads_per_worker : Optional[int], optional
+        Number of threads used inside each worker by OpenCV, numba
+        and BLAS, by default no limit
+    chunk_size : Optional[int], optional
+        Number of frames in each chunk of the lazy arrays, by default
+        None which uses dask's automatic chunking or the chunk size
+        derived from `memory_limit`
+    memory_limit : Optional[Union[int, str]], optional
+        Approximate memory budget in bytes, e.g 4e9 or "4GB". It limits
+        the size of the caches and of the chunks, by default no limit
+    """
+
+    scheduler: Optional[Scheduler] = None
+    num_workers: Optional[int] = None
+    threads_per_worker: Optional[int] = None
+    chunk_size: Optional[int] = None
+    memory_limit: Optional[Union[int, str]] = None
+
+    def __post_init__(self) -> None:
+        # The dataclass is frozen, so set the converted values directly
+        if self.scheduler is not None:
+            object.__setattr__(self, "scheduler", Scheduler(self.scheduler))
+        if isinstance(self.memory_limit, str):
+            from dask.utils import parse_bytes
+
+            object.__setattr__(self, "memory_limit", parse_bytes(self.memory_limit))
+        elif self.memory_limit is not None:
+            object.__setattr__(self, "memory_limit", int(self.memory_limit))
+
+    def __enter__(self) -> "ExecutionConfig":
+        import dask
+
+        dask_config = dask.config.set(**self.dask_kwargs())
+        old_threads = None
+        if self.threads_per_worker is not None:
+            import cv2
+
+            old_threads = cv2.getNumThreads()
+            cv2.setNumThreads(self.threads_per_worker)
+        _active.append((self, dask_config, old_threads))
+        return self
+
+    def __exit__(self, *args) -> None:
+        _, dask_config, old_threads = _active.pop()
+        dask_config.__exit__(*args)
+        if old_threads is not None:
+            import cv2
+
+            cv2.setNumThreads(old_threads)
+
+    def dask_kwargs(self) -> Dict[str, Any]:
+        """Keyword arguments for `dask.compute` and `dask.config.set`"""
+        kwargs: Dict[str, Any] = {}
+        if self.scheduler is not None:
+            kwargs["scheduler"] = self.scheduler.value
+        if self.num_workers is not None:
+            kwargs["num_workers"] = self.num_workers
+        return kwargs
+
+    @property
+    def cache_bytes(self) -> Optional[int]:
+        """Memory budget for the caches, which is half of the memory limit"""
+        if self.memory_limit is None:
+            return None
+        return int(self.memory_limit) // 2
+
+    def frames_per_chunk(self, frame_bytes: int) -> Optional[int]:
+        """Number of frames in each chunk, given the number of bytes
+        in one frame. If only the memory limit is given, the chunks
+        are chosen such that all workers together use at most a
+        quarter of the memory limit for their chunks."""
+        if self.chunk_size is not None:
+            return self.chunk_size
+        if self.memory_limit is None:
+            return None
+        num_workers = self.num_workers or os.cpu_count() or 1
+        return max(int(self.memory_limit) // (4 * num_workers * max(frame_bytes, 1)), 1)
+
+    def rechunk(self, array: "da.Array", axis: int = 2) -> "da.Array":
+        """Rechunk `array` along the time axis according to the chunk size"""
+        frame_bytes = array.nbytes // max(array.shape[axis], 1)
+        frames_per_chunk = self.frames_per_chunk(frame_bytes)
+        if frames_per_chunk is None:
+            return array
+        chunks = {i: -1 for i in range(array.ndim)}
+        chunks[axis] = frames_per_chunk
+        return array.rechunk(chunks)
+
+    def executor(self, scheduler: Scheduler = Scheduler.processes) -> concurrent.futures.Executor:
+        """Executor used for the computations that are not done by dask
+
+        Parameters
+        ----------
+        scheduler : Scheduler, optional
+            Scheduler to use if none is configured, by default processes
+
+        Returns
+        -------
+        concurrent.futures.Executor
+            The executor
+        """
+        scheduler = Scheduler(self.scheduler or scheduler)
+        if scheduler == Scheduler.synchronous:
+            return SerialExecutor()
+        if scheduler == Scheduler.threads:
+            return concurrent.futures.ThreadPoolExecutor(max_workers=self.num_workers)
+        if self.threads_per_worker is None:
+            return concurrent.futures.ProcessPoolExecutor(max_workers=self.num_workers)
+        from . import utils
+
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            initializer=utils.limit_threads,
+            initargs=(self.threads_per_worker,),
+        )
+
+
+DEFAULT_CONFIG = ExecutionConfig()
+_active: List[Any] = []
+
+
+def get_config() -> ExecutionConfig:
+    """The active execution configuration"""
+    if _active:
+        return _active[-1][0]
+    return DEFAULT_CONFIG
+
+
+def activate(config: Optional[ExecutionConfig]) -> ContextManager:
+    """Context activating `config`, or keeping the
+    active configuration if `config` is None"""
+    if config is None:
+        return contextlib.nullcontext()
+    return config
+
+
+def compute(*args, **kwargs):
+    """Same as `dask.compute` using the active execution configuration"""
+    import dask
+
+    return dask.compute(*args, **get_config().dask_kwargs(), **kwargs)
+
+
+def executor(scheduler: Scheduler = Scheduler.processes) -> concurrent.futures.Executor:
+    """Executor from the active execution configuration,
+    see :meth:`ExecutionConfig.executor`"""
+    return get_config().executor(scheduler)
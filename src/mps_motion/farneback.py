@@ -12,6 +12,8 @@ import dask.array as da
 import numpy as np
 from dask.diagnostics import ProgressBar
 
+from . import execution
+from . import profiling
 from . import utils
 
 logger = logging.getLogger(__name__)
@@ -174,6 +176,9 @@ def get_displacements(
         logger.warning(f"Unknown arguments {kwargs!r} - ignoring")
     logger.info("Get displacements using Farneback's algorithm")
 
+    # Convert once here instead of once per frame inside each task
+    frames, reference_image = utils.frames_to_uint8(frames, reference_image)
+
     all_flows = []
     for im in np.rollaxis(frames, 2):
         all_flows.append(
@@ -190,8 +195,10 @@ def get_displacements(
             ),
         )
 
-    with ProgressBar(out=utils.LoggerWrapper(logger, logging.INFO)):
-        arr = da.compute(all_flows)
+    with profiling.stage("farneback", num_frames=frames.shape[-1]), ProgressBar(
+        out=utils.LoggerWrapper(logger, logging.INFO),
+    ):
+        arr = execution.compute(all_flows)
     flows = np.stack(*arr, axis=2)  # type:ignore
 
     logger.info("Done running Farneback's algorithm")
@@ -263,6 +270,8 @@ def get_velocities(
 
     logger.info("Get velocities using Farneback's algorithm")
     dts = np.subtract(time_stamps[spacing:], time_stamps[:-spacing])
+    if frames.dtype != np.uint8:
+        frames = utils.to_uint8(frames)
     all_flows = []
     for index in range(frames.shape[-1] - spacing):
         all_flows.append(
@@ -280,8 +289,10 @@ def get_velocities(
             ),
         )
 
-    with ProgressBar(out=utils.LoggerWrapper(logger, logging.INFO)):
-        arr = da.compute(all_flows)
+    with profiling.stage("farneback_velocities", num_frames=frames.shape[-1]), ProgressBar(
+        out=utils.LoggerWrapper(logger, logging.INFO),
+    ):
+        arr = execution.compute(all_flows)
 
     flows = np.stack(*arr, axis=2)  # type:ignore
 
@@ -1,79 +1,111 @@
 import logging
-from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
+from typing import Any
+from typing import Dict
 from typing import List
 from typing import Optional
 
-import dask
+import cv2
 import dask.array as da
 import dask_image.ndfilters
 import numpy as np
-import tqdm
-from dask.diagnostics import ProgressBar
-from scipy.interpolate import bisplev
-from scipy.interpolate import bisplrep
+from scipy import ndimage
+from scipy import signal
+from scipy.interpolate import BSpline
 from typing_extensions import Protocol
 
+from . import profiling
 from . import utils
 
 logger = logging.getLogger(__name__)
 
 
-def spline_smooth_u(args):
-    ux, uy, X, Y = args
+def spline_smoothing_matrix(
+    n: int,
+    num_segments: Optional[int] = None,
+    smoothing: float = 1.0,
+    degree: int = 3,
+) -> np.ndarray:
+    """Smoothing operator of a penalized B-spline (P-spline)
+    fitted to `n` equally spaced points.
 
-    N = min(ux.shape) // 10
+    The spline uses uniform knots and a penalty on the second
+    differences of the coefficients, so that the smoother
+    reproduces linear functions exactly.
 
-    x = X.flatten()[::N]
-    y = Y.flatten()[::N]
-    valuesx = ux.flatten()[::N]
-    valuesy = uy.flatten()[::N]
-
-    sx = X.shape[1] - np.sqrt(2 * X.shape[1])
-    sy = X.shape[0] - np.sqrt(2 * X.shape[0])
-
-    tckx = bisplrep(x, y, valuesx, kx=5, ky=5, s=sx)
-    Ux = bisplev(X[:, 0], Y[0, :], tckx)
-    tcky = bisplrep(x, y, valuesy, kx=5, ky=5, s=sy)
-    Uy = bisplev(X[:, 0], Y[0, :], tcky)
-
-    return [Ux, Uy]
-
-
-def process_spline_interpolation(u):
-    x = np.arange(u.shape[0])
-    y = np.arange(u.shape[1])
-    Y, X = np.meshgrid(y, x)
-
-    Us = []
-
-    args = ((u[:, :, i, 0], u[:, :, i, 1], X, Y) for i in range(u.shape[2]))
-
-    with ProcessPoolExecutor() as executor:
-        for ui in tqdm.tqdm(
-            executor.map(spline_smooth_u, args),
-            desc="Running spline interpolation",
-            total=u.shape[2],
-        ):
-            Us.append(ui)
+    Parameters
+    ----------
+    n : int
+        Number of points
+    num_segments : Optional[int], optional
+        Number of knot intervals, by default None meaning
+        one interval for every ten points
+    smoothing : float, optional
+        Weight of the penalty, by default 1.0. Larger values
+        give smoother results
+    degree : int, optional
+        Degree of the spline, by default 3
 
-    return Us
+    Returns
+    -------
+    np.ndarray
+        Matrix S of shape (n, n) such that ``S @ y`` is the
+        smoothed version of ``y``
+    """
+    if num_segments is None:
+        num_segments = max(n // 10, 1)
+    x = np.arange(n, dtype=float)
+    h = max(n - 1, 1) / num_segments
+    knots = h * np.arange(-degree, num_segments + degree + 1)
+    B = BSpline.design_matrix(x, knots, degree).toarray()
+    D = np.diff(np.eye(B.shape[1]), n=2, axis=0)
+    return B @ np.linalg.solve(B.T @ B + smoothing * D.T @ D, B.T)
+
+
+def _spline_smooth_block(block: np.ndarray, S0: np.ndarray, S1: np.ndarray) -> np.ndarray:
+    block = np.tensordot(S0, block, axes=(1, 0))
+    return np.moveaxis(np.tensordot(S1, block, axes=(1, 1)), 0, 1)
+
+
+def spline_smooth(
+    u: utils.Array,
+    num_segments: Optional[int] = None,
+    smoothing: float = 1.0,
+    degree: int = 3,
+) -> utils.Array:
+    """Smooth each frame with a separable penalized B-spline, see
+    :func:`spline_smoothing_matrix`. The smoothing is applied as
+    one matrix product along each spatial axis for all frames at once.
 
+    Parameters
+    ----------
+    u : utils.Array
+        Array of shape (N, M, ...), e.g (N, M, T, 2) for vectors
+    num_segments : Optional[int], optional
+        Number of knot intervals along each axis, by default None
+        meaning one interval for every ten pixels
+    smoothing : float, optional
+        Weight of the penalty, by default 1.0
+    degree : int, optional
+        Degree of the spline, by default 3
 
-def spline_smooth(u: utils.Array) -> np.ndarray:
+    Returns
+    -------
+    utils.Array
+        The smoothed array of same type and shape as `u`
+    """
+    logger.info("Performing spline smoothing")
+    S0 = spline_smoothing_matrix(u.shape[0], num_segments, smoothing, degree)
+    S1 = spline_smoothing_matrix(u.shape[1], num_segments, smoothing, degree)
     if isinstance(u, da.Array):
-        u = u.compute()
-
-    logger.info("Performing spline interpolation, this may take some time...")
-    Us = process_spline_interpolation(u)
-
-    new_u = np.zeros(u.shape)
-
-    for i, ui in enumerate(Us):
-        new_u[:, :, i, 0] = ui[0]
-        new_u[:, :, i, 1] = ui[1]
-
-    return new_u
+        return u.rechunk({0: -1, 1: -1}).map_blocks(
+            _spline_smooth_block,
+            S0=S0,
+            S1=S1,
+            dtype=float,
+        )
+    with profiling.stage("spline_smooth", num_frames=u.shape[2] if u.ndim > 2 else None):
+        return _spline_smooth_block(u, S0, S1)
 
 
 class Filters(str, Enum):
@@ -113,42 +145,111 @@ def filter_vectors(
     return vectors
 
 
+def _filter_depth(
+    filter_type: Filters,
+    size: Optional[int] = None,
+    sigma: Optional[float] = None,
+) -> int:
+    """Number of neighboring pixels needed to filter one pixel"""
+    if filter_type == Filters.median:
+        return int(size) // 2  # type: ignore
+    # Same radius as scipy.ndimage.gaussian_filter
+    return int(4.0 * float(sigma) + 0.5)  # type: ignore
+
+
+def _filter_vectors_block(
+    block: np.ndarray,
+    filter_type: Filters,
+    size: Optional[int] = None,
+    sigma: Optional[float] = None,
+) -> np.ndarray:
+    """Filter each frame and component in a block of shape
+    (N, M, T, 2), using reflecting boundaries"""
+    shape = block.shape
+    if filter_type == Filters.median and size == 3 and block.dtype == np.float32:
+        # For a kernel of size 3 OpenCV's replicated border
+        # is the same as reflecting the boundary
+        frames = block.reshape(shape[:2] + (-1,))
+        out = np.empty_like(frames)
+        for i in range(frames.shape[2]):
+            out[:, :, i] = cv2.medianBlur(np.ascontiguousarray(frames[:, :, i]), 3)
+        return out.reshape(shape)
+
+    if filter_type == Filters.gaussian and block.dtype in (np.float32, np.float64):
+        ksize = 2 * _filter_depth(filter_type, sigma=sigma) + 1
+        frames = block.reshape(shape[:2] + (-1,))
+        out = np.empty_like(frames)
+        step = utils.MAX_OPENCV_CHANNELS
+        for i in range(0, frames.shape[2], step):
+            out[:, :, i : i + step] = cv2.GaussianBlur(
+                np.ascontiguousarray(frames[:, :, i : i + step]),
+                (ksize, ksize),
+                sigmaX=sigma,
+                sigmaY=sigma,
+                borderType=cv2.BORDER_REFLECT,
+            ).reshape(shape[:2] + (-1,))
+        return out.reshape(shape)
+
+    footprint = (size, size) + (1,) * (len(shape) - 2)
+    if filter_type == Filters.median:
+        return ndimage.median_filter(block, size=footprint, mode="reflect")
+    return ndimage.gaussian_filter(
+        block,
+        sigma=(sigma, sigma) + (0,) * (len(shape) - 2),
+        mode="reflect",
+    )
+
+
 def filter_vectors_par(
-    vectors,
+    vectors: utils.Array,
     filter_type: Filters,
     size: Optional[int] = None,
     sigma: Optional[float] = None,
-):
+) -> utils.Array:
+    """Filter each frame of a sequence of vectors in space.
+
+    The filter is applied to the whole array in a single pass,
+    where dask arrays are processed lazily chunk by chunk with
+    halos of the size of the filter.
+
+    Parameters
+    ----------
+    vectors : utils.Array
+        Vectors of shape (N, M, T, 2)
+    filter_type : Filters
+        The filter
+    size : Optional[int], optional
+        Size of the median filter, by default None
+    sigma : Optional[float], optional
+        Standard deviation of the gaussian filter, by default None
+
+    Returns
+    -------
+    utils.Array
+        The filtered vectors of the same type as the input
+    """
     if not valid_filter(filter_type=filter_type, size=size, sigma=sigma):
         return vectors
+    filter_type = Filters(filter_type)
+    if not is_positive(size if filter_type == Filters.median else sigma):
+        return vectors
     logger.info("Filter vectors")
     assert len(vectors.shape) == 4
     assert vectors.shape[3] == 2
-    num_frames = vectors.shape[2]
+    kwargs = dict(filter_type=filter_type, size=size, sigma=sigma)
 
-    is_numpy = False
     if isinstance(vectors, np.ndarray):
-        is_numpy = True
-        vectors = da.from_array(vectors)
-
-    all_vectors = []
-    for i in range(num_frames):
-        all_vectors.append(
-            dask.delayed(filter_vectors)(
-                vectors[:, :, i, :],
-                filter_type=filter_type,
-                size=size,
-                sigma=sigma,
-            ),
-        )
-
-    with ProgressBar(out=utils.LoggerWrapper(logger, logging.INFO)):
-        vectors = da.stack(*da.compute(all_vectors), axis=2)
-    if is_numpy:
-        vectors = vectors.compute()
-
-    logger.info("Done filtering")
-    return vectors
+        with profiling.stage("filter_vectors", num_frames=vectors.shape[2]):
+            return _filter_vectors_block(vectors, **kwargs)
+
+    depth = _filter_depth(**kwargs)
+    return vectors.map_overlap(
+        _filter_vectors_block,
+        depth={0: depth, 1: depth, 2: 0, 3: 0},
+        boundary="none",
+        dtype=vectors.dtype,
+        **kwargs,
+    )
 
 
 def valid_filter(
@@ -200,6 +301,101 @@ def apply_filter(
     return array
 
 
+class TemporalFilters(str, Enum):
+    savgol = "savgol"
+    butterworth = "butterworth"
+    median = "median"
+
+
+def _butterworth_sos(order: int = 2, cutoff: float = 0.2) -> np.ndarray:
+    return signal.butter(order, cutoff, output="sos")
+
+
+def _temporal_depth(filter_type: TemporalFilters, options: Dict[str, Any], num_frames: int) -> int:
+    """Number of neighboring time steps needed to filter one time step"""
+    if filter_type == TemporalFilters.savgol:
+        return options.get("window_length", 5) // 2
+    if filter_type == TemporalFilters.median:
+        return options.get("size", 3) // 2
+    # Use the number of steps before the impulse response has settled
+    impulse = np.zeros(max(num_frames, 1))
+    impulse[0] = 1.0
+    h = np.abs(signal.sosfilt(_butterworth_sos(**options), impulse))
+    return int(np.nonzero(h > 1e-6 * h.max())[0][-1]) + 1
+
+
+def _temporal_filter_block(
+    block: np.ndarray,
+    filter_type: TemporalFilters,
+    options: Dict[str, Any],
+) -> np.ndarray:
+    if filter_type == TemporalFilters.savgol:
+        return signal.savgol_filter(
+            block,
+            window_length=options.get("window_length", 5),
+            polyorder=options.get("polyorder", 2),
+            axis=2,
+            mode="interp",
+        )
+    if filter_type == TemporalFilters.butterworth:
+        return signal.sosfiltfilt(_butterworth_sos(**options), block, axis=2)
+
+    size = [1] * block.ndim
+    size[2] = options.get("size", 3)
+    return ndimage.median_filter(block, size=size, mode="reflect")
+
+
+def apply_temporal_filter(
+    array: utils.Array,
+    filter_type: TemporalFilters,
+    options: Optional[Dict[str, Any]] = None,
+) -> utils.Array:
+    """Filter an array along the time axis (axis 2)
+
+    Dask arrays are filtered lazily chunk by chunk, where
+    the chunks share halos along the time axis that are
+    wide enough for the filter.
+
+    Parameters
+    ----------
+    array : utils.Array
+        Array with time along the third axis, e.g (N, M, T) or (N, M, T, 2)
+    filter_type : TemporalFilters
+        The filter. Options for each filter are
+
+        - 'savgol': `window_length` (default 5) and `polyorder` (default 2)
+        - 'butterworth': `order` (default 2) and `cutoff` (default 0.2),
+          the cutoff frequency relative to the Nyquist frequency. The
+          filter is applied forward and backward so there is no phase shift
+        - 'median': `size` (default 3)
+    options : Optional[Dict[str, Any]], optional
+        Options passed to the filter, by default None
+
+    Returns
+    -------
+    utils.Array
+        The filtered array of the same type as the input
+    """
+    filter_type = TemporalFilters(filter_type)
+    options = options or {}
+    logger.info(f"Apply temporal {filter_type.value} filter")
+
+    if isinstance(array, np.ndarray):
+        with profiling.stage("temporal_filter", num_frames=array.shape[2]):
+            return _temporal_filter_block(array, filter_type, options)
+
+    num_frames = array.shape[2]
+    depth = min(_temporal_depth(filter_type, options, num_frames), num_frames - 1)
+    return array.map_overlap(
+        _temporal_filter_block,
+        depth={i: depth if i == 2 else 0 for i in range(array.ndim)},
+        boundary="none",
+        dtype=float,
+        filter_type=filter_type,
+        options=options,
+    )
+
+
 class InvalidThresholdError(ValueError):
     pass
 
@@ -249,13 +445,31 @@ def threshold(
     return array
 
 
-def _handle_threshold_norm(norm_inds, ns, factor, norm_array, array):
-    if norm_inds.any():
-        if ns == da:
-            norm_inds = norm_inds.compute()
-        inds = np.stack([norm_inds, norm_inds], -1).flatten()
-        values = factor / ns.stack([norm_array[norm_inds], norm_array[norm_inds]], -1).flatten()
-        array[inds] *= values
+@utils.jit(nopython=True, cache=True)
+def _clamp_norm(array, vmin, vmax):
+    """Scale the vectors in `array` (in place) so that their
+    norm is within `vmin` and `vmax`. Vectors of zero length
+    are left untouched since they have no direction."""
+    n, m, t = array.shape[:3]
+    for i in range(n):
+        for j in range(m):
+            for k in range(t):
+                x = array[i, j, k, 0]
+                y = array[i, j, k, 1]
+                norm = np.sqrt(x * x + y * y)
+                if norm > vmax:
+                    factor = vmax / norm
+                elif 0 < norm < vmin:
+                    factor = vmin / norm
+                else:
+                    continue
+                array[i, j, k, 0] = factor * x
+                array[i, j, k, 1] = factor * y
+    return array
+
+
+def _threshold_norm_block(block, vmin, vmax):
+    return _clamp_norm(block.copy(), vmin, vmax)
 
 
 class _Linalg(Protocol):
@@ -285,6 +499,9 @@ def threshold_norm(
     you can use this function to scale all vectors so
     that the magnitudes are within `vmin` and `vmax`
 
+    Vectors of zero length have no direction and are
+    therefore left unchanged, also when `vmin` is given.
+
     Parameters
     ----------
     array : utils.Array
@@ -296,7 +513,9 @@ def threshold_norm(
     vmax : Optional[float], optional
         Upper bound on the norm, by default None
     copy : bool, optional
-        Wheter to operate on the input are or use a copy, by default True
+        Whether to operate on the input array or on a copy, by default True.
+        Dask arrays are evaluated lazily block by block and are never
+        modified in place.
 
     Returns
     -------
@@ -307,16 +526,19 @@ def threshold_norm(
     assert array.shape[3] == 2
     assert ns in [da, np]
     check_threshold(vmin, vmax)
+    if vmin is None and vmax is None:
+        return array.copy() if copy else array
+
+    vmin_ = 0.0 if vmin is None else vmin
+    vmax_ = np.inf if vmax is None else vmax
+
+    if isinstance(array, da.Array):
+        # Each block is processed in one pass, and blocks
+        # are never modified in place
+        if array.chunks[3] != (2,):
+            array = array.rechunk({3: 2})
+        return array.map_blocks(_threshold_norm_block, vmin_, vmax_, dtype=array.dtype)
+
     if copy:
         array = array.copy()
-    shape = array.shape
-    norm_array = ns.linalg.norm(array, axis=3).flatten()
-    array = array.flatten()
-
-    if vmax is not None:
-        norm_inds = norm_array > vmax
-        _handle_threshold_norm(norm_inds, ns, vmax, norm_array, array)
-    if vmin is not None:
-        norm_inds = norm_array < vmin
-        _handle_threshold_norm(norm_inds, ns, vmin, norm_array, array)
-    return array.reshape(shape)
+    return _clamp_norm(array, vmin_, vmax_)
@@ -1,7 +1,10 @@
 import logging
 import weakref
 from pathlib import Path
+from typing import Any
+from typing import Dict
 from typing import Optional
+from typing import Tuple
 
 import dask.array as da
 import numpy as np
@@ -19,7 +22,7 @@ except ImportError:
 logger = logging.getLogger(__name__)
 
 
-@utils.jit(nopython=True)
+@utils.jit(nopython=True, cache=True)
 def sum_along_time(arr, t, i, j):
     x = 0
     for k in range(t):
@@ -27,7 +30,7 @@ def sum_along_time(arr, t, i, j):
     return x
 
 
-@utils.jit(nopython=True, parallel=True)
+@utils.jit(nopython=True, parallel=True, cache=True)
 def reduce_sliding_window(arr):
     n, m, t = arr.shape[:3]
     new_arr = np.zeros((n, m))
@@ -39,6 +42,69 @@ def reduce_sliding_window(arr):
     return new_arr
 
 
+def eigvalsh_2x2(array: utils.Array) -> utils.Array:
+    """Eigenvalues of a stack of symmetric 2x2 matrices
+
+    Closed form alternative to :func:`numpy.linalg.eigvalsh`
+    that only uses elementwise operations, and therefore
+    stays lazy when `array` is a dask array. As in
+    :func:`numpy.linalg.eigvalsh` only the lower triangle
+    of each matrix is used.
+
+    Parameters
+    ----------
+    array : utils.Array
+        Array of shape (..., 2, 2)
+
+    Returns
+    -------
+    utils.Array
+        Eigenvalues of shape (..., 2) in ascending order
+    """
+    ns = da if isinstance(array, da.Array) else np
+    a = array[..., 0, 0]
+    b = array[..., 1, 0]
+    c = array[..., 1, 1]
+
+    mean = 0.5 * (a + c)
+    radius = np.hypot(0.5 * (a - c), b)
+    return ns.stack([mean - radius, mean + radius], axis=-1)
+
+
+def eigh_2x2(array: utils.Array) -> Tuple[utils.Array, utils.Array]:
+    """Eigenvalues and eigenvectors of a stack of symmetric
+    2x2 matrices, see :func:`eigvalsh_2x2`.
+
+    Parameters
+    ----------
+    array : utils.Array
+        Array of shape (..., 2, 2)
+
+    Returns
+    -------
+    Tuple[utils.Array, utils.Array]
+        Eigenvalues of shape (..., 2) in ascending order and
+        the corresponding normalized eigenvectors of shape
+        (..., 2, 2), where the column ``v[..., :, i]`` is the
+        eigenvector of the eigenvalue ``w[..., i]``.
+    """
+    ns = da if isinstance(array, da.Array) else np
+    a = array[..., 0, 0]
+    b = array[..., 1, 0]
+    c = array[..., 1, 1]
+
+    # Angle between the first axis and the eigenvector
+    # corresponding to the largest eigenvalue
+    theta = 0.5 * np.arctan2(2 * b, a - c)
+    cos = np.cos(theta)
+    sin = np.sin(theta)
+    vectors = ns.stack(
+        [ns.stack([-sin, cos], axis=-1), ns.stack([cos, sin], axis=-1)],
+        axis=-1,
+    )
+    return eigvalsh_2x2(array), vectors
+
+
 def close_file(h5file):
     if h5file is not None:
         h5file.close()
@@ -57,6 +123,7 @@ class FrameSequence:
         dx: float = 1.0,
         scale: float = 1.0,
         fill_value: float = 0.0,
+        mask: Optional[np.ndarray] = None,
     ):
         """Constructor
 
@@ -75,6 +142,10 @@ class FrameSequence:
         fill_value: float
             Value to fill in for bad values masked arrays if used,
             by default 0.0.
+        mask : np.ndarray, optional
+            Spatial mask of shape (width, height) where True
+            indicates pixels that should be excluded, by default None.
+            See :meth:`FrameSequence.apply_mask`.
 
         """
         assert isinstance(array, (da.core.Array, np.ndarray))
@@ -84,6 +155,9 @@ class FrameSequence:
         self.scale = scale
         self._h5file = None
         self._fill_value = fill_value
+        self._mask: Optional[np.ndarray] = None
+        if mask is not None:
+            self.apply_mask(mask)
         self._finalizer = weakref.finalize(self, close_file, self._h5file)
 
     def __enter__(self):
@@ -105,11 +179,15 @@ class FrameSequence:
             return False
         if self.dx != other.dx:
             return False
+        if (self.mask is None) != (other.mask is None):
+            return False
+        if self.mask is not None and not np.array_equal(self.mask, other.mask):
+            return False
         return self._ns.isclose(self.array, other.array).all()
 
     def _check_other(self, other):
         if isinstance(other, FrameSequence):
-            other = other.array
+            other = other._array
 
         if not isinstance(other, (da.core.Array, np.ndarray)):
             raise TypeError(
@@ -122,24 +200,34 @@ class FrameSequence:
         return other
 
     def __add__(self, other):
+        mask = self._combined_mask(other)
         other = self._check_other(other)
-        return self.__class__(self.array + other, dx=self.dx, scale=self.scale)
+        return self.__class__(self._array + other, dx=self.dx, scale=self.scale, mask=mask)
 
     def __sub__(self, other):
+        mask = self._combined_mask(other)
         other = self._check_other(other)
-        return self.__class__(self.array - other, dx=self.dx, scale=self.scale)
+        return self.__class__(self._array - other, dx=self.dx, scale=self.scale, mask=mask)
 
     def __mul__(self, other):
         if not np.isscalar(other):
             raise TypeError(f"Can only multiply with a scalar value, got {type(other)}")
 
-        return self.__class__(other * self.array, dx=self.dx, scale=self.scale)
+        return self.__class__(other * self._array, dx=self.dx, scale=self.scale, mask=self.mask)
 
     def __rmul__(self, other):
         if not np.isscalar(other):
             raise TypeError(f"Can only multiply with a scalar value, got {type(other)}")
 
-        return self.__class__(other * self.array, dx=self.dx, scale=self.scale)
+        return self.__class__(other * self._array, dx=self.dx, scale=self.scale, mask=self.mask)
+
+    def _combined_mask(self, other) -> Optional[np.ndarray]:
+        other_mask = other.mask if isinstance(other, FrameSequence) else None
+        if self.mask is None:
+            return other_mask
+        if other_mask is None:
+            return self.mask
+        return np.logical_or(self.mask, other_mask)
 
     @property
     def fill_value(self) -> float:
@@ -154,21 +242,50 @@ class FrameSequence:
 
     def filter(
         self,
-        filter_type: filters.Filters = filters.Filters.median,
+        filter_type: Optional[filters.Filters] = filters.Filters.median,
         size: int = 3,
         sigma: float = 1.0,
+        temporal_filter: Optional[filters.TemporalFilters] = None,
+        temporal_options: Optional[Dict[str, Any]] = None,
     ) -> "FrameSequence":
-        """Apply a median filter"""
+        """Apply a median or gaussian filter, optionally followed
+        by a filter along the time axis
 
-        return FrameSequence(
-            array=filters.apply_filter(
-                self._array,
+        Masked pixels are replaced by the fill value before
+        filtering, so that values in masked regions do not leak
+        into neighbouring pixels.
+
+        Parameters
+        ----------
+        filter_type : Optional[filters.Filters], optional
+            The spatial filter, by default median. Pass None to
+            only apply the temporal filter
+        size : int, optional
+            Size of the median filter, by default 3
+        sigma : float, optional
+            Standard deviation of the gaussian filter, by default 1.0
+        temporal_filter : Optional[filters.TemporalFilters], optional
+            Filter along the time axis, by default None
+        temporal_options : Optional[Dict[str, Any]], optional
+            Options to the temporal filter, see
+            :func:`filters.apply_temporal_filter`, by default None
+        """
+        array = self.array
+        if filter_type is not None:
+            array = filters.apply_filter(
+                array,
                 size=size,
                 sigma=sigma,
                 filter_type=filter_type,
-            ),
+            )
+        if temporal_filter is not None:
+            array = filters.apply_temporal_filter(array, temporal_filter, temporal_options)
+
+        return FrameSequence(
+            array=array,
             dx=self.dx,
             scale=self.scale,
+            mask=self.mask,
         )
 
     def save(self, path: utils.PathLike) -> None:
@@ -189,6 +306,8 @@ class FrameSequence:
                 attr_manager = h5py.AttributeManager(dataset)
                 attr_manager.create("scale", str(self.scale))
                 attr_manager.create("dx", str(self.dx))
+                if self.mask is not None:
+                    f.create_dataset("mask", data=self.mask)
         else:
             np.save(
                 path,
@@ -196,6 +315,7 @@ class FrameSequence:
                     "array": self.array_np,
                     "scale": self.scale,
                     "dx": self.dx,
+                    "mask": self.mask,
                 },  # type:ignore
             )
 
@@ -228,6 +348,8 @@ class FrameSequence:
                     )
                     data["dx"] = float(h5file["array"].attrs.get("dx", 1))
                     data["scale"] = float(h5file["array"].attrs.get("scale", 1))
+                if "mask" in h5file:
+                    data["mask"] = h5file["mask"][...]
             except Exception:
                 h5file.close()
         else:
@@ -283,26 +405,85 @@ class FrameSequence:
         return mask
 
     def apply_mask(self, mask: np.ndarray) -> None:
+        """Mask out pixels in the frame sequence.
+
+        The mask is stored as a 2D spatial mask and is only
+        broadcasted over the remaining axes when the data is
+        accessed or reduced, so no array of the same size as
+        the frame sequence is created. Applying a mask to an
+        already masked sequence will combine the two masks.
+
+        Parameters
+        ----------
+        mask : np.ndarray
+            Boolean array of shape (width, height) where
+            True indicates pixels that should be excluded
+
+        Raises
+        ------
+        ValueError
+            If the shape of the mask does not match the spatial
+            shape of the frame sequence
+        """
         logger.debug("Apply mask")
-        self._array = da.ma.masked_array(
-            self.array,
-            np.tile(mask[..., np.newaxis], self.shape[2:]),
-            fill_value=0.0,
-        )
+        # Keep a private, read-only copy since the mask is shared
+        # with all sequences derived from this one
+        mask = np.array(mask, dtype=bool)
+        if mask.shape != self.shape[:2]:
+            raise ValueError(
+                f"Incompatible mask shape, got {mask.shape}, expected {self.shape[:2]}",
+            )
+        if self._mask is not None:
+            mask = np.logical_or(self._mask, mask)
+        mask.setflags(write=False)
+        self._mask = mask
+
+    @property
+    def mask(self) -> Optional[np.ndarray]:
+        """Spatial mask where True indicates pixels that
+        are excluded, or None if no mask is applied"""
+        return self._mask
+
+    def _broadcast_mask(self, ndim: Optional[int] = None) -> np.ndarray:
+        assert self._mask is not None
+        ndim = len(self.shape) if ndim is None else ndim
+        return self._mask.reshape(self._mask.shape + (1,) * (ndim - 2))
+
+    def _fill_masked(self, array: utils.Array) -> utils.Array:
+        """Fill masked pixels in an array which has the same
+        spatial shape as the sequence, e.g a reduction over time"""
+        if self._mask is None:
+            return array
+        return self._ns.where(self._broadcast_mask(array.ndim), self.fill_value, array)
+
+    def _tissue_sum(self) -> utils.Array:
+        """Sum over all pixels that are not masked"""
+        assert self._mask is not None
+        if isinstance(self._array, np.ndarray):
+            # Only the tissue pixels are gathered
+            return self._array[~self._mask].sum(0)
+        return da.where(self._broadcast_mask(), 0, self._array).sum((0, 1))
+
+    def _filled(self) -> utils.Array:
+        if self._mask is None:
+            return self._array
+        return self._ns.where(self._broadcast_mask(), self.fill_value, self._array)
 
     def threshold(self, vmin: Optional[float] = None, vmax: Optional[float] = None):
-        array = filters.threshold(self.array, vmin, vmax)
-        return self.__class__(array, self.dx, self.scale)
+        array = filters.threshold(self._array, vmin, vmax)
+        return self.__class__(array, self.dx, self.scale, mask=self.mask)
 
     @property
     def array(self) -> utils.Array:
-        return self._array
+        """The underlying array where masked pixels (if any)
+        are replaced with the fill value"""
+        return self._filled()
 
     @property
     def array_np(self) -> np.ndarray:
         array = self.array
-        if isinstance(self._array, da.core.Array):
-            array = self.array.compute()  # type: ignore
+        if isinstance(array, da.core.Array):
+            array = array.compute()  # type: ignore
         return utils.unmask(array, fill_value=self.fill_value)
 
     @property
@@ -330,22 +511,47 @@ class FrameSequence:
 
     @property
     def shape(self):
-        return self.array.shape
+        return self._array.shape
+
+    def mean(self, masked: bool = True) -> utils.Array:
+        """Spatial average of the frame sequence
 
-    def mean(self) -> utils.Array:
-        return self.array.mean((0, 1)) * self.scale
+        Parameters
+        ----------
+        masked : bool, optional
+            If True and a mask is applied, only average over the
+            pixels that are not masked, i.e divide by the number of
+            tissue pixels. If False, masked pixels are included with
+            the fill value, by default True
+
+        Returns
+        -------
+        utils.Array
+            The average for each time step
+        """
+        if self._mask is None:
+            return self._array.mean((0, 1)) * self.scale
+
+        num_tissue = np.count_nonzero(~self._mask)
+        total = self._tissue_sum()
+        if masked:
+            return total * (self.scale / max(num_tissue, 1))
+
+        num_pixels = self._mask.size
+        total = total + self.fill_value * (num_pixels - num_tissue)
+        return total * (self.scale / num_pixels)
 
     def max(self) -> utils.Array:
-        return self.array.max(2) * self.scale
+        return self._fill_masked(self._array.max(2)) * self.scale
 
     def min(self) -> utils.Array:
-        return self.array.min(2) * self.scale
+        return self._fill_masked(self._array.min(2)) * self.scale
 
     def compute(self) -> utils.Array:
         return self.array_np * self.scale
 
     def __repr__(self) -> str:
-        return f"{self.__class__.__name__}({self.array.shape}, dx={self.dx}, scale={self.scale})"
+        return f"{self.__class__.__name__}({self.shape}, dx={self.dx}, scale={self.scale})"
 
 
 class VectorFrameSequence(FrameSequence):
@@ -354,7 +560,13 @@ class VectorFrameSequence(FrameSequence):
 
     """
 
-    def __init__(self, array: utils.Array, dx: float = 1.0, scale: float = 1.0):
+    def __init__(
+        self,
+        array: utils.Array,
+        dx: float = 1.0,
+        scale: float = 1.0,
+        mask: Optional[np.ndarray] = None,
+    ):
         """Constructor
 
         Parameters
@@ -369,57 +581,67 @@ class VectorFrameSequence(FrameSequence):
             physical size.
         scale : float
             Another factor that should be reflexted and averaging
+        mask : np.ndarray, optional
+            Spatial mask of shape (width, height), by default None
 
         """
-        super().__init__(array, dx, scale)
+        super().__init__(array, dx, scale, mask=mask)
         assert len(array.shape) == 4
         assert array.shape[3] == 2
 
     def filter(
         self,
-        filter_type: filters.Filters = filters.Filters.median,
+        filter_type: Optional[filters.Filters] = filters.Filters.median,
         size: int = 3,
         sigma: float = 1.0,
+        temporal_filter: Optional[filters.TemporalFilters] = None,
+        temporal_options: Optional[Dict[str, Any]] = None,
     ) -> "VectorFrameSequence":
-        """Apply a filter"""
+        """Apply a filter to each frame, optionally followed by a
+        filter along the time axis, see :meth:`FrameSequence.filter`.
+        Masked pixels are replaced by the fill value before filtering."""
 
-        array = filters.filter_vectors_par(
-            self._array,
-            size=size,
-            sigma=sigma,
-            filter_type=filter_type,
-        )
+        array = self.array
+        if filter_type is not None:
+            array = filters.filter_vectors_par(
+                array,
+                size=size,
+                sigma=sigma,
+                filter_type=filter_type,
+            )
+        if temporal_filter is not None:
+            array = filters.apply_temporal_filter(array, temporal_filter, temporal_options)
 
-        return VectorFrameSequence(array=array, dx=self.dx, scale=self.scale)
+        return VectorFrameSequence(array=array, dx=self.dx, scale=self.scale, mask=self.mask)
 
-    def spline_smooth(self):
-        arr = filters.spline_smooth(self.array)
-        return VectorFrameSequence(da.from_array(arr), scale=self.scale, dx=self.dx)
+    def spline_smooth(
+        self,
+        num_segments: Optional[int] = None,
+        smoothing: float = 1.0,
+    ) -> "VectorFrameSequence":
+        """Smooth each frame with a penalized B-spline,
+        see :func:`filters.spline_smooth`"""
+        arr = filters.spline_smooth(self.array, num_segments=num_segments, smoothing=smoothing)
+        return VectorFrameSequence(arr, scale=self.scale, dx=self.dx, mask=self.mask)
 
     # def cartToPolar(self):
 
     #     mag, ang = cv2.cartToPolar(flow[...,0], flow[...,1], angleInDegrees=True)
 
-    def apply_mask(self, mask: np.ndarray) -> None:
-        self._array = da.ma.masked_array(
-            self.array,
-            np.tile(mask[..., np.newaxis, np.newaxis], self.shape[2:]),
-            fill_value=0.0,
-        )
-
     def threshold_norm(
         self,
         vmin: Optional[float] = None,
         vmax: Optional[float] = None,
     ) -> "VectorFrameSequence":
-        array = filters.threshold_norm(self.array, self._ns, vmin, vmax)
-        return VectorFrameSequence(array, self.dx, self.scale)
+        array = filters.threshold_norm(self._array, self._ns, vmin, vmax)
+        return VectorFrameSequence(array, self.dx, self.scale, mask=self.mask)
 
     def norm(self) -> FrameSequence:
         return FrameSequence(
             self._ns.linalg.norm(self._array, axis=3),
             dx=self.dx,
             scale=self.scale,
+            mask=self.mask,
         )
 
     def angle(self) -> FrameSequence:
@@ -427,15 +649,16 @@ class VectorFrameSequence(FrameSequence):
             self._ns.arctan2(self._array[:, :, :, 0], self._array[:, :, :, 1]),
             dx=self.dx,
             scale=self.scale,
+            mask=self.mask,
         )
 
     @property
     def x(self) -> FrameSequence:
-        return FrameSequence(self._array[:, :, :, 0], dx=self.dx, scale=self.scale)
+        return FrameSequence(self._array[:, :, :, 0], dx=self.dx, scale=self.scale, mask=self.mask)
 
     @property
     def y(self) -> FrameSequence:
-        return FrameSequence(self._array[:, :, :, 1], dx=self.dx, scale=self.scale)
+        return FrameSequence(self._array[:, :, :, 1], dx=self.dx, scale=self.scale, mask=self.mask)
 
 
 class TensorFrameSequence(FrameSequence):
@@ -445,7 +668,13 @@ class TensorFrameSequence(FrameSequence):
 
     """
 
-    def __init__(self, array: utils.Array, dx: float = 1.0, scale: float = 1.0):
+    def __init__(
+        self,
+        array: utils.Array,
+        dx: float = 1.0,
+        scale: float = 1.0,
+        mask: Optional[np.ndarray] = None,
+    ):
         """Constructor
 
         Parameters
@@ -460,9 +689,11 @@ class TensorFrameSequence(FrameSequence):
             physical size.
         scale : float
             Another factor that should be reflexted and averaging
+        mask : np.ndarray, optional
+            Spatial mask of shape (width, height), by default None
 
         """
-        super().__init__(array, dx, scale)
+        super().__init__(array, dx, scale, mask=mask)
         self._ns = np if isinstance(array, np.ndarray) else da
         assert len(array.shape) == 5
         assert array.shape[3] == array.shape[4] == 2
@@ -472,27 +703,46 @@ class TensorFrameSequence(FrameSequence):
             self._ns.linalg.norm(self._array, axis=(3, 4)),
             dx=self.dx,
             scale=self.scale,
+            mask=self.mask,
         )
 
     @property
     def x(self) -> FrameSequence:
-        return FrameSequence(self._array[:, :, :, 1, 1], dx=self.dx, scale=self.scale)
+        return FrameSequence(self._array[:, :, :, 1, 1], dx=self.dx, scale=self.scale, mask=self.mask)
 
     @property
     def y(self) -> FrameSequence:
-        return FrameSequence(self._array[:, :, :, 0, 0], dx=self.dx, scale=self.scale)
+        return FrameSequence(self._array[:, :, :, 0, 0], dx=self.dx, scale=self.scale, mask=self.mask)
 
     @property
     def xy(self) -> FrameSequence:
-        return FrameSequence(self._array[:, :, :, 1, 0], dx=self.dx, scale=self.scale)
+        return FrameSequence(self._array[:, :, :, 1, 0], dx=self.dx, scale=self.scale, mask=self.mask)
 
     @property
     def yx(self) -> FrameSequence:
-        return FrameSequence(self.array[:, :, :, 0, 1], dx=self.dx, scale=self.scale)
+        return FrameSequence(self._array[:, :, :, 0, 1], dx=self.dx, scale=self.scale, mask=self.mask)
 
     def compute_eigenvalues(self) -> VectorFrameSequence:
+        """Eigenvalues of the tensors in ascending order.
+        The tensors are assumed to be symmetric and
+        only the lower triangle is used.
+        """
         return VectorFrameSequence(
-            np.linalg.eigvalsh(self.array_np),
+            eigvalsh_2x2(self._array),
+            dx=self.dx,
+            scale=self.scale,
+            mask=self.mask,
+        )
+
+    def compute_eigenvectors(self) -> "TensorFrameSequence":
+        """Normalized eigenvectors of the tensors, where column
+        ``i`` is the eigenvector corresponding to eigenvalue ``i``
+        returned from :meth:`compute_eigenvalues`.
+        """
+        _, vectors = eigh_2x2(self._array)
+        return TensorFrameSequence(
+            vectors,
             dx=self.dx,
             scale=self.scale,
+            mask=self.mask,
         )
@@ -9,16 +9,198 @@ import matplotlib.pyplot as plt
 
 
 import tempfile
+import threading
+import time
 import sys
-import mps
+from typing import Any, Dict, Iterator, Optional
+
+import cv2
+import numpy as np
 import mps_motion
 
+# Number of frames tracked at a time when computing the traces
+CHUNK_SIZE = 50
+# Scale of the preview relative to the scale of the full analysis
+PREVIEW_FACTOR = 0.25
+
 
 def get_folder_and_files():
     folder = Path(sys.argv[1])
     return folder, [f.name for f in folder.iterdir() if f.suffix in [".nd2", ".tif", ".tiff", ".czi"]]
 
 
+@st.cache_resource(show_spinner="Read data")
+def load_data(path: str, stamp: Dict[str, int]) -> mps_motion.MPSData:
+    # The stamp is part of the key, so changed files are read again
+    return mps_motion.readers.load_data(path)
+
+
+def iter_traces(
+    data: mps_motion.MPSData,
+    flow_algorithm: str,
+    reference_frame: float,
+    scale: float,
+    spacing: int,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator[Dict[str, np.ndarray]]:
+    """Compute the mean norm of the displacement and velocity one
+    chunk of frames at a time, and yield the traces computed so far
+    after each chunk. Each chunk overlaps the next one by `spacing`
+    frames, which are needed for the velocity."""
+    if scale < 1.0:
+        data = mps_motion.scaling.resize_data(data, scale)
+    reference_image = mps_motion.motion_tracking.get_reference_image(
+        reference_frame,
+        data.frames,
+        data.time_stamps,
+    )
+    opt_flow = mps_motion.OpticalFlow(data, flow_algorithm=flow_algorithm, data_scale=scale)
+    # Use the same intensity range for all chunks
+    frames, reference_image = opt_flow._frames(data, reference_image)
+
+    num_frames = data.num_frames
+    u_norm, v_norm = [], []
+    for start in range(0, num_frames - spacing, chunk_size):
+        stop = min(start + chunk_size, num_frames - spacing) + spacing
+        info = dict(data.info, num_frames=stop - start)
+        chunk = mps_motion.MPSData(frames[:, :, start:stop], data.time_stamps[start:stop], info)
+        u = mps_motion.OpticalFlow(
+            chunk,
+            flow_algorithm=flow_algorithm,
+            data_scale=scale,
+        ).get_displacements(reference_image=reference_image)
+        v = mps_motion.Mechanics(u=u, t=chunk.time_stamps).velocity(spacing=spacing)
+
+        u_mean, v_mean = mps_motion.execution.compute(u.norm().mean(), v.norm().mean())
+        u_norm.append(u_mean if stop == num_frames else u_mean[:-spacing])
+        v_norm.append(v_mean)
+        yield {
+            "time": data.time_stamps[:stop],
+            "u_norm": np.concatenate(u_norm),
+            "v_norm": np.concatenate(v_norm),
+        }
+
+
+class MotionJob:
+    """Compute the traces in a background thread, first as a low
+    resolution preview and then at full resolution. The traces
+    computed so far are available in `traces` while the job runs."""
+
+    def __init__(self, data: mps_motion.MPSData, preview: bool = True, **settings) -> None:
+        self.data = data
+        self.settings = settings
+        scale = settings["scale"]
+        self.passes = {"full": scale}
+        if preview and PREVIEW_FACTOR * scale >= 0.05:
+            self.passes = {"preview": PREVIEW_FACTOR * scale, "full": scale}
+        self.traces: Dict[str, Dict[str, np.ndarray]] = {}
+        self.error: Optional[Exception] = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        try:
+            for name, scale in self.passes.items():
+                for traces in iter_traces(self.data, **dict(self.settings, scale=scale)):
+                    self.traces[name] = traces
+        except Exception as e:
+            self.error = e
+
+    @property
+    def done(self) -> bool:
+        return not self._thread.is_alive()
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        """The best traces computed so far, i.e the full resolution
+        traces when they are complete and the preview otherwise"""
+        if "full" in self.traces and (self.done or "preview" not in self.passes):
+            return dict(self.traces["full"], name="full")
+        for name in ("preview", "full"):
+            if name in self.traces:
+                return dict(self.traces[name], name=name)
+        return None
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def get_job(
+    path: str,
+    stamp: Dict[str, int],
+    preview: bool,
+    flow_algorithm: str,
+    reference_frame: float,
+    scale: float,
+    spacing: int,
+) -> MotionJob:
+    # The finished job is kept as the result for these settings
+    return MotionJob(
+        load_data(path, stamp),
+        preview=preview,
+        flow_algorithm=flow_algorithm,
+        reference_frame=reference_frame,
+        scale=scale,
+        spacing=spacing,
+    )
+
+
+@st.cache_resource(show_spinner="Compute displacement", max_entries=4)
+def get_displacements(
+    path: str,
+    stamp: Dict[str, int],
+    flow_algorithm: str,
+    reference_frame: float,
+    scale: float,
+) -> mps_motion.VectorFrameSequence:
+    opt_flow = mps_motion.OpticalFlow(load_data(path, stamp), flow_algorithm=flow_algorithm)
+    return opt_flow.get_displacements(reference_frame=reference_frame, scale=scale)
+
+
+@st.cache_data(show_spinner="Creating video", max_entries=4)
+def quiver_video(
+    path: str,
+    stamp: Dict[str, int],
+    flow_algorithm: str,
+    reference_frame: float,
+    scale: float,
+    step: int,
+    vector_scale: float,
+) -> bytes:
+    data = load_data(path, stamp)
+    u = get_displacements(path, stamp, flow_algorithm, reference_frame, scale)
+    if scale < 1.0:
+        data = mps_motion.scaling.resize_data(data, scale=u.scale)
+
+    with tempfile.TemporaryDirectory() as folder:
+        video_path = Path(folder).joinpath("quiver.mp4")
+        mps_motion.visu.quiver_video(data, u, video_path, step=step, vector_scale=vector_scale)
+        return video_path.read_bytes()
+
+
+@st.cache_data(show_spinner="Loading video", max_entries=4)
+def recording_video(path: str, stamp: Dict[str, int]) -> bytes:
+    data = load_data(path, stamp)
+    vmin, vmax = data.intensity_range()
+    with tempfile.TemporaryDirectory() as folder:
+        video_path = Path(folder).joinpath("video.mp4")
+        with mps_motion.visu.VideoWriter(video_path, data.framerate, data.size_x, data.size_y) as writer:
+            for frame in mps_motion.visu.iter_frames(data.frames):
+                frame = mps_motion.utils.to_uint8(frame.T, vmin, vmax)
+                writer.write(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+        return video_path.read_bytes()
+
+
+def plot_traces(traces: Dict[str, Any], spacing: int):
+    fig, ax = plt.subplots(2, 1, sharex=True)
+    t = traces["time"]
+    ax[0].plot(t, traces["u_norm"])
+    ax[0].set_ylabel("Displacement [\u00b5m]")
+    ax[1].plot(t[:-spacing], traces["v_norm"])
+    ax[1].set_ylabel("Velocity [\u00b5m/s]")
+    if traces["name"] == "preview":
+        fig.suptitle("Low resolution preview")
+    st.pyplot(fig=fig)
+    plt.close(fig)
+
+
 def video():
     st.title("Video")
 
@@ -26,15 +208,8 @@ def video():
     filename = st.selectbox("Select file", options=files)
 
     if st.button("Show video"):
-        with st.spinner("Loading video"):
-            data = mps.MPS(folder / filename)
-            with tempfile.NamedTemporaryFile(suffix=".mp4") as f:
-                mps.utils.frames2mp4(
-                    data.frames.T,
-                    path=f.name,
-                    framerate=data.framerate,
-                )
-                st.video(open(f.name, "rb"), format="video/mp4")
+        path = folder / filename
+        st.video(recording_video(path.as_posix(), mps_motion.readers.file_stamp(path)), format="video/mp4")
 
 
 def motion_analysis():
@@ -60,56 +235,43 @@ def motion_analysis():
     with cols_mech[1]:
         spacing = st.number_input("spacing", value=1, min_value=1)
         scale = st.number_input("Scale", value=0.4, min_value=0.1, max_value=1.0)
+        preview = st.checkbox("Low resolution preview", value=True)
 
-    if not st.button("Run motion analysis"):
+    path = folder / filename
+    stamp = mps_motion.readers.file_stamp(path)
+    settings = (path.as_posix(), stamp, preview, flow_algorithm, reference_frame, scale, spacing)
+
+    # Keep showing the results when other widgets change
+    if st.button("Run motion analysis"):
+        st.session_state["motion_analysis"] = settings
+    if st.session_state.get("motion_analysis") != settings:
         return
 
     print("Run motion analysis")
-    with st.spinner("Read data"):
-        data = mps.MPS(folder / filename)
-
-    opt_flow = mps_motion.OpticalFlow(
-        data,
-        flow_algorithm=flow_algorithm,
-        reference_frame=reference_frame,
-    )
-
-    with st.spinner("Compute displacement"):
-        u = opt_flow.get_displacements(scale=scale)
-
-    mech = mps_motion.Mechanics(u=u, t=data.time_stamps)
-
-    with st.spinner("Compute velocity"):
-        v = mech.velocity(spacing=spacing)
-
-    with st.spinner("Compute mean norm displacement"):
-        u_norm_mean = u.norm().mean().compute()
-
-    with st.spinner("Compute mean norm velocity"):
-        v_norm_mean = v.norm().mean()
-
-    fig, ax = plt.subplots(2, 1, sharex=True)
-    ax[0].plot(data.time_stamps, u_norm_mean)
-    ax[0].set_ylabel("Displacement [\u00b5m]")
-    ax[1].plot(data.time_stamps[:-spacing], v_norm_mean)
-    ax[1].set_ylabel("Velocity [\u00b5m/s]")
-    st.pyplot(fig=fig)
+    job = get_job(*settings)
+
+    placeholder = st.empty()
+    while True:
+        done = job.done
+        traces = job.latest()
+        with placeholder.container():
+            if traces is not None:
+                plot_traces(traces, spacing=spacing)
+            if not done:
+                st.caption("Computing motion...")
+        if done:
+            break
+        time.sleep(1.0)
+
+    if job.error is not None:
+        st.error(f"Motion analysis failed: {job.error}")
+        return
 
     if show_motion_video:
-        with st.spinner("Creating video"):
-            scaled_data = data
-            if scale < 1.0:
-                scaled_data = mps_motion.scaling.resize_data(data, scale=u.scale)
-
-            with tempfile.NamedTemporaryFile(suffix=".mp4") as f:
-                mps_motion.visu.quiver_video(
-                    scaled_data,
-                    u,
-                    f.name,
-                    step=step,
-                    vector_scale=vector_scale,
-                )
-                st.video(open(f.name, "rb"), format="video/mp4")
+        st.video(
+            quiver_video(path.as_posix(), stamp, flow_algorithm, reference_frame, scale, step, vector_scale),
+            format="video/mp4",
+        )
 
     return
 
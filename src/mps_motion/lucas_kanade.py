@@ -5,7 +5,6 @@ Lucas, B. D., & Kanade, T. (1981). An iterative image registration technique wit
 http://cseweb.ucsd.edu/classes/sp02/cse252/lucaskanade81.pdf
 """
 
-import concurrent.futures
 import logging
 from enum import Enum
 from typing import Optional
@@ -19,6 +18,8 @@ import numpy as np
 import tqdm
 from dask.diagnostics import ProgressBar
 
+from . import execution
+from . import profiling
 from . import scaling
 from . import utils
 
@@ -258,6 +259,8 @@ def get_displacements(
     logger.info("Get displacements using Lucas Kanade")
 
     frames = utils.check_frame_dimensions(frames, reference_image)
+    # Convert once here instead of once per frame inside each task
+    frames, reference_image = utils.frames_to_uint8(frames, reference_image)
 
     step = resolve_step(step, reference_image.shape)
     reference_points = get_uniform_reference_points(reference_image, step=step)
@@ -277,8 +280,10 @@ def get_displacements(
             ),
         )
 
-    with ProgressBar(out=utils.LoggerWrapper(logger, logging.INFO)):
-        flows = da.stack(*da.compute(all_flows), axis=2)
+    with profiling.stage("lucas_kanade", num_frames=num_frames), ProgressBar(
+        out=utils.LoggerWrapper(logger, logging.INFO),
+    ):
+        flows = da.stack(*execution.compute(all_flows), axis=2)
     logger.info("Done with Lucas-Kanade method")
 
     if interpolation == Interpolation.none:
@@ -292,7 +297,7 @@ def get_displacements(
         x = np.arange(reference_image.shape[1])
         y = np.arange(reference_image.shape[0])
         int_args = ((p, f, x, y) for f in np.rollaxis(flows, 2))
-        with concurrent.futures.ProcessPoolExecutor() as executor:
+        with execution.executor() as executor:
             for i, q in tqdm.tqdm(
                 enumerate(executor.map(scaling.rbfinterp2d_map, int_args)),
                 desc="Interpolate",
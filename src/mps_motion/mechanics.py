@@ -1,26 +1,26 @@
-import functools
 import logging
+import uuid
+import weakref
+from enum import Enum
+from typing import Any
+from typing import Dict
+from typing import List
 from typing import Optional
+from typing import Sequence
 from typing import Union
 
-try:
-    from functools import cached_property  # type: ignore
-except ImportError:
-    # This is only supported in python 3.8 and above
-    try:
-        from cached_property import cached_property  # type: ignore
-    except ImportError as e:
-        raise ImportError(
-            "Please install cached_property - pip install cached_property",
-        ) from e
-
 from dask.diagnostics import ProgressBar
 import dask.array as da
 import numpy as np
 import dask
 from scipy import interpolate
+from scipy import signal
 
+from . import execution
 from . import frame_sequence as fs
+from . import profiling
+from .cache import FieldCache
+from .execution import ExecutionConfig
 from . import utils
 
 Array = Union[da.Array, np.ndarray]
@@ -62,11 +62,11 @@ def compute_gradients(displacement: Array, dx=1) -> da.Array:
 
     logger.info("Compute interpolant Ux")
     with ProgressBar(out=utils.LoggerWrapper(logger, logging.INFO)):
-        Uxs = dask.compute(*Uxs)
+        Uxs = execution.compute(*Uxs)
 
     logger.info("Compute interpolant Uy")
     with ProgressBar(out=utils.LoggerWrapper(logger, logging.INFO)):
-        Uys = dask.compute(*Uys)
+        Uys = execution.compute(*Uys)
 
     for (
         Ux,
@@ -79,16 +79,16 @@ def compute_gradients(displacement: Array, dx=1) -> da.Array:
 
     logger.info("Compute dudx")
     with ProgressBar(out=utils.LoggerWrapper(logger, logging.INFO)):
-        Dudx = da.stack(*dask.compute(dudxs))
+        Dudx = da.stack(*execution.compute(dudxs))
     logger.info("Compute dudy")
     with ProgressBar(out=utils.LoggerWrapper(logger, logging.INFO)):
-        Dudy = da.stack(*dask.compute(dudys))
+        Dudy = da.stack(*execution.compute(dudys))
     logger.info("Compute dvdx")
     with ProgressBar(out=utils.LoggerWrapper(logger, logging.INFO)):
-        Dvdx = da.stack(*dask.compute(dvdxs))
+        Dvdx = da.stack(*execution.compute(dvdxs))
     logger.info("Compute dvdy")
     with ProgressBar(out=utils.LoggerWrapper(logger, logging.INFO)):
-        Dvdy = da.stack(*dask.compute(dvdys))
+        Dvdy = da.stack(*execution.compute(dvdys))
 
     logger.info("Stack arrays")
     Du = da.stack([[Dudx, Dudy], [Dvdx, Dvdy]]).T
@@ -96,6 +96,151 @@ def compute_gradients(displacement: Array, dx=1) -> da.Array:
     return Du
 
 
+class GradientMethod(str, Enum):
+    spline = "spline"
+    central = "central"
+    savgol = "savgol"
+
+
+def _finite_difference_block(
+    block: np.ndarray,
+    dx: float,
+    method: GradientMethod,
+    edge_order: int = 2,
+    window_length: int = 5,
+    polyorder: int = 2,
+) -> np.ndarray:
+    if method == GradientMethod.central:
+        d0 = np.gradient(block, dx, axis=0, edge_order=edge_order)
+        d1 = np.gradient(block, dx, axis=1, edge_order=edge_order)
+    else:
+        # Differentiate along one axis and smooth along the other
+        kwargs = dict(window_length=window_length, polyorder=polyorder, mode="interp")
+        d0 = signal.savgol_filter(
+            signal.savgol_filter(block, deriv=1, delta=dx, axis=0, **kwargs),
+            axis=1,
+            **kwargs,
+        )
+        d1 = signal.savgol_filter(
+            signal.savgol_filter(block, deriv=1, delta=dx, axis=1, **kwargs),
+            axis=0,
+            **kwargs,
+        )
+    return np.stack([d0, d1], axis=3)
+
+
+def _spline_gradient_block(block: np.ndarray, dx: float) -> np.ndarray:
+    n, m, num_frames = block.shape[:3]
+    x = dx * np.arange(n)
+    y = dx * np.arange(m)
+    du = np.zeros((n, m, num_frames, 2, 2))
+    for k in range(num_frames):
+        for i in range(2):
+            spline = interpolate.RectBivariateSpline(x, y, block[:, :, k, i])
+            du[:, :, k, 0, i] = spline(x, y, dx=1)
+            du[:, :, k, 1, i] = spline(x, y, dy=1)
+    return du
+
+
+def _gradient_depth(method: GradientMethod, window_length: int = 5, **kwargs) -> int:
+    """Number of neighboring pixels needed to compute the
+    gradient in one pixel"""
+    if method == GradientMethod.central:
+        return 1
+    if method == GradientMethod.savgol:
+        return window_length // 2
+    # The spline is fitted to the full frame
+    return 0
+
+
+FUSED_FIELDS = ("du", "F", "E", "principal_strain")
+
+
+def _fused_block(
+    block: np.ndarray,
+    dx: float,
+    method: GradientMethod,
+    options: Dict[str, Any],
+    fields: Sequence[str],
+) -> np.ndarray:
+    if method == GradientMethod.spline:
+        du = _spline_gradient_block(block, dx)
+    else:
+        du = _finite_difference_block(block, dx, method, **options)
+
+    values = {"du": du}
+    values["F"] = F = du + np.eye(2)
+    if "E" in fields or "principal_strain" in fields:
+        values["E"] = E = 0.5 * (np.swapaxes(F, 3, 4) @ F - np.eye(2))
+        if "principal_strain" in fields:
+            values["principal_strain"] = fs.eigvalsh_2x2(E)
+
+    shape = block.shape[:3] + (-1,)
+    return np.concatenate([values[f].reshape(shape) for f in fields], axis=3)
+
+
+def compute_gradients_finite_difference(
+    displacement: Array,
+    dx: float = 1,
+    method: GradientMethod = GradientMethod.central,
+    edge_order: int = 2,
+    window_length: int = 5,
+    polyorder: int = 2,
+) -> da.Array:
+    """Compute gradients of the displacement using finite
+    differences. All frames are processed at once, chunk by chunk,
+    where neighboring chunks share a halo that is wide enough
+    for the stencil.
+
+    Parameters
+    ----------
+    displacement : Array
+        Displacement vectors of shape (N, M, T, 2)
+    dx : float, optional
+        Distance between pixels, by default 1
+    method : GradientMethod, optional
+        Either 'central' for second order central differences or
+        'savgol' for Savitzky-Golay derivative filters, by default 'central'
+    edge_order : int, optional
+        Order of the one sided differences used at the boundary
+        with the 'central' method, by default 2
+    window_length : int, optional
+        Window length of the Savitzky-Golay filter, by default 5
+    polyorder : int, optional
+        Order of the polynomial used in the Savitzky-Golay filter, by default 2
+
+    Returns
+    -------
+    da.Array
+        Gradients of shape (N, M, T, 2, 2), where the entry
+        (..., j, i) is the derivative of component i along axis j
+    """
+    method = GradientMethod(method)
+    if method == GradientMethod.spline:
+        raise ValueError(f"Method {method} is not a finite difference method")
+    depth = _gradient_depth(method, window_length=window_length)
+    logger.info(f"Compute gradient using method {method.value!r}")
+
+    depths = {0: depth, 1: depth, 2: 0, 3: 0}
+    U = da.overlap.overlap(
+        da.asarray(displacement).rechunk({3: -1}),
+        depth=depths,
+        boundary="none",
+    )
+    du = U.map_blocks(
+        _finite_difference_block,
+        new_axis=4,
+        chunks=U.chunks[:3] + ((2,), (2,)),
+        dtype=float,
+        dx=dx,
+        method=method,
+        edge_order=edge_order,
+        window_length=window_length,
+        polyorder=polyorder,
+    )
+    return da.overlap.trim_internal(du, {**depths, 4: 0}, boundary="none")
+
+
 def compute_green_lagrange_strain_tensor(F: Array) -> da.Array:
     r"""Compute Green-Lagrange strain tensor
 
@@ -153,41 +298,78 @@ def compute_velocity(u: Array, t: Array, spacing: int = 1) -> da.Array:
     return da.moveaxis(da.moveaxis(du, 2, 3) / dt, 2, 3)
 
 
-def compute_displacement(v: Array, t: Array, ref_index=0, spacing: int = 1) -> da.Array:
+class IntegrationMethod(str, Enum):
+    rectangle = "rectangle"
+    trapezoid = "trapezoid"
+
+
+def _interpolate_time(v: da.Array, t_from: np.ndarray, t_to: np.ndarray) -> da.Array:
+    """Linearly interpolate `v` along the time axis (axis 2) from
+    the time points `t_from` to the time points `t_to`. Values outside
+    the range of `t_from` are set to the closest end point.
+    """
+    if len(t_from) == 1:
+        return v[:, :, np.zeros(len(t_to), dtype=int), :]
+    index = np.clip(np.searchsorted(t_from, t_to) - 1, 0, len(t_from) - 2)
+    weight = (t_to - t_from[index]) / (t_from[index + 1] - t_from[index])
+    weight = np.clip(weight, 0, 1)[None, None, :, None]
+    return (1 - weight) * v[:, :, index, :] + weight * v[:, :, index + 1, :]
+
+
+def compute_displacement(
+    v: Array,
+    t: Array,
+    ref_index=0,
+    spacing: int = 1,
+    method: IntegrationMethod = IntegrationMethod.rectangle,
+) -> da.Array:
     """Compute displacement from velocity
 
     Parameters
     ----------
     v : Array
-        Velocities
+        Velocities, as computed by :func:`compute_velocity`
     t : Array
         time stamps
     ref_index : int, optional
         Index to be used as reference frame, by default 0
     spacing : int, optional
         Spacing used to compute velocities, by default 1
+    method : IntegrationMethod, optional
+        Either 'rectangle', where the velocity is assumed to be
+        constant between two time stamps, or 'trapezoid' where the
+        velocity is assumed to vary linearly, by default 'rectangle'.
+        With 'rectangle' and a spacing of 1 this is the exact
+        inverse of :func:`compute_velocity`.
 
     Returns
     -------
     da.Array
         Displacement
-
-    Raises
-    ------
-    NotImplementedError
-        If spacing is different from 1
     """
-    if spacing != 1:
-        raise NotImplementedError("Only implemented for the case when spacing is 1")
-    zero = da.zeros((v.shape[0], v.shape[1], 1, v.shape[3]))
+    assert spacing > 0, "Spacing must be a positive integer"
+    method = IntegrationMethod(method)
+    t = np.asarray(t, dtype=float)
+    v = da.asarray(v)
+    assert v.shape[2] == len(t) - spacing, "Velocity does not match time stamps"
+
     dt = np.diff(t)
-    vdt = da.apply_along_axis(lambda x: x * dt, axis=2, arr=v)
+    # The velocities are averages between t[k] and t[k + spacing]
+    t_v = 0.5 * (t[:-spacing] + t[spacing:])
+    if method == IntegrationMethod.rectangle:
+        if spacing != 1:
+            v = _interpolate_time(v, t_v, 0.5 * (t[:-1] + t[1:]))
+        vdt = v * dt[None, None, :, None]
+    else:
+        v = _interpolate_time(v, t_v, t)
+        vdt = 0.5 * (v[:, :, :-1, :] + v[:, :, 1:, :]) * dt[None, None, :, None]
 
+    zero = da.zeros((v.shape[0], v.shape[1], 1, v.shape[3]))
     vdt_low = vdt[:, :, :ref_index, :]
     vdt_high = vdt[:, :, ref_index:, :]
     U = da.concatenate(
         (
-            da.flip(da.cumsum(-da.flip(vdt_low), axis=2)),
+            da.flip(da.cumsum(-da.flip(vdt_low, axis=2), axis=2), axis=2),
             zero,
             da.cumsum(vdt_high, axis=2),
         ),
@@ -197,11 +379,73 @@ def compute_displacement(v: Array, t: Array, ref_index=0, spacing: int = 1) -> d
     return U
 
 
+def grid_labels(shape: Sequence[int], nrows: int, ncols: int) -> np.ndarray:
+    """Create a label image that divides a frame into a
+    grid of `nrows` x `ncols` rectangular regions
+
+    Parameters
+    ----------
+    shape : Sequence[int]
+        Spatial shape of the frame
+    nrows : int
+        Number of regions along the first axis
+    ncols : int
+        Number of regions along the second axis
+
+    Returns
+    -------
+    np.ndarray
+        Labels of the given shape with values from 1
+        to `nrows` * `ncols`
+    """
+    rows = np.arange(shape[0]) * nrows // shape[0]
+    cols = np.arange(shape[1]) * ncols // shape[1]
+    return 1 + rows[:, None] * ncols + cols[None, :]
+
+
+def _regional_block(
+    block: np.ndarray,
+    labels: np.ndarray,
+    regions: np.ndarray,
+    stats: Sequence[str],
+    percentiles: Sequence[float],
+) -> np.ndarray:
+    # Sort the pixels by label so that each region
+    # is a contiguous range of rows
+    order = np.argsort(labels, kind="stable")
+    values = block[order]
+    sorted_labels = labels[order]
+    present, starts, counts = np.unique(sorted_labels, return_index=True, return_counts=True)
+    index = np.searchsorted(regions, present)
+
+    out = np.full((len(regions), len(stats) + len(percentiles)) + block.shape[1:], np.nan)
+    for i, stat in enumerate(stats):
+        if stat == "mean":
+            sums = np.add.reduceat(values, starts, axis=0)
+            out[index, i] = sums / counts.reshape((-1,) + (1,) * (values.ndim - 1))
+        elif stat == "max":
+            out[index, i] = np.maximum.reduceat(values, starts, axis=0)
+        elif stat == "min":
+            out[index, i] = np.minimum.reduceat(values, starts, axis=0)
+    for j, (start, count) in enumerate(zip(starts, counts)):
+        region_values = values[start : start + count]
+        for i, q in enumerate(percentiles, start=len(stats)):
+            out[index[j], i] = np.percentile(region_values, q, axis=0)
+    return out
+
+
+REGIONAL_STATS = ("mean", "max", "min")
+
+
 class Mechanics:
     def __init__(
         self,
         u: fs.VectorFrameSequence,
         t: Optional[Array] = None,
+        gradient_method: GradientMethod = GradientMethod.spline,
+        gradient_options: Optional[Dict[str, Any]] = None,
+        cache: Optional[FieldCache] = None,
+        execution: Optional[ExecutionConfig] = None,
     ):
         """Create a mechanics object
 
@@ -214,10 +458,35 @@ class Mechanics:
             If not provided `t` will be an evenly spaced
             array with a step of 1.0. Note that `t` is only
             relevant when computing time derivatives such as velocity.
+        gradient_method : GradientMethod, optional
+            Method used to compute the displacement gradient, by default
+            'spline'. The finite difference methods ('central' and 'savgol')
+            are considerably faster for long recordings.
+        gradient_options : Optional[Dict[str, Any]], optional
+            Extra keyword arguments passed to
+            :func:`compute_gradients_finite_difference`, by default None
+        cache : Optional[FieldCache], optional
+            Cache used for the derived fields, by default None, in which
+            case a cache with the memory budget from `execution` is created.
+            The cache is released together with this object.
+        execution : Optional[ExecutionConfig], optional
+            Execution configuration used when computing fields, by default
+            None, in which case the active configuration is used
         """
         assert isinstance(u, fs.VectorFrameSequence)
         self._u = u
+        self.execution = execution
+        if cache is None:
+            cache = FieldCache(max_bytes=None if execution is None else execution.cache_bytes)
+        self.cache = cache
+        # Keys in the cache are prefixed with a token that is unique
+        # for this object, so that a cache can be shared between
+        # several objects
+        self._token = uuid.uuid4().hex
+        weakref.finalize(self, self.cache.pop_prefix, self._token)
         self.t = t
+        self.gradient_method = GradientMethod(gradient_method)
+        self.gradient_options = gradient_options or {}
 
     @property
     def u(self) -> fs.VectorFrameSequence:
@@ -238,6 +507,19 @@ class Mechanics:
                 "Expected time stamps to have the same number of points at 'u'",
             )
         self._t = t
+        # The velocities depend on the time stamps
+        for key in self.cache:
+            if key[:2] == (self._token, "velocity"):
+                self.cache.pop(key)
+
+    @property
+    def gradient_method(self) -> GradientMethod:
+        """Method used to compute the displacement gradient"""
+        return self._gradient_method
+
+    @gradient_method.setter
+    def gradient_method(self, gradient_method: GradientMethod) -> None:
+        self._gradient_method = GradientMethod(gradient_method)
 
     @property
     def dx(self) -> float:
@@ -271,15 +553,36 @@ class Mechanics:
     def __repr__(self):
         return f"{self.__class__.__name__}(u={self.u}, dx={self.dx}, scale={self.scale})"
 
-    @cached_property
+    def _key(self, name: str, *params) -> tuple:
+        """Cache key of a field that depends on the gradient"""
+        options = tuple(sorted(self.gradient_options.items()))
+        return (self._token, name, self.gradient_method.value, options) + params
+
+    @property
     def du(self) -> fs.TensorFrameSequence:
+        """Displacement gradient"""
+        return self.cache.get_or_compute(self._key("du"), self._compute_du)
+
+    def _compute_du(self) -> fs.TensorFrameSequence:
+        if self.gradient_method != GradientMethod.spline:
+            return fs.TensorFrameSequence(
+                compute_gradients_finite_difference(
+                    self.u.array,
+                    dx=self.dx,
+                    method=self.gradient_method,
+                    **self.gradient_options,
+                ),
+                dx=self.dx,
+                scale=self.scale,
+                mask=self.u.mask,
+            )
         try:
             du = compute_gradients(self.u.array, dx=self.dx)
         except ValueError:
             # We probably need to rechunk
             if isinstance(self.u._array, da.Array):
                 logger.warning("Problems with computing gradient - try rechunking")
-                self.u._array = self.u.array.rechunk()  # type:ignore
+                self.u._array = self.u._array.rechunk()  # type:ignore
                 du = compute_gradients(self.u.array, dx=self.dx)
             else:
                 raise
@@ -287,50 +590,278 @@ class Mechanics:
             du,
             dx=self.dx,
             scale=self.scale,
+            mask=self.u.mask,
         )
 
     @property
     def F(self) -> fs.TensorFrameSequence:
         """Deformation gradient"""
-        return fs.TensorFrameSequence(
-            self.du.array + da.eye(2)[None, None, None, :, :],
-            dx=self.dx,
-            scale=self.scale,
+        return self.cache.get_or_compute(
+            self._key("F"),
+            lambda: fs.TensorFrameSequence(
+                self.du.array + da.eye(2)[None, None, None, :, :],
+                dx=self.dx,
+                scale=self.scale,
+                mask=self.u.mask,
+            ),
         )
 
     @property
     def E(self) -> fs.TensorFrameSequence:
         """Green-Lagrange strain tensor"""
-        return fs.TensorFrameSequence(
-            compute_green_lagrange_strain_tensor(self.F.array),
-            dx=self.dx,
-            scale=self.scale,
+        return self.cache.get_or_compute(
+            self._key("E"),
+            lambda: fs.TensorFrameSequence(
+                compute_green_lagrange_strain_tensor(self.F.array),
+                dx=self.dx,
+                scale=self.scale,
+                mask=self.u.mask,
+            ),
         )
 
-    @functools.lru_cache
-    def velocity(self, spacing: int = 1) -> fs.VectorFrameSequence:
-        """Velocity field"""
-        return fs.VectorFrameSequence(
-            compute_velocity(self.u.array, self.t, spacing=spacing),
+    def _fused_fields(self, fields: Sequence[str]) -> Dict[str, fs.FrameSequence]:
+        """Lazily compute the requested fields in a single pass
+        over the displacement, so that none of the intermediate
+        tensors are stored for the full recording.
+
+        Parameters
+        ----------
+        fields : Sequence[str]
+            Fields to compute, see `FUSED_FIELDS`
+
+        Returns
+        -------
+        Dict[str, fs.FrameSequence]
+            The lazy fields
+        """
+        for field in fields:
+            if field not in FUSED_FIELDS:
+                raise ValueError(
+                    f"Unknown field {field!r}, expected one of {FUSED_FIELDS}",
+                )
+        fields = tuple(dict.fromkeys(fields))
+        channels = [2 if f == "principal_strain" else 4 for f in fields]
+
+        depth = _gradient_depth(self.gradient_method, **self.gradient_options)
+        if self.gradient_method == GradientMethod.spline:
+            rechunk = {0: -1, 1: -1, 3: -1}
+        else:
+            rechunk = {3: -1}
+        depths = {0: depth, 1: depth, 2: 0, 3: 0}
+
+        U = da.overlap.overlap(
+            da.asarray(self.u.array).rechunk(rechunk),
+            depth=depths,
+            boundary="none",
+        )
+        packed = U.map_blocks(
+            _fused_block,
+            chunks=U.chunks[:3] + ((sum(channels),),),
+            dtype=float,
             dx=self.dx,
-            scale=self.scale,
+            method=self.gradient_method,
+            options=self.gradient_options,
+            fields=fields,
         )
+        packed = da.overlap.trim_internal(packed, depths, boundary="none")
+
+        sequences: Dict[str, fs.FrameSequence] = {}
+        start = 0
+        for field, num_channels in zip(fields, channels):
+            array = packed[:, :, :, start : start + num_channels]
+            start += num_channels
+            if field == "principal_strain":
+                sequences[field] = fs.VectorFrameSequence(
+                    array,
+                    dx=self.dx,
+                    scale=self.scale,
+                    mask=self.u.mask,
+                )
+            else:
+                sequences[field] = fs.TensorFrameSequence(
+                    array.reshape(array.shape[:3] + (2, 2)),
+                    dx=self.dx,
+                    scale=self.scale,
+                    mask=self.u.mask,
+                )
+        return sequences
+
+    def compute(
+        self,
+        fields: Sequence[str] = ("E", "principal_strain"),
+    ) -> Dict[str, np.ndarray]:
+        """Compute several fields in one pass over the displacement.
 
-    @cached_property
-    def principal_strain(self) -> fs.VectorFrameSequence:
-        """Return the principal strain
+        The displacement is streamed chunk by chunk through
+        gradient, deformation gradient, strain and principal
+        strain, and only the requested outputs are kept.
 
         Parameters
         ----------
-        k : int, optional
-            Which component of the princial strain either 0 or 1, by default 0.
-            0 correspond to the largets eigen value
-        recompute : bool, optional
-            If already computed set this to True if you want to recompute, by default False
+        fields : Sequence[str], optional
+            The fields to compute, by default ("E", "principal_strain").
+            Valid fields are 'du', 'F', 'E' and 'principal_strain'.
+            Adding the suffix '_mean' or '_max', e.g 'E_mean', gives the
+            spatial average for each time point or the maximum over
+            time for each pixel, as returned from
+            `FrameSequence.mean` and `FrameSequence.max`.
 
         Returns
         -------
-        np.ndarray
-            The kth principal strain
+        Dict[str, np.ndarray]
+            The computed fields. These are stored in the cache
+            and are only recomputed if they have been evicted.
         """
-        return self.E.compute_eigenvalues()
+        keys = {field: self._key("computed", field) for field in fields}
+        missing = [field for field in dict.fromkeys(fields) if keys[field] not in self.cache]
+
+        names: List[str] = []
+        reductions: List[Optional[str]] = []
+        for field in missing:
+            name, reduction = field, None
+            for suffix in ("_mean", "_max"):
+                if field.endswith(suffix):
+                    name, reduction = field[: -len(suffix)], suffix[1:]
+            names.append(name)
+            reductions.append(reduction)
+
+        sequences = self._fused_fields(names) if names else {}
+        values = []
+        for name, reduction in zip(names, reductions):
+            sequence = sequences[name]
+            if reduction is None:
+                values.append(sequence.array)
+            else:
+                values.append(getattr(sequence, reduction)())
+
+        if missing:
+            logger.info(f"Compute {', '.join(missing)}")
+            with profiling.stage("mechanics", num_frames=self.num_time_points), execution.activate(
+                self.execution,
+            ), ProgressBar(out=utils.LoggerWrapper(logger, logging.INFO)):
+                results = execution.compute(*values)
+            for field, value in zip(missing, results):
+                self.cache[keys[field]] = np.asarray(value)
+        return {field: self.cache[keys[field]] for field in fields}
+
+    def regional_traces(
+        self,
+        labels: np.ndarray,
+        fields: Sequence[str] = ("u", "E"),
+        stats: Sequence[str] = ("mean",),
+        percentiles: Sequence[float] = (),
+    ) -> Dict[str, Dict[str, np.ndarray]]:
+        """Compute traces averaged over regions of the frame.
+
+        The fields are streamed through time chunk by chunk
+        and reduced for all regions at once, so the full
+        tensor fields are never stored in memory.
+
+        Parameters
+        ----------
+        labels : np.ndarray
+            Integer image of the same spatial shape as the
+            displacement. Pixels with label 0 are background
+            and masked pixels are always excluded. See also
+            :func:`grid_labels`
+        fields : Sequence[str], optional
+            Fields to compute traces for, by default ("u", "E").
+            Valid fields are 'u', 'v' (velocity) and the fields
+            supported by :meth:`compute`
+        stats : Sequence[str], optional
+            Statistics to compute in each region, any of 'mean',
+            'max' and 'min', by default ("mean",)
+        percentiles : Sequence[float], optional
+            Percentiles to compute in each region, by default ().
+            The percentile `q` is stored with the key 'p{q}', e.g 'p95'
+
+        Returns
+        -------
+        Dict[str, Dict[str, np.ndarray]]
+            The traces for each field and statistic. Each trace has
+            shape (num_regions, num_time_points, ...) where the regions
+            are ordered by increasing label. Regions without any
+            tissue pixels are NaN.
+        """
+        labels = np.asarray(labels)
+        if labels.shape != self.u.shape[:2]:
+            raise ValueError(
+                f"Incompatible labels shape, got {labels.shape}, expected {self.u.shape[:2]}",
+            )
+        for stat in stats:
+            if stat not in REGIONAL_STATS:
+                raise ValueError(f"Unknown statistic {stat!r}, expected one of {REGIONAL_STATS}")
+        labels = labels.astype(int)
+        regions = np.unique(labels[labels > 0])
+        keep = labels > 0
+        if self.u.mask is not None:
+            keep &= ~self.u.mask
+        keep = keep.ravel()
+        pixel_labels = labels.ravel()[keep]
+
+        tensor_fields = [f for f in fields if f not in ("u", "v")]
+        sequences = self._fused_fields(tensor_fields) if tensor_fields else {}
+        sequences["u"] = self.u
+        if "v" in fields:
+            sequences["v"] = self.velocity()
+
+        keys = list(stats) + [f"p{q:g}" for q in percentiles]
+        values = []
+        for field in fields:
+            array = da.asarray(sequences[field].array)
+            shape = array.shape
+            array = array.reshape(shape[:3] + (-1,)).rechunk({0: -1, 1: -1, 3: -1})
+            array = array.reshape((-1,) + array.shape[2:])[keep]
+            out = array.map_blocks(
+                _regional_block,
+                chunks=((len(regions),), (len(keys),)) + array.chunks[1:],
+                new_axis=1,
+                dtype=float,
+                labels=pixel_labels,
+                regions=regions,
+                stats=stats,
+                percentiles=percentiles,
+            )
+            values.append(out.reshape(out.shape[:3] + shape[3:]) * self.scale)
+
+        logger.info(f"Compute regional traces of {', '.join(fields)}")
+        with profiling.stage("regional_traces", num_frames=self.num_time_points), execution.activate(
+            self.execution,
+        ), ProgressBar(out=utils.LoggerWrapper(logger, logging.INFO)):
+            results = execution.compute(*values)
+
+        return {
+            field: {key: result[:, i] for i, key in enumerate(keys)} for field, result in zip(fields, results)
+        }
+
+    def velocity(self, spacing: int = 1) -> fs.VectorFrameSequence:
+        """Velocity field"""
+        return self.cache.get_or_compute(
+            (self._token, "velocity", spacing),
+            lambda: fs.VectorFrameSequence(
+                compute_velocity(self.u.array, self.t, spacing=spacing),
+                dx=self.dx,
+                scale=self.scale,
+                mask=self.u.mask,
+            ),
+        )
+
+    @property
+    def principal_strain(self) -> fs.VectorFrameSequence:
+        """Principal strains, i.e the eigenvalues of the
+        Green-Lagrange strain tensor in ascending order
+        """
+        return self.cache.get_or_compute(
+            self._key("principal_strain"),
+            lambda: self.E.compute_eigenvalues(),
+        )
+
+    @property
+    def principal_directions(self) -> fs.TensorFrameSequence:
+        """Directions of the principal strains, where column ``k``
+        is the direction of ``principal_strain[..., k]``
+        """
+        return self.cache.get_or_compute(
+            self._key("principal_directions"),
+            lambda: self.E.compute_eigenvectors(),
+        )
@@ -3,6 +3,7 @@ from enum import Enum
 from typing import Any
 from typing import Dict
 from typing import Optional
+from typing import Tuple
 from typing import Union
 
 import ap_features as apf
@@ -11,27 +12,20 @@ import numpy as np
 
 from . import block_matching
 from . import dualtvl1
+from . import execution
 from . import farneback
 from . import frame_sequence as fs
 from . import lucas_kanade
 from . import scaling
 from . import utils
+from .algorithms import FLOW_ALGORITHMS
+from .algorithms import list_optical_flow_algorithm  # noqa: F401
+from .execution import ExecutionConfig
 
 
 logger = logging.getLogger(__name__)
 
 
-class FLOW_ALGORITHMS(str, Enum):
-    farneback = "farneback"
-    dualtvl1 = "dualtvl1"
-    lucas_kanade = "lucas_kanade"
-    block_matching = "block_matching"
-
-
-def list_optical_flow_algorithm():
-    return FLOW_ALGORITHMS._member_names_
-
-
 class RefFrames(str, Enum):
     min = "min"
     max = "max"
@@ -177,8 +171,19 @@ class OpticalFlow:
         flow_algorithm: FLOW_ALGORITHMS = FLOW_ALGORITHMS.farneback,
         filter_options: Optional[Dict[str, Any]] = None,
         data_scale: float = 1.0,
+        intensity_percentiles: Optional[Tuple[float, float]] = None,
+        execution: Optional[ExecutionConfig] = None,
         **options,
     ):
+        if not isinstance(data, utils.MPSData):
+            # Make sure we have a cache for the resized frames
+            data = utils.MPSData(
+                data.frames,
+                data.time_stamps,
+                data.info,
+                pacing=getattr(data, "pacing", None),
+                metadata=getattr(data, "metadata", None),
+            )
         self.data = data
 
         self.flow_algorithm = flow_algorithm
@@ -186,6 +191,16 @@ class OpticalFlow:
         self._handle_algorithm(options)
         options["filter_options"] = filter_options or {}
         self._data_scale = data_scale
+        self.intensity_percentiles = intensity_percentiles
+        self.execution = execution
+        if execution is not None and execution.cache_bytes is not None:
+            # Keep the cached frames within the memory limit
+            max_bytes = self.data.cache.max_bytes
+            self.data.cache.max_bytes = min(max_bytes or execution.cache_bytes, execution.cache_bytes)
+
+    @property
+    def _execution_config(self) -> ExecutionConfig:
+        return self.execution or execution.get_config()
 
     @property
     def data_scale(self) -> float:
@@ -214,6 +229,18 @@ class OpticalFlow:
 
         self.options.update(options)
 
+    def _frames(self, data: utils.MPSData, reference_image=None):
+        """Frames (and reference image) passed to the algorithm. All
+        algorithms except block matching work on uint8 images, so the
+        frames are converted once and cached on `data`."""
+        if self.flow_algorithm == FLOW_ALGORITHMS.block_matching:
+            return data.frames, reference_image
+        frames = data.frames_uint8(self.intensity_percentiles)
+        if reference_image is not None and reference_image.dtype != np.uint8:
+            vmin, vmax = data.intensity_range(self.intensity_percentiles)
+            reference_image = utils.to_uint8(np.asarray(reference_image), vmin, vmax)
+        return frames, reference_image
+
     def get_displacements(
         self,
         recompute: bool = False,
@@ -272,7 +299,9 @@ class OpticalFlow:
             )
 
         if not hasattr(self, "_displacement") or recompute:
-            u = self._get_displacements(data.frames, reference_image, **self.options)
+            with execution.activate(self.execution):
+                frames, reference_image = self._frames(data, reference_image)
+                u = self._get_displacements(frames, reference_image, **self.options)
             dx = 1
 
             scale *= self.data_scale
@@ -287,6 +316,7 @@ class OpticalFlow:
 
             if not isinstance(u, da.Array):
                 u = da.from_array(u)
+            u = self._execution_config.rechunk(u)
 
             self._displacement = fs.VectorFrameSequence(u, dx=dx, scale=scale)
 
@@ -308,12 +338,14 @@ class OpticalFlow:
         if scale < 1.0:
             scaled_data = scaling.resize_data(data, scale)
 
-        v = self._get_velocities(
-            scaled_data.frames,
-            scaled_data.time_stamps,
-            spacing=spacing,
-            **self.options,
-        )
+        with execution.activate(self.execution):
+            frames, _ = self._frames(scaled_data)
+            v = self._get_velocities(
+                frames,
+                scaled_data.time_stamps,
+                spacing=spacing,
+                **self.options,
+            )
         dx = 1
 
         scale *= self.data_scale
@@ -328,6 +360,7 @@ class OpticalFlow:
 
         if not isinstance(v, da.Array):
             v = da.from_array(v)
+        v = self._execution_config.rechunk(v)
 
         self._velocity = fs.VectorFrameSequence(v, dx=dx, scale=scale)
 
@@ -0,0 +1,142 @@
+"""Checkpoints for the stages of an analysis.
+
+Each stage stores its result (artifact) in an output directory
+together with a fingerprint of its inputs, i.e its settings and the
+fingerprints of the stages it depends on. When the analysis is run
+again, stages with an unchanged fingerprint load their artifact
+instead of being recomputed.
+"""
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Sequence
+from typing import TypeVar
+
+from . import profiling
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Name of the file with the fingerprints of the stages
+STAGES_FILE = "stages.json"
+
+
+def fingerprint(*inputs: Any) -> str:
+    """Fingerprint of the inputs, which should be JSON serializable.
+    Other objects are represented by their string representation."""
+    s = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha1(s.encode()).hexdigest()
+
+
+class Checkpoints:
+    """Run stages and keep their artifacts in `outdir`.
+
+    Parameters
+    ----------
+    outdir : utils.PathLike
+        Directory with the artifacts
+    overwrite : bool, optional
+        If True, recompute all stages, by default False
+    """
+
+    def __init__(self, outdir: utils.PathLike, overwrite: bool = False) -> None:
+        self.outdir = Path(outdir)
+        self.overwrite = overwrite
+        self.fingerprints: Dict[str, str] = {}
+        self._path = self.outdir.joinpath(STAGES_FILE)
+        self._stored: Dict[str, str] = {}
+        if self._path.is_file():
+            self._stored = json.loads(self._path.read_text())
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(outdir={self.outdir}, overwrite={self.overwrite})"
+
+    def path(self, name: str) -> Path:
+        """Path to an artifact in the output directory"""
+        return self.outdir.joinpath(name)
+
+    def is_valid(self, name: str) -> bool:
+        """Return True if the stored artifacts of the stage `name` were
+        computed with the same inputs as the last call to :meth:`run`"""
+        return not self.overwrite and self._stored.get(name) == self.fingerprints.get(name)
+
+    def run(
+        self,
+        name: str,
+        inputs: Dict[str, Any],
+        compute: Callable[[], T],
+        save: Callable[[T], None],
+        load: Callable[[], T],
+        upstream: Sequence[str] = (),
+    ) -> T:
+        """Run a stage, or load its artifact if it is up to date
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage
+        inputs : Dict[str, Any]
+            The settings used by the stage
+        compute : Callable[[], T]
+            Function computing the result
+        save : Callable[[T], None]
+            Function saving the result to the output directory
+        load : Callable[[], T]
+            Function loading the result from the output directory. It
+            should raise an exception if the artifact is missing.
+        upstream : Sequence[str], optional
+            Names of the stages this stage depends on, which has to be
+            run before this stage, by default ()
+
+        Returns
+        -------
+        T
+            The result
+        """
+        self.fingerprints[name] = fingerprint(inputs, [self.fingerprints[u] for u in upstream])
+        with profiling.stage(name):
+            return self._run(name, compute, save, load)
+
+    def _run(self, name: str, compute: Callable[[], T], save: Callable[[T], None], load: Callable[[], T]) -> T:
+        if self.is_valid(name):
+            try:
+                value = load()
+            except Exception as e:
+                logger.debug(f"Unable to load artifact of stage {name!r}: {e}")
+            else:
+                logger.info(f"Reuse stage {name!r}")
+                return value
+
+        logger.debug(f"Run stage {name!r}")
+        value = compute()
+        self.outdir.mkdir(exist_ok=True, parents=True)
+        # Forget the old artifact first, in case saving the new one fails
+        if self._stored.pop(name, None) is not None:
+            self._save()
+        save(value)
+        self._stored[name] = self.fingerprints[name]
+        self._save()
+        return value
+
+    def _save(self) -> None:
+        tmp_path = self._path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self._stored, indent=2))
+        os.replace(tmp_path, self._path)
+
+
+def load_json(path: Path) -> Any:
+    return json.loads(path.read_text())
+
+
+def require_file(path: Path) -> Path:
+    """Load function for artifacts that are only written, e.g videos"""
+    if not path.is_file():
+        raise FileNotFoundError(path)
+    return path
@@ -0,0 +1,162 @@
+"""Lightweight instrumentation of the stages of an analysis.
+
+The engines and filters report their work with :func:`stage`::
+
+    with profiling.stage("farneback", num_frames=frames.shape[2]):
+        ...
+
+This costs nothing unless a :class:`Profiler` is active, in which case
+the wall time, CPU time, peak memory and the bytes read and written
+are recorded for each stage. Stages inside other stages are named by
+their path, e.g 'displacement/farneback'.
+"""
+import contextlib
+import json
+import logging
+import sys
+import time
+from dataclasses import asdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+
+def peak_rss() -> int:
+    """Peak resident set size of this process in bytes,
+    or 0 if it is not available"""
+    if resource is None:
+        return 0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return maxrss if sys.platform == "darwin" else 1024 * maxrss
+
+
+def io_counters() -> Tuple[int, int]:
+    """Number of bytes read from and written to the
+    storage by this process"""
+    try:
+        counters = dict(line.split(": ") for line in Path("/proc/self/io").read_text().splitlines())
+    except (OSError, ValueError):
+        if resource is None:
+            return 0, 0
+        # Fall back to the number of blocks, which are 512 bytes
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return 512 * usage.ru_inblock, 512 * usage.ru_oublock
+    return int(counters["read_bytes"]), int(counters["write_bytes"])
+
+
+@dataclass
+class StageTiming:
+    name: str
+    wall_time: float
+    cpu_time: float
+    peak_rss: int
+    bytes_read: int
+    bytes_written: int
+    num_frames: Optional[int] = None
+
+    @property
+    def frames_per_second(self) -> Optional[float]:
+        if self.num_frames is None or self.wall_time == 0:
+            return None
+        return self.num_frames / self.wall_time
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = asdict(self)
+        d["frames_per_second"] = self.frames_per_second
+        return d
+
+
+class Profiler:
+    """Collect the timings of the stages run while the profiler is
+    active, i.e inside a `with Profiler() as profiler:` block.
+
+    Note that the CPU time includes all threads in the process and that
+    the peak memory is the peak of the process at the end of the stage.
+    """
+
+    def __init__(self) -> None:
+        self.stages: List[StageTiming] = []
+
+    def __enter__(self) -> "Profiler":
+        _profilers.append(self)
+        return self
+
+    def __exit__(self, *args) -> None:
+        _profilers.remove(self)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(num_stages={len(self.stages)})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"stages": [s.to_dict() for s in self.stages]}
+
+    def summary(self) -> str:
+        lines = [f"{'Stage':<40} {'Wall [s]':>10} {'CPU [s]':>10} {'Peak RSS [MB]':>14} {'Frames/s':>10}"]
+        for s in self.stages:
+            fps = "" if s.frames_per_second is None else f"{s.frames_per_second:.1f}"
+            lines.append(
+                f"{s.name:<40} {s.wall_time:>10.2f} {s.cpu_time:>10.2f} {s.peak_rss / 1e6:>14.1f} {fps:>10}",
+            )
+        return "\n".join(lines)
+
+    def save(self, path: Union[str, Path]) -> None:
+        Path(path).write_text(json.dumps(self.to_dict(), indent=2))
+
+
+_profilers: List[Profiler] = []
+_names: List[str] = []
+
+
+@contextlib.contextmanager
+def stage(name: str, num_frames: Optional[int] = None) -> Iterator[None]:
+    """Record the resources used inside the block in the active profilers
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage
+    num_frames : Optional[int], optional
+        Number of frames processed in the stage, used to
+        compute the throughput, by default None
+    """
+    if not _profilers:
+        yield
+        return
+
+    _names.append(name)
+    path = "/".join(_names)
+    wall_time = time.perf_counter()
+    cpu_time = time.process_time()
+    bytes_read, bytes_written = io_counters()
+    try:
+        yield
+    finally:
+        _names.pop()
+        read, written = io_counters()
+        timing = StageTiming(
+            name=path,
+            wall_time=time.perf_counter() - wall_time,
+            cpu_time=time.process_time() - cpu_time,
+            peak_rss=peak_rss(),
+            bytes_read=read - bytes_read,
+            bytes_written=written - bytes_written,
+            num_frames=num_frames,
+        )
+        logger.debug(f"Stage {path!r} took {timing.wall_time:.2f} s")
+        for profiler in _profilers:
+            profiler.stages.append(timing)
@@ -0,0 +1,399 @@
+"""Readers for stacks of frames.
+
+A :class:`FrameReader` gives access to the frames in a file without
+loading them all into memory. Cropping and time windows are applied
+when the frames are read, so that only the selected part of the file
+is read from disk.
+"""
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+import dask.array as da
+import numpy as np
+
+from . import utils
+
+try:
+    import h5py
+
+    has_h5py = True
+except ImportError:
+    has_h5py = False
+
+logger = logging.getLogger(__name__)
+
+# Suffix added to the name of a recording for its HDF5 cache
+CACHE_SUFFIX = ".frames.h5"
+
+
+def default_info(shape: Tuple[int, ...]) -> Dict[str, Any]:
+    return {
+        "size_x": shape[0],
+        "size_y": shape[1],
+        "num_frames": shape[2],
+        "dt": 1.0,
+        "time_unit": "ms",
+        "um_per_pixel": 1.0,
+    }
+
+
+def time_window(
+    time_stamps: np.ndarray,
+    start_t: Optional[float] = None,
+    end_t: Optional[float] = None,
+) -> slice:
+    """Slice of the frames with time stamps in the window from
+    `start_t` to `end_t`. The window starts (and ends) at the first
+    time stamp larger than or equal to `start_t` (and `end_t`)."""
+
+    def find_time_index(t_star, default):
+        if t_star is None:
+            return default
+        return next((i for i, t in enumerate(time_stamps) if t >= t_star), default)
+
+    return slice(find_time_index(start_t, 0), find_time_index(end_t, len(time_stamps)))
+
+
+def _select(frames: np.ndarray, x: slice, y: slice, t: slice) -> np.ndarray:
+    selection = frames[x, y, t]
+    if isinstance(frames, np.memmap) or selection.size == frames.size:
+        return selection
+    # Copy so that the frames outside the selection can be released
+    return selection.copy()
+
+
+class FrameReader:
+    """Base class for readers of stacks of frames of shape
+    (size_x, size_y, num_frames).
+
+    Subclasses set the attributes `time_stamps`, `info`, `pacing` and
+    `metadata` and implement :meth:`read`.
+
+    Parameters
+    ----------
+    path : utils.PathLike
+        Path to the file
+    """
+
+    def __init__(self, path: utils.PathLike) -> None:
+        self.path = Path(path)
+        if not self.path.is_file():
+            raise IOError(f"File {self.path} does not exist")
+        self.time_stamps: np.ndarray = np.array([])
+        self.info: Dict[str, Any] = {}
+        self.pacing: Optional[np.ndarray] = None
+        self.metadata: Dict[str, Any] = {}
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(path={self.path}, shape={self.shape})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        raise NotImplementedError
+
+    def read(
+        self,
+        x: slice = slice(None),
+        y: slice = slice(None),
+        t: slice = slice(None),
+    ) -> utils.Array:
+        """Read the frames in the selection. The selection is
+        read lazily whenever the file format allows it.
+
+        Parameters
+        ----------
+        x : slice, optional
+            Selection in the first dimension, by default all
+        y : slice, optional
+            Selection in the second dimension, by default all
+        t : slice, optional
+            Selection in time, by default all
+
+        Returns
+        -------
+        utils.Array
+            The selected frames
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class NpyReader(FrameReader):
+    """Reader for `.npy` files. Files containing a plain array of
+    frames are memory mapped, while files containing a dictionary
+    in the format of :class:`mps.MPS` are loaded into memory."""
+
+    def __init__(self, path: utils.PathLike) -> None:
+        super().__init__(path)
+        try:
+            frames = np.load(self.path, mmap_mode="r")
+        except ValueError:
+            # Python objects cannot be memory mapped
+            data = np.load(self.path, allow_pickle=True).item()
+            frames = np.asarray(data["frames"])
+            self.time_stamps = np.asarray(data["time_stamps"])
+            self.info = dict(data["info"])
+            self.pacing = data.get("pacing")
+            self.metadata = data.get("metadata") or {}
+        else:
+            self.info = default_info(frames.shape)
+            self.time_stamps = np.arange(frames.shape[2]) * self.info["dt"]
+        self._frames = frames
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return self._frames.shape
+
+    def read(
+        self,
+        x: slice = slice(None),
+        y: slice = slice(None),
+        t: slice = slice(None),
+    ) -> np.ndarray:
+        return _select(self._frames, x, y, t)
+
+
+class H5Reader(FrameReader):
+    """Reader for HDF5 files written by :func:`write_h5`. The frames
+    are read lazily as a dask array with the chunks of the file, so
+    only the chunks in the selection are read."""
+
+    def __init__(self, path: utils.PathLike) -> None:
+        if not has_h5py:
+            raise ImportError("Cannot read HDF5 files. Please install h5py")
+        super().__init__(path)
+        self._file = h5py.File(self.path, "r")
+        dataset = self._file["frames"]
+        self._frames = dataset
+        self.time_stamps = self._file["time_stamps"][...]
+        self.pacing = self._file["pacing"][...] if "pacing" in self._file else None
+        self.info = json.loads(dataset.attrs.get("info", "{}")) or default_info(dataset.shape)
+        self.metadata = json.loads(dataset.attrs.get("metadata", "{}"))
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return self._frames.shape
+
+    @property
+    def source(self) -> Dict[str, Any]:
+        """Size and modification time of the file the cache was made from"""
+        return json.loads(self._frames.attrs.get("source", "{}"))
+
+    def read(
+        self,
+        x: slice = slice(None),
+        y: slice = slice(None),
+        t: slice = slice(None),
+    ) -> da.Array:
+        chunks = self._frames.chunks or "auto"
+        return da.from_array(self._frames, chunks=chunks)[x, y, t]
+
+    def close(self) -> None:
+        # Note that the lazy frames returned by read are no longer valid
+        self._file.close()
+
+
+class MPSReader(FrameReader):
+    """Reader for the formats supported by :class:`mps.MPS`, e.g
+    nd2 and czi files. These files are decoded into memory, so
+    use :func:`open_reader` with `cache=True` to store the decoded
+    frames in a chunked HDF5 file that can be read lazily."""
+
+    def __init__(self, path: utils.PathLike) -> None:
+        import mps
+
+        super().__init__(path)
+        data = mps.MPS(self.path).data
+        self._frames = data.frames
+        self.time_stamps = np.asarray(data.time_stamps)
+        self.info = dict(data.info)
+        self.pacing = data.pacing
+        self.metadata = data.metadata or {}
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        return self._frames.shape
+
+    def read(
+        self,
+        x: slice = slice(None),
+        y: slice = slice(None),
+        t: slice = slice(None),
+    ) -> np.ndarray:
+        return _select(self._frames, x, y, t)
+
+
+def file_stamp(path: utils.PathLike) -> Dict[str, int]:
+    """Size and modification time of a file, used to detect changes"""
+    stat = Path(path).stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def write_h5(
+    path: utils.PathLike,
+    reader: FrameReader,
+    chunks: Tuple[int, int, int] = (128, 128, 32),
+) -> None:
+    """Write the frames in `reader` to a chunked HDF5 file
+    that can be read with :class:`H5Reader`
+
+    Parameters
+    ----------
+    path : utils.PathLike
+        Path to the HDF5 file
+    reader : FrameReader
+        The reader
+    chunks : Tuple[int, int, int], optional
+        Chunk size of the frames in the file, by default (128, 128, 32)
+    """
+    if not has_h5py:
+        raise ImportError("Cannot write HDF5 files. Please install h5py")
+    chunks = tuple(min(c, s) for c, s in zip(chunks, reader.shape))
+    frames = reader.read()
+    path = Path(path)
+    logger.info(f"Write frames to {path}")
+    # Write to a new file and replace the old one in the end, since
+    # the old file may still be open by someone reading the frames
+    tmp_path = path.with_name(path.name + ".tmp")
+    with h5py.File(tmp_path, "w") as f:
+        dataset = f.create_dataset("frames", shape=reader.shape, dtype=frames.dtype, chunks=chunks)
+        # Write one block of frames at the time to keep memory usage low
+        for start in range(0, reader.shape[2], chunks[2]):
+            dataset[:, :, start : start + chunks[2]] = np.asarray(frames[:, :, start : start + chunks[2]])
+        f.create_dataset("time_stamps", data=reader.time_stamps)
+        if reader.pacing is not None:
+            f.create_dataset("pacing", data=reader.pacing)
+        dataset.attrs["info"] = json.dumps(reader.info, default=str)
+        dataset.attrs["metadata"] = json.dumps(reader.metadata, default=str)
+        dataset.attrs["source"] = json.dumps(file_stamp(reader.path))
+    os.replace(tmp_path, path)
+
+
+def is_memmappable(path: utils.PathLike) -> bool:
+    """Return True if the `.npy` file in `path` holds a
+    plain array that can be memory mapped"""
+    with open(path, "rb") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            _, _, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            _, _, dtype = np.lib.format.read_array_header_2_0(f)
+    return not dtype.hasobject
+
+
+def cache_path(path: utils.PathLike) -> Path:
+    """Path to the HDF5 cache of the recording in `path`"""
+    path = Path(path)
+    return path.with_name(path.name + CACHE_SUFFIX)
+
+
+def open_reader(
+    path: utils.PathLike,
+    cache: Union[bool, utils.PathLike] = False,
+) -> FrameReader:
+    """Open a reader for the file in `path`
+
+    Parameters
+    ----------
+    path : utils.PathLike
+        Path to the file
+    cache : Union[bool, utils.PathLike], optional
+        If True, or a path, keep the decoded frames in a chunked HDF5
+        file, by default next to the recording. The cache is created the
+        first time and used as long as the recording is unchanged. Plain
+        `.npy` arrays are memory mapped and never cached, by default False
+
+    Returns
+    -------
+    FrameReader
+        The reader
+    """
+    path = Path(path)
+    if path.suffix == ".h5":
+        return H5Reader(path)
+    if path.suffix == ".npy" and (not cache or is_memmappable(path)):
+        return NpyReader(path)
+    if not cache:
+        return MPSReader(path)
+
+    h5_path = cache_path(path) if cache is True else Path(cache)
+    if h5_path.is_file():
+        reader = H5Reader(h5_path)
+        if reader.source == file_stamp(path):
+            logger.debug(f"Use cached frames in {h5_path}")
+            return reader
+        logger.info(f"Cached frames in {h5_path} are out of date")
+        reader.close()
+
+    write_h5(h5_path, NpyReader(path) if path.suffix == ".npy" else MPSReader(path))
+    return H5Reader(h5_path)
+
+
+def load_data(
+    path: Union[utils.PathLike, FrameReader],
+    start_x: Optional[int] = None,
+    end_x: Optional[int] = None,
+    start_y: Optional[int] = None,
+    end_y: Optional[int] = None,
+    start_t: Optional[float] = None,
+    end_t: Optional[float] = None,
+    cache: Union[bool, utils.PathLike] = False,
+) -> utils.MPSData:
+    """Load the frames in a region and time window of a recording.
+    Only the selected frames are read from the file, and the frames
+    are kept lazy (memory mapped or as a dask array) when possible.
+
+    Parameters
+    ----------
+    path : Union[utils.PathLike, FrameReader]
+        Path to the recording, or a reader
+    start_x : Optional[int], optional
+        Start of the region in the first dimension, by default 0
+    end_x : Optional[int], optional
+        End of the region in the first dimension, by default the end
+    start_y : Optional[int], optional
+        Start of the region in the second dimension, by default 0
+    end_y : Optional[int], optional
+        End of the region in the second dimension, by default the end
+    start_t : Optional[float], optional
+        Start time of the window, by default the first time stamp
+    end_t : Optional[float], optional
+        End time of the window, by default the last time stamp
+    cache : Union[bool, utils.PathLike], optional
+        Cache the decoded frames in a HDF5 file, see :func:`open_reader`
+
+    Returns
+    -------
+    utils.MPSData
+        The data
+    """
+    reader = path if isinstance(path, FrameReader) else open_reader(path, cache=cache)
+
+    t = time_window(reader.time_stamps, start_t, end_t)
+    frames = reader.read(x=slice(start_x, end_x), y=slice(start_y, end_y), t=t)
+
+    info = dict(reader.info)
+    info["size_x"], info["size_y"], info["num_frames"] = frames.shape
+    pacing = None if reader.pacing is None else np.asarray(reader.pacing)[t]
+    return utils.MPSData(
+        frames=frames,
+        time_stamps=reader.time_stamps[t],
+        info=info,
+        pacing=pacing,
+        metadata=reader.metadata,
+    )
@@ -3,13 +3,13 @@ from typing import Optional
 from typing import Tuple
 
 import cv2
-import dask
 import dask.array as da
 import numpy as np
+import scipy.sparse
 import scipy.spatial
-import tqdm
-from dask.diagnostics import ProgressBar
+from scipy.interpolate import CloughTocher2DInterpolator
 
+from . import profiling
 from . import utils
 
 logger = logging.getLogger(__name__)
@@ -23,35 +23,92 @@ INTERPOLATION_METHODS = {
 }
 
 
-def resize_vectors(vectors, new_shape):
+def _resize_block(
+    frames: np.ndarray,
+    width: int,
+    height: int,
+    interpolation: int,
+) -> np.ndarray:
+    """Resize the first two axes of `frames` by resizing blocks of
+    frames as multichannel images"""
+    shape = frames.shape
+    frames = frames.reshape(shape[:2] + (-1,))
+    resized = np.empty((width, height, frames.shape[2]), dtype=frames.dtype)
+    # Area interpolation only supports up to four channels
+    step = 4 if interpolation == cv2.INTER_AREA else utils.MAX_OPENCV_CHANNELS
+    for i in range(0, frames.shape[2], step):
+        resized[:, :, i : i + step] = cv2.resize(
+            np.ascontiguousarray(frames[:, :, i : i + step]),
+            (height, width),
+            interpolation=interpolation,
+        ).reshape(width, height, -1)
+    return resized.reshape((width, height) + shape[2:])
+
+
+def resize_vectors(vectors: utils.Array, new_shape: Tuple[int, int]) -> utils.Array:
+    """Resize vectors of shape (N, M, T, 2) or (N, M, 2)
+    to `new_shape` along the first two axes"""
     if len(vectors.shape) == 4:
-        vec1 = resize_frames(
-            vectors[:, :, :, 0],
-            new_shape=new_shape,
-        )
-        vec2 = resize_frames(
-            vectors[:, :, :, 1],
-            new_shape=new_shape,
-        )
-    else:
-        assert len(vectors.shape) == 3
-        vec1 = resize_frames(
-            vectors[:, :, 0],
-            new_shape=new_shape,
-        )
-        vec2 = resize_frames(
-            vectors[:, :, 1],
-            new_shape=new_shape,
-        )
-    return da.stack([vec1, vec2], axis=-1)
+        return resize_frames(vectors, new_shape=new_shape)
 
+    assert len(vectors.shape) == 3
+    width, height = (int(v) for v in new_shape)
+    if isinstance(vectors, da.Array):
+        vectors = vectors.compute()
+    return _resize_block(vectors, width, height, cv2.INTER_LINEAR)
 
-def resize_data(data: utils.MPSData, scale: float) -> utils.MPSData:
-    new_frames = resize_frames(data.frames, scale)
+
+def resize_data(
+    data: utils.MPSData,
+    scale: float,
+    interpolation_method: str = "linear",
+) -> utils.MPSData:
+    """Resize the frames in `data`.
+
+    The resized frames are stored in the cache of `data`, so
+    resizing the same data to the same scale again is free.
+
+    Parameters
+    ----------
+    data : utils.MPSData
+        The data
+    scale : float
+        Scaling factor
+    interpolation_method : str, optional
+        Interpolation method, by default "linear"
+
+    Returns
+    -------
+    utils.MPSData
+        Data with resized frames
+    """
+    if scale == 1.0:
+        return data
+
+    def resize():
+        with profiling.stage("resize", num_frames=data.num_frames):
+            frames = resize_frames(data.frames, scale, interpolation_method=interpolation_method)
+        if isinstance(frames, np.ndarray):
+            # The frames are shared by all users of the cache
+            frames.setflags(write=False)
+        return frames
+
+    cache = getattr(data, "cache", None)
+    if cache is None:
+        new_frames = resize()
+    else:
+        key = data._cache_key("resize", scale, interpolation_method)
+        new_frames = cache.get_or_compute(key, resize)
     info = data.info.copy()
     info["um_per_pixel"] /= scale
     info["size_x"], info["size_y"], info["num_frames"] = new_frames.shape
-    return utils.MPSData(new_frames, data.time_stamps, info)
+    new_data = utils.MPSData(new_frames, data.time_stamps, info)
+    if cache is not None:
+        # Share the cache so that e.g the uint8 frames of the resized
+        # data are kept when resizing the same data again
+        new_data._cache = cache
+        new_data._cache_prefix = key
+    return new_data
 
 
 def subsample_time(data: utils.MPSData, step: int) -> utils.MPSData:
@@ -101,54 +158,112 @@ def reshape_lk(reference_points: np.ndarray, flows: utils.Array) -> utils.Array:
 
 
 def resize_frames(
-    frames: np.ndarray,
+    frames: utils.Array,
     scale: float = 1.0,
     new_shape: Optional[Tuple[int, int]] = None,
-    interpolation_method="nearest",
-) -> np.ndarray:
+    interpolation_method="linear",
+) -> utils.Array:
+    """Resize frames along the first two axes
+
+    Blocks of frames are treated as the channels of a single image,
+    so that many frames are resized in one call to OpenCV. Dask arrays are resized
+    lazily, one time chunk at the time.
+
+    Parameters
+    ----------
+    frames : utils.Array
+        Frames of shape (N, M), (N, M, T) or (N, M, T, ...)
+    scale : float, optional
+        Scaling factor, by default 1.0
+    new_shape : Optional[Tuple[int, int]], optional
+        The new spatial shape, which takes precedence over `scale`,
+        by default None
+    interpolation_method : str, optional
+        Interpolation method, by default "linear". A single frame
+        of shape (N, M) is always resized with linear interpolation.
+
+    Returns
+    -------
+    utils.Array
+        The resized frames, of the same type as the input
+    """
     logger.debug("Resize frames")
     msg = f"Expected interpolation method to be one of {INTERPOLATION_METHODS.keys()}, got {interpolation_method}"
     assert interpolation_method in INTERPOLATION_METHODS, msg
-    if scale != 1.0 or new_shape is not None:
-        if len(frames.shape) == 2:
-            w, h = frames.shape
-        else:
-            w, h, num_frames = frames.shape
-
-        if new_shape is not None:
-            assert len(new_shape) == 2
-            width, height = new_shape
-        else:
-            width = int(w * scale)
-            height = int(h * scale)
-
-        width = int(width)
-        height = int(height)
-
-        if len(frames.shape) == 2:
-            return cv2.resize(frames, (height, width))
-
-        all_resized_frames = []
-        for i in range(num_frames):
-            all_resized_frames.append(
-                dask.delayed(cv2.resize)(
-                    frames[:, :, i],
-                    (height, width),
-                    INTERPOLATION_METHODS[interpolation_method],
-                ),
-            )
-        with ProgressBar(out=utils.LoggerWrapper(logger, logging.INFO)):
-            resized_frames = da.stack(
-                *da.compute(all_resized_frames),
-                axis=-1,
-            ).compute()
+    if scale == 1.0 and new_shape is None:
+        return frames.copy()
 
+    w, h = frames.shape[:2]
+    if new_shape is not None:
+        assert len(new_shape) == 2
+        width, height = new_shape
     else:
-        resized_frames = frames.copy()
+        width = int(w * scale)
+        height = int(h * scale)
+
+    width = int(width)
+    height = int(height)
+
+    if len(frames.shape) == 2:
+        return cv2.resize(frames, (height, width))
+
+    interpolation = INTERPOLATION_METHODS[interpolation_method]
+    if isinstance(frames, da.Array):
+        frames = frames.rechunk({i: -1 for i in range(frames.ndim) if i != 2})
+        return frames.map_blocks(
+            _resize_block,
+            chunks=((width,), (height,)) + frames.chunks[2:],
+            dtype=frames.dtype,
+            width=width,
+            height=height,
+            interpolation=interpolation,
+        )
+
+    resized_frames = _resize_block(frames, width, height, interpolation)
     logger.info("Done resizing")
     return resized_frames
 
 
+def linear_interpolation_operator(
+    tri: scipy.spatial.Delaunay,
+    xi: np.ndarray,
+) -> Tuple[scipy.sparse.csr_matrix, np.ndarray]:
+    """Sparse operator for piecewise linear interpolation from
+    the vertices of a triangulation to the points `xi`
+
+    Parameters
+    ----------
+    tri : scipy.spatial.Delaunay
+        Triangulation of the data points
+    xi : np.ndarray
+        Points to interpolate to of shape (num_points, 2)
+
+    Returns
+    -------
+    Tuple[scipy.sparse.csr_matrix, np.ndarray]
+        The operator of shape (len(xi), number of data points),
+        holding the barycentric coordinates of each point, and a
+        boolean array which is False for the points outside the
+        convex hull of the data points.
+    """
+    simplex = tri.find_simplex(xi)
+    inside = simplex >= 0
+    transform = tri.transform[simplex[inside]]
+    barycentric = np.einsum(
+        "ijk,ik->ij",
+        transform[:, :2],
+        xi[inside] - transform[:, 2],
+    )
+    weights = np.column_stack([barycentric, 1 - barycentric.sum(axis=1)])
+    rows = np.repeat(np.nonzero(inside)[0], 3)
+    cols = tri.simplices[simplex[inside]].ravel()
+    operator = scipy.sparse.csr_matrix(
+        (weights.ravel(), (rows, cols)),
+        shape=(len(xi), tri.npoints),
+    )
+    return operator, inside
+
+
 def interpolate_lk_flow(
     disp: np.ndarray,
     reference_points: np.ndarray,
@@ -161,10 +276,16 @@ def interpolate_lk_flow(
     interpolates the data onto a given size, i.e
     the original size of the image.
 
+    The reference points are only triangulated once, and
+    all frames and components are interpolated at the same time.
+    Points outside the convex hull of the reference points are
+    set to NaN, except for the 'nearest' method.
+
     Parameters
     ----------
     disp : np.ndarray
         The flow or displacement from LK algorithm
+        of shape (num_points, 2, num_frames)
     reference_points : np.ndarray
         Reference points
     size_x : int
@@ -172,37 +293,35 @@ def interpolate_lk_flow(
     size_y : int
         Size of the output in y-direction
     interpolation_method : str
-        Method for interpolation, by default 'linear'
+        Method for interpolation, either 'nearest', 'linear'
+        or 'cubic', by default 'linear'
 
     Returns
     -------
     np.ndarray
-        Interpolated values
+        Interpolated values of shape (size_y, size_x, 2, num_frames)
     """
     num_frames = disp.shape[-1]
-    from scipy.interpolate import griddata
-
-    disp_full = np.zeros((size_y, size_x, 2, num_frames))
-    ref_points = np.squeeze(reference_points)
+    ref_points = np.squeeze(reference_points).astype(float)
     grid_x, grid_y = np.meshgrid(np.arange(size_x), np.arange(size_y))
-    # TODO: This could be parallelized
-    for i in tqdm.tqdm(range(num_frames)):
-        values_x = disp[:, 0, i]
-        values_y = disp[:, 1, i]
-
-        disp_full[:, :, 0, i] = griddata(
-            ref_points,
-            values_x,
-            (grid_y, grid_x),
-            method=interpolation_method,
-        )
-        disp_full[:, :, 1, i] = griddata(
-            ref_points,
-            values_y,
-            (grid_y, grid_x),
-            method=interpolation_method,
-        )
-    return disp_full
+    xi = np.column_stack([grid_y.ravel(), grid_x.ravel()]).astype(float)
+    values = np.asarray(disp).reshape(len(ref_points), -1)
+
+    if interpolation_method == "nearest":
+        _, index = scipy.spatial.cKDTree(ref_points).query(xi)
+        disp_full = values[index]
+    else:
+        tri = scipy.spatial.Delaunay(ref_points)
+        if interpolation_method == "linear":
+            operator, inside = linear_interpolation_operator(tri, xi)
+            disp_full = operator @ values
+            disp_full[~inside] = np.nan
+        elif interpolation_method == "cubic":
+            disp_full = CloughTocher2DInterpolator(tri, values)(xi)
+        else:
+            raise ValueError(f"Unknown interpolation method {interpolation_method!r}")
+
+    return disp_full.reshape(size_y, size_x, 2, num_frames)
 
 
 def rbfinterp2d_map(args):
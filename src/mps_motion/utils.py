@@ -1,11 +1,15 @@
 import logging
 import os
 import sys
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
 from typing import Union
 
 import dask.array as da
 import numpy as np
 
+from . import profiling
 
 logger = logging.getLogger(__name__)
 
@@ -19,8 +23,8 @@ except ImportError:
     logger.debug(msg)
     prange = range
 
-    # Create a dummy decorator
-    def jit(**params):
+    # Create a dummy decorator, used as either @jit or @jit(...)
+    def jit(*args, **params):
         def decorator(f):
             logger.warning(
                 "You are trying to call a numba function, but numba is not installed",
@@ -31,9 +35,99 @@ except ImportError:
 
             return wrap
 
+        if len(args) == 1 and callable(args[0]) and not params:
+            return decorator(args[0])
         return decorator
 
 
+# Environment variables controlling the size of the thread pools in
+# the numerical libraries (BLAS, OpenMP, numba)
+THREAD_ENV_VARIABLES = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "NUMBA_NUM_THREADS",
+)
+
+
+def limit_threads(num_threads: int) -> None:
+    """Limit the number of threads used by OpenCV, dask, numba and
+    the libraries reading the thread environment variables in
+    this process. Useful when several processes share the cores.
+
+    Parameters
+    ----------
+    num_threads : int
+        Maximum number of threads
+    """
+    import cv2
+    import dask
+
+    for name in THREAD_ENV_VARIABLES:
+        os.environ[name] = str(num_threads)
+    cv2.setNumThreads(num_threads)
+    dask.config.set(num_workers=num_threads)
+    try:
+        import numba
+
+        numba.set_num_threads(min(num_threads, numba.config.NUMBA_NUM_THREADS))
+    except ImportError:
+        pass
+
+
+# Types of the frames the numba kernels are compiled for by :func:`warmup`
+WARMUP_DTYPES = ("uint8", "uint16", "float32", "float64")
+
+
+def warmup(dtypes: Sequence[str] = WARMUP_DTYPES) -> None:
+    """Compile the numba kernels for frames of the given types.
+
+    The kernels are cached on disk, so this only has to be done once
+    (e.g with `mps-motion warmup` after installing) and later processes,
+    including the workers used for block matching, load the compiled
+    kernels instead of compiling them on their first call.
+
+    Parameters
+    ----------
+    dtypes : Sequence[str], optional
+        Types of the frames, by default WARMUP_DTYPES
+    """
+    from . import block_matching
+    from . import filters
+    from . import frame_sequence as fs
+    from . import motion_tracking as mt
+    from .execution import ExecutionConfig
+
+    with ExecutionConfig(scheduler="synchronous"):
+        for dtype in dtypes:
+            logger.info(f"Compile kernels for frames of type {dtype}")
+            frames = np.ones((4, 4, 3), dtype=dtype)
+            read_only = frames.copy()
+            read_only.setflags(write=False)
+            # The reference image is either a frame, the mean of three
+            # frames or a statistic of all frames, e.g the median
+            for reference_frame in ("0", "median"):
+                reference_image = mt.get_reference_image(reference_frame, frames, np.arange(3))
+                for f in (frames, read_only):
+                    block_matching.get_displacements(
+                        f,
+                        reference_image,
+                        block_size=2,
+                        max_block_movement=1,
+                        resize=False,
+                    )
+
+        for dtype in ("float32", "float64"):
+            fs.FrameSequence(np.ones((4, 4, 5), dtype=dtype)).amplitude_mask()
+            filters.threshold_norm(np.ones((4, 4, 3, 2), dtype=dtype), np, vmin=0.5, vmax=1.0)
+
+
+# Maximum number of channels OpenCV accepts in one image. This
+# is 512 in OpenCV 4 but only 128 in OpenCV 5.
+MAX_OPENCV_CHANNELS = 128
+
+
 class ShapeError(RuntimeError):
     pass
 
@@ -101,8 +195,20 @@ def check_frame_dimensions(frames, reference_image):
     return frames
 
 
+# Default memory budget for the frames cached on MPSData
+DEFAULT_CACHE_BYTES = 2 * 1024**3
+
+
 class MPSData:
-    def __init__(self, frames, time_stamps, info, pacing=None, metadata=None) -> None:
+    def __init__(
+        self,
+        frames,
+        time_stamps,
+        info,
+        pacing=None,
+        metadata=None,
+        max_cache_bytes: Optional[int] = DEFAULT_CACHE_BYTES,
+    ) -> None:
         self.frames = frames
         self.time_stamps = time_stamps
         self.info = info
@@ -112,6 +218,62 @@ class MPSData:
         if metadata is None:
             metadata = {}
         self.metadata = metadata
+        self.max_cache_bytes = max_cache_bytes
+        self._cache = None
+        # Prefix of the keys used by this object in the cache, which
+        # is shared with the data derived from it (e.g resized data)
+        self._cache_prefix: tuple = ()
+
+    @property
+    def cache(self):
+        """Cache for frames derived from these frames, e.g the
+        downscaled frames from :func:`scaling.resize_data`. The cache
+        is shared by everyone using this object and holds at most
+        `max_cache_bytes` bytes."""
+        if self._cache is None:
+            from .cache import FieldCache
+
+            self._cache = FieldCache(max_bytes=self.max_cache_bytes)
+        return self._cache
+
+    def _cache_key(self, *key) -> tuple:
+        return self._cache_prefix + key
+
+    def intensity_range(
+        self,
+        percentiles: Optional[Tuple[float, float]] = None,
+    ) -> Tuple[float, float]:
+        """Cached intensity range of the frames, see :func:`intensity_range`"""
+        if percentiles is not None:
+            percentiles = tuple(percentiles)
+        return self.cache.get_or_compute(
+            self._cache_key("intensity_range", percentiles),
+            lambda: intensity_range(self.frames, percentiles),
+        )
+
+    def frames_uint8(
+        self,
+        percentiles: Optional[Tuple[float, float]] = None,
+    ) -> Array:
+        """The frames converted to uint8 using the intensity range from
+        :meth:`intensity_range`. The result is cached, so the frames are
+        only converted once for all the motion tracking algorithms."""
+        if self.frames.dtype == np.uint8:
+            return self.frames
+        if percentiles is not None:
+            percentiles = tuple(percentiles)
+
+        def convert():
+            with profiling.stage("uint8", num_frames=self.num_frames):
+                frames = to_uint8(self.frames, *self.intensity_range(percentiles))
+                if isinstance(frames, da.Array):
+                    # Lazy frames are read once here instead of in every task
+                    frames = frames.compute()
+            # The frames are shared by all users of the cache
+            frames.setflags(write=False)
+            return frames
+
+        return self.cache.get_or_compute(self._cache_key("uint8", percentiles), convert)
 
     @property
     def size_x(self):
@@ -130,9 +292,126 @@ class MPSData:
         return int(1000 / np.mean(np.diff(self.time_stamps)))
 
 
-def to_uint8(img):
-    img_float = img.astype(float)
-    return (256 * (img_float / max(img_float.max(), 1e-12))).astype(np.uint8)
+def intensity_range(
+    frames: Array,
+    percentiles: Optional[Tuple[float, float]] = None,
+    max_samples: int = 1_000_000,
+) -> Tuple[float, float]:
+    """Intensity range used to convert `frames` to uint8.
+
+    Parameters
+    ----------
+    frames : Array
+        The frames
+    percentiles : Optional[Tuple[float, float]], optional
+        Lower and upper percentile of the range, e.g (1, 99). By
+        default None, meaning the range goes from 0 to the global maximum
+    max_samples : int, optional
+        The percentiles are estimated from an evenly strided subset
+        of the frames with at most this number of pixels, by default 1_000_000
+
+    Returns
+    -------
+    Tuple[float, float]
+        The lower and upper value of the range
+    """
+    if percentiles is None:
+        vmax = frames.max()
+        if isinstance(vmax, da.Array):
+            vmax = vmax.compute()
+        return 0.0, float(vmax)
+
+    step = max(int(np.ceil((frames.size / max_samples) ** (1 / 3))), 1)
+    sample = np.asarray(frames[::step, ::step, ::step], dtype=np.float32)
+    vmin, vmax = np.percentile(sample, percentiles)
+    return float(vmin), float(vmax)
+
+
+def _to_uint8_block(block, vmin: float, vmax: float) -> np.ndarray:
+    # Split the range in 256 bins of equal width, the maximum
+    # value ends up in bin 256 and is clipped to the last one
+    scale = 256.0 / max(vmax - vmin, 1e-12)
+    block = (block.astype(np.float32) - vmin) * scale
+    return np.clip(block, 0, 255, out=block).astype(np.uint8)
+
+
+def to_uint8(
+    img: Array,
+    vmin: Optional[float] = None,
+    vmax: Optional[float] = None,
+    chunk_size: int = 64,
+) -> Array:
+    """Convert an image or a stack of frames to uint8 by splitting
+    the range [vmin, vmax] into 256 levels. Values outside the range
+    are clipped.
+
+    Parameters
+    ----------
+    img : Array
+        The image or frames
+    vmin : Optional[float], optional
+        Value mapped to 0, by default 0
+    vmax : Optional[float], optional
+        Value mapped to 255, by default the maximum value of `img`
+    chunk_size : int, optional
+        Number of frames converted at once for numpy arrays of
+        frames, by default 64
+
+    Returns
+    -------
+    Array
+        The converted image
+    """
+    if vmin is None:
+        vmin = 0.0
+    if vmax is None:
+        vmax = intensity_range(img)[1]
+
+    if isinstance(img, da.Array):
+        return img.map_blocks(_to_uint8_block, vmin, vmax, dtype=np.uint8)
+
+    img = np.asarray(img)
+    if img.ndim < 3:
+        return _to_uint8_block(img, vmin, vmax)
+
+    # Convert a few frames at the time to avoid a float copy of the full stack
+    out = np.empty(img.shape, dtype=np.uint8)
+    for start in range(0, img.shape[2], chunk_size):
+        out[:, :, start : start + chunk_size] = _to_uint8_block(
+            img[:, :, start : start + chunk_size],
+            vmin,
+            vmax,
+        )
+    return out
+
+
+def frames_to_uint8(
+    frames: Array,
+    reference_image: Array,
+    percentiles: Optional[Tuple[float, float]] = None,
+) -> Tuple[Array, np.ndarray]:
+    """Convert the frames and the reference image to uint8 using the
+    same intensity range, which is computed from the frames. Nothing
+    is done if both are already uint8.
+
+    Parameters
+    ----------
+    frames : Array
+        The frames
+    reference_image : Array
+        The reference image
+    percentiles : Optional[Tuple[float, float]], optional
+        Percentiles used for the intensity range, see :func:`intensity_range`
+
+    Returns
+    -------
+    Tuple[Array, np.ndarray]
+        The converted frames and reference image
+    """
+    if frames.dtype == np.uint8 and reference_image.dtype == np.uint8:
+        return frames, np.asarray(reference_image)
+    vmin, vmax = intensity_range(frames, percentiles)
+    return to_uint8(frames, vmin, vmax), to_uint8(np.asarray(reference_image), vmin, vmax)
 
 
 def ca_transient(
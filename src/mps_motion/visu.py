@@ -1,6 +1,16 @@
+import collections
+import concurrent.futures
+import functools
 import logging
+import os
 from pathlib import Path
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+from typing import List
 from typing import Optional
+from typing import Tuple
+from typing import TypeVar
 from typing import Union
 
 import cv2
@@ -9,32 +19,47 @@ import matplotlib.pyplot as plt
 import numpy as np
 import tqdm
 
+from . import execution
 from . import frame_sequence as fs
+from . import profiling
 from . import scaling
 from . import utils
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+S = TypeVar("S")
 
-def apply_custom_colormap(image_gray, cmap=plt.get_cmap("seismic")):
-    assert image_gray.dtype == np.uint8, "must be np.uint8 image"
-    if image_gray.ndim == 3:
-        image_gray = image_gray.squeeze(-1)
 
+def _colormap_lut(cmap) -> np.ndarray:
     # Initialize the matplotlib color map
     sm = plt.cm.ScalarMappable(cmap=cmap)
 
     # Obtain linear color range
     color_range = sm.to_rgba(np.linspace(0, 1, 256))[:, 0:3]  # color range RGBA => RGB
     color_range = (color_range * 255.0).astype(np.uint8)  # [0,1] => [0,255]
-    color_range = np.squeeze(
-        np.dstack([color_range[:, 2], color_range[:, 1], color_range[:, 0]]),
-        0,
-    )  # RGB => BGR
+    # RGB => BGR, with shape (1, 256, 3) as expected by cv2.LUT
+    return np.ascontiguousarray(color_range[None, :, ::-1])
+
+
+@functools.lru_cache(maxsize=None)
+def colormap_lut(cmap: str) -> np.ndarray:
+    """Lookup table with the BGR colors of the named
+    colormap `cmap` for each uint8 value. The tables are
+    computed once for each colormap."""
+    lut = _colormap_lut(plt.get_cmap(cmap))
+    lut.setflags(write=False)
+    return lut
+
+
+def apply_custom_colormap(image_gray, cmap="seismic"):
+    assert image_gray.dtype == np.uint8, "must be np.uint8 image"
+    if image_gray.ndim == 3:
+        image_gray = image_gray.squeeze(-1)
 
-    # Apply colormap for each channel individually
-    channels = [cv2.LUT(image_gray, color_range[:, i]) for i in range(3)]
-    return np.dstack(channels)
+    lut = colormap_lut(cmap) if isinstance(cmap, str) else _colormap_lut(cmap)
+    # Apply colormap to all channels at once
+    return cv2.LUT(cv2.cvtColor(image_gray, cv2.COLOR_GRAY2BGR), lut)
 
 
 def colorize(img, vmin=None, vmax=None, factor=1, cmap="bwr"):
@@ -43,7 +68,7 @@ def colorize(img, vmin=None, vmax=None, factor=1, cmap="bwr"):
     vmax = np.max(img) if vmax is None else vmax
     img = (img - vmin) / (vmax - vmin)
     img = (img * 255).astype(np.uint8)
-    img = apply_custom_colormap(img, cmap=plt.get_cmap(cmap))
+    img = apply_custom_colormap(img, cmap=cmap)
 
     # img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
     if factor != 1:
@@ -86,12 +111,22 @@ def draw_flow(image, flow, step=16, scale: float = 1.0, thickness: int = 2):
     [type]
         [description]
     """
-    h, w = image.shape[:2]
-    y, x = np.mgrid[step / 2 : h : step, step / 2 : w : step].reshape(2, -1).astype(int)
+    y, x = quiver_grid(image.shape[:2], step)
     fx, fy = flow[y, x].T
     return _draw_flow(image, x, y, scale * fx, scale * fy, thickness=thickness)
 
 
+@functools.lru_cache(maxsize=16)
+def quiver_grid(shape: Tuple[int, int], step: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Row and column indices of the arrows drawn by :func:`draw_flow`
+    in a frame of the given shape, which are computed once for all frames"""
+    h, w = shape
+    y, x = np.mgrid[step / 2 : h : step, step / 2 : w : step].reshape(2, -1).astype(int)
+    y.setflags(write=False)
+    x.setflags(write=False)
+    return y, x
+
+
 def draw_hsv(flow):
     h, w = flow.shape[:2]
     magnitude, angle = cv2.cartToPolar(flow[..., 0], flow[..., 1])
@@ -113,9 +148,196 @@ def draw_hsv(flow):
     return rgb
 
 
+class VideoWriter:
+    """Write BGR frames to an mp4 file one frame at a time.
+
+    The frames are piped directly into a single H.264 encode with
+    ffmpeg if `imageio-ffmpeg` is installed, so the video can be played
+    in a browser without converting it afterwards. Otherwise the frames
+    are encoded with OpenCV using the mp4v codec.
+
+    Parameters
+    ----------
+    path : utils.PathLike
+        Path to the video, the suffix is replaced by .mp4
+    fps : float
+        Frames per second
+    width : int
+        Width of the frames
+    height : int
+        Height of the frames
+    """
+
+    def __init__(self, path: utils.PathLike, fps: float, width: int, height: int) -> None:
+        self.path = Path(path).with_suffix(".mp4")
+        self.fps = fps
+        self.width = width
+        self.height = height
+        if self.path.is_file():
+            self.path.unlink()
+
+        try:
+            import imageio_ffmpeg
+        except ImportError:
+            logger.debug("imageio-ffmpeg not found, encode video with OpenCV")
+            self.backend = "opencv"
+            fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+            self._writer = cv2.VideoWriter(self.path.as_posix(), fourcc, fps, (width, height))
+        else:
+            self.backend = "ffmpeg"
+            self._writer = imageio_ffmpeg.write_frames(
+                self.path.as_posix(),
+                (width, height),
+                pix_fmt_in="bgr24",
+                fps=fps,
+                codec="libx264",
+                macro_block_size=2,
+            )
+            self._writer.send(None)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(path={self.path}, backend={self.backend})"
+
+    def __enter__(self) -> "VideoWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def write(self, frame: np.ndarray) -> None:
+        """Write a BGR frame of shape (height, width, 3) and type uint8"""
+        if frame.shape != (self.height, self.width, 3):
+            raise ValueError(
+                f"Expected frame of shape {(self.height, self.width, 3)}, got {frame.shape}",
+            )
+        if self.backend == "ffmpeg":
+            self._writer.send(np.ascontiguousarray(frame))
+        else:
+            self._writer.write(frame)
+
+    def close(self) -> None:
+        if self.backend == "ffmpeg":
+            self._writer.close()
+        else:
+            self._writer.release()
+
+
+def render_frames(
+    render: Callable[..., S],
+    items: Iterable[T],
+    num_workers: Optional[int] = None,
+) -> Iterator[S]:
+    """Render the frames in a thread pool and yield them in order.
+
+    OpenCV releases the GIL while drawing, so the frames are rendered
+    in parallel while the encoder consumes them. At most two frames
+    per worker are rendered ahead of the encoder, so only a few frames
+    are kept in memory.
+
+    Parameters
+    ----------
+    render : Callable[..., S]
+        Function rendering a frame, called as `render(*item)`
+    items : Iterable[T]
+        Arguments to `render` for each frame
+    num_workers : Optional[int], optional
+        Number of threads, by default the number of workers in the
+        active execution configuration or the number of cores. The
+        frames are rendered serially with the synchronous scheduler.
+
+    Yields
+    ------
+    S
+        The rendered frames in the same order as `items`
+    """
+    config = execution.get_config()
+    num_workers = num_workers or config.num_workers or os.cpu_count() or 1
+    if num_workers == 1 or config.scheduler == execution.Scheduler.synchronous:
+        for item in items:
+            yield render(*item)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        pending: collections.deque = collections.deque()
+        for item in items:
+            pending.append(executor.submit(render, *item))
+            if len(pending) >= 2 * num_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def time_chunks(
+    array: Union[utils.Array, fs.FrameSequence],
+    axis: int = 2,
+    chunk_size: Optional[int] = None,
+) -> List[Tuple[int, int]]:
+    """Start and stop of the chunks along the time axis
+    that the videos are rendered in
+
+    Parameters
+    ----------
+    array : Union[utils.Array, fs.FrameSequence]
+        The array
+    axis : int, optional
+        The time axis, by default 2
+    chunk_size : Optional[int], optional
+        Number of frames in each chunk. By default None, meaning
+        the chunk size of the active execution configuration, or the
+        chunks of `array` if it is a dask array, or else 64 frames
+
+    Returns
+    -------
+    List[Tuple[int, int]]
+        Start and stop of each chunk
+    """
+    if isinstance(array, fs.FrameSequence):
+        array = array.array
+    num_frames = array.shape[axis]
+    chunk_size = chunk_size or execution.get_config().chunk_size
+    if chunk_size is None and isinstance(array, da.Array):
+        stops = np.cumsum(array.chunks[axis]).tolist()
+        return list(zip([0] + stops[:-1], stops))
+    chunk_size = chunk_size or 64
+    return [(start, min(start + chunk_size, num_frames)) for start in range(0, num_frames, chunk_size)]
+
+
+def load_chunk(
+    array: Union[utils.Array, fs.FrameSequence],
+    start: int,
+    stop: int,
+    axis: int = 2,
+) -> np.ndarray:
+    """Load the frames from `start` to `stop` along `axis` into memory"""
+    if isinstance(array, fs.FrameSequence):
+        fill_value = array.fill_value
+        array = array.array
+    else:
+        fill_value = 0.0
+    index = [slice(None)] * array.ndim
+    index[axis] = slice(start, stop)
+    chunk = array[tuple(index)]
+    if isinstance(chunk, da.Array):
+        (chunk,) = execution.compute(chunk)
+    return utils.unmask(chunk, fill_value=fill_value)
+
+
+def iter_frames(
+    array: Union[utils.Array, fs.FrameSequence],
+    axis: int = 2,
+    chunk_size: Optional[int] = None,
+) -> Iterator[np.ndarray]:
+    """Iterate over the frames of `array` along `axis`, where
+    only one chunk of frames is loaded at a time, see :func:`time_chunks`"""
+    for start, stop in time_chunks(array, axis=axis, chunk_size=chunk_size):
+        chunk = load_chunk(array, start, stop, axis=axis)
+        for i in range(stop - start):
+            yield np.take(chunk, i, axis=axis)
+
+
 def quiver_video(
     data: utils.MPSData,
-    vectors: Union[np.ndarray, fs.VectorFrameSequence],
+    vectors: Union[utils.Array, fs.VectorFrameSequence],
     path: utils.PathLike,
     step: int = 16,
     vector_scale: float = 1.0,
@@ -123,16 +345,48 @@ def quiver_video(
     convert: bool = True,
     offset: int = 0,
     thickness: int = 2,
+    chunk_size: Optional[int] = None,
+    num_workers: Optional[int] = None,
 ) -> None:
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+    """Create a video of the frames with the vectors drawn as arrows.
+
+    The frames and vectors are loaded, rendered and encoded one time
+    chunk at a time, see :class:`VideoWriter`.
+
+    Parameters
+    ----------
+    data : utils.MPSData
+        The data
+    vectors : Union[utils.Array, fs.VectorFrameSequence]
+        The vectors with shape (N, M, T, 2), e.g the displacement
+    path : utils.PathLike
+        Path to the video, the suffix is replaced by .mp4
+    step : int, optional
+        Number of pixels between each arrow, by default 16
+    vector_scale : float, optional
+        Scaling factor for the length of the arrows, by default 1.0
+    frame_scale : float, optional
+        Scaling factor for the frames, by default 1.0
+    convert : bool, optional
+        If True, the frames are transposed to the orientation of the
+        recording, as done by the conversion with imageio in earlier
+        versions, by default True
+    offset : int, optional
+        Number of frames more in `data` than in `vectors`, e.g the
+        spacing used for the velocity, by default 0
+    thickness : int, optional
+        Thickness of the arrows, by default 2
+    chunk_size : Optional[int], optional
+        Number of frames loaded at a time, see :func:`time_chunks`
+    num_workers : Optional[int], optional
+        Number of threads rendering the frames, see :func:`render_frames`
+    """
     if isinstance(vectors, fs.VectorFrameSequence):
-        vectors_np: np.ndarray = vectors.array_np
-    elif isinstance(vectors, da.Array):
-        vectors_np = vectors.compute()
+        shape = vectors.array.shape
     else:
-        vectors_np = vectors
+        shape = vectors.shape
 
-    assert len(vectors_np.shape) == 4
+    assert len(shape) == 4
 
     if frame_scale < 1.0:
         data = scaling.resize_data(data, frame_scale)
@@ -145,103 +399,114 @@ def quiver_video(
 
     # Check shapes
     try:
-        time_axis = vectors_np.shape.index(num_frames)
+        time_axis = shape.index(num_frames)
     except ValueError as ex:
         msg = (
             "Time axis for frames and vetors does not match. "
             f"Got frames of shape {data.frames.shape}, and "
-            f"vector of shape {vectors_np.shape}."
+            f"vector of shape {shape}."
         )
         raise ValueError(msg) from ex
 
-    vector_shape = (
-        vectors_np.shape[0],
-        vectors_np.shape[1],
-        vectors_np.shape[time_axis] + offset,
-    )
+    vector_shape = (shape[0], shape[1], shape[time_axis] + offset)
 
     if not data.frames.shape == vector_shape:
         msg = (
             "Shape of frames and vector does not match. "
             f"Got frames of shape {data.frames.shape}, and "
-            f"vector of shape {vectors_np.shape}."
+            f"vector of shape {shape}."
             f"Expected frames to have shape {vector_shape}."
         )
         raise ValueError(msg)
 
-    p = Path(path).with_suffix(".mp4")
-    if p.is_file():
-        p.unlink()
-    frames = utils.to_uint8(data.frames)
-    out = cv2.VideoWriter(p.as_posix(), fourcc, fps, (width, height))
-    for i in tqdm.tqdm(range(num_frames), desc=f"Create quiver video at {p}"):
-        im = frames[:, :, i]
-        flow = np.take(vectors_np, i, axis=time_axis)
-        out.write(
-            draw_flow(im, flow, step=step, scale=vector_scale, thickness=thickness),
-        )
+    if convert:
+        width, height = height, width
 
-    out.release()
-    cv2.destroyAllWindows()
+    vmin, vmax = data.intensity_range()
 
-    if convert:
-        import imageio
+    def items():
+        for start, stop in time_chunks(vectors, axis=time_axis, chunk_size=chunk_size):
+            frames = utils.to_uint8(load_chunk(data.frames, start, stop), vmin, vmax)
+            flows = load_chunk(vectors, start, stop, axis=time_axis)
+            for i in range(stop - start):
+                yield frames[:, :, i], np.take(flows, i, axis=time_axis)
 
-        tmp_path = p.parent.joinpath(p.stem + "_tmp").with_suffix(".mp4")
-        p.rename(tmp_path)
-        video = imageio.read(tmp_path)
-        imageio.mimwrite(p, [np.swapaxes(d, 0, 1) for d in video.iter_data()], fps=fps)
-        tmp_path.unlink()
+    def render(frame, flow):
+        im = draw_flow(frame, flow, step=step, scale=vector_scale, thickness=thickness)
+        if convert:
+            im = np.ascontiguousarray(np.swapaxes(im, 0, 1))
+        return im
+
+    with profiling.stage("quiver_video", num_frames=num_frames), VideoWriter(path, fps, width, height) as writer:
+        for im in tqdm.tqdm(
+            render_frames(render, items(), num_workers=num_workers),
+            total=num_frames,
+            desc=f"Create quiver video at {writer.path}",
+        ):
+            writer.write(im)
 
 
 def hsv_video(
     path: utils.PathLike,
-    vectors: Union[np.ndarray, fs.VectorFrameSequence],
+    vectors: Union[utils.Array, fs.VectorFrameSequence],
     fps: int = 50,
     axis: int = 2,
     convert: bool = False,
+    chunk_size: Optional[int] = None,
+    num_workers: Optional[int] = None,
 ) -> None:
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+    """Create a video of the vectors, where the hue is the
+    direction and the value is the magnitude of the vectors.
+
+    The frames are rendered in parallel, see :func:`render_frames`.
+    `convert` is ignored, since the video is encoded in a single
+    pass by :class:`VideoWriter`."""
     if isinstance(vectors, fs.VectorFrameSequence):
-        vectors_np: np.ndarray = vectors.array_np
+        shape = vectors.array.shape
     else:
-        vectors_np = vectors
+        shape = vectors.shape
 
-    assert len(vectors_np.shape) == 4
+    assert len(shape) == 4
+    assert shape[3] == 2
 
-    width = vectors_np.shape[1]
-    height = vectors_np.shape[0]
-    assert len(vectors_np.shape) == 3
-    num_frames = vectors_np.shape[axis]
+    width = shape[1]
+    height = shape[0]
+    num_frames = shape[axis]
 
-    p = Path(path).with_suffix(".mp4")
-
-    out = cv2.VideoWriter(p.as_posix(), fourcc, fps, (width, height))
-
-    for i in tqdm.tqdm(range(num_frames), desc=f"Create HSV movie at {p}"):
-        flow = np.take(vectors_np, i, axis=axis)
-        out.write(draw_hsv(flow))
-
-    out.release()
-    cv2.destroyAllWindows()
-
-    if convert:
-        convert_imageio(p, fps)
+    with profiling.stage("hsv_video", num_frames=num_frames), VideoWriter(path, fps, width, height) as writer:
+        for im in tqdm.tqdm(
+            render_frames(
+                draw_hsv,
+                ((flow,) for flow in iter_frames(vectors, axis=axis, chunk_size=chunk_size)),
+                num_workers=num_workers,
+            ),
+            total=num_frames,
+            desc=f"Create HSV movie at {writer.path}",
+        ):
+            writer.write(im)
 
 
 def convert_imageio(path, fps):
+    """Re-encode the video at `path` as H.264"""
     logger.info("Convert video using imageio")
-    import imageio
+    import imageio_ffmpeg
 
+    path = Path(path)
     tmp_path = path.parent.joinpath(path.stem + "_tmp").with_suffix(".mp4")
     path.rename(tmp_path)
-    video = imageio.read(tmp_path)
-    imageio.mimwrite(path, video.iter_data(), fps=fps)
+    reader = imageio_ffmpeg.read_frames(tmp_path.as_posix())
+    meta = reader.__next__()
+    writer = imageio_ffmpeg.write_frames(path.as_posix(), meta["size"], fps=fps, macro_block_size=2)
+    writer.send(None)
+    for frame in reader:
+        writer.send(frame)
+    writer.close()
+    tmp_path.unlink()
 
 
 def heatmap(
     path: utils.PathLike,
-    data: Union[np.ndarray, fs.FrameSequence],
+    data: Union[utils.Array, fs.FrameSequence],
     fps: int = 50,
     axis: int = 2,
     convert: bool = False,
@@ -249,38 +514,50 @@ def heatmap(
     vmax: Optional[float] = None,
     cmap="bwr",
     transpose: bool = False,
+    chunk_size: Optional[int] = None,
+    num_workers: Optional[int] = None,
 ):
+    """Create a video of a scalar field with the colormap `cmap`.
+
+    The frames are rendered in parallel, see :func:`render_frames`.
+    `convert` is ignored, since the video is encoded in a single
+    pass by :class:`VideoWriter`."""
     logger.info("Create heatmap video")
     if isinstance(data, fs.FrameSequence):
-        data_np: np.ndarray = data.array_np
+        shape = data.array.shape
     else:
-        data_np = data
+        shape = data.shape
 
-    vmin = vmin if vmin is not None else data_np.min()
-    vmax = vmax if vmax is not None else data_np.max()
+    assert len(shape) == 3
+    num_frames = shape[axis]
 
-    assert len(data_np.shape) == 3
-    num_frames = data_np.shape[axis]
+    if vmin is None or vmax is None:
+        array = data.array if isinstance(data, fs.FrameSequence) else data
+        data_min, data_max = execution.compute(array.min(), array.max())
+        vmin = vmin if vmin is not None else data_min
+        vmax = vmax if vmax is not None else data_max
 
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-
-    width = data_np.shape[1]
-    height = data_np.shape[0]
+    width = shape[1]
+    height = shape[0]
     if transpose:
-        width = data_np.shape[0]
-        height = data_np.shape[1]
-
-    p = Path(path).with_suffix(".mp4")
-
-    out = cv2.VideoWriter(p.as_posix(), fourcc, fps, (width, height))
-    for i in tqdm.tqdm(range(num_frames), desc=f"Create heatmap movie at {p}"):
-        heat = np.take(data_np, i, axis=axis)
-        if transpose:
-            heat = heat.T
-        out.write(colorize(heat, vmin=vmin, vmax=vmax, cmap=cmap))
-
-    out.release()
-    cv2.destroyAllWindows()
+        width = shape[0]
+        height = shape[1]
+
+    with profiling.stage("heatmap_video", num_frames=num_frames), VideoWriter(path, fps, width, height) as writer:
+
+        def render(heat):
+            if transpose:
+                heat = heat.T
+            return colorize(heat, vmin=vmin, vmax=vmax, cmap=cmap)
+
+        for im in tqdm.tqdm(
+            render_frames(
+                render,
+                ((heat,) for heat in iter_frames(data, axis=axis, chunk_size=chunk_size)),
+                num_workers=num_workers,
+            ),
+            total=num_frames,
+            desc=f"Create heatmap movie at {writer.path}",
+        ):
+            writer.write(im)
     logger.info("Done creating heatmap video")
-    if convert:
-        convert_imageio(p, fps)
@@ -0,0 +1,85 @@
+import gc
+import weakref
+
+import numpy as np
+from mps_motion import frame_sequence as fs
+from mps_motion import Mechanics
+from mps_motion.cache import FieldCache
+
+
+def test_lru_eviction():
+    cache = FieldCache(max_bytes=250)
+    cache["a"] = np.zeros(10)  # 80 bytes
+    cache["b"] = np.zeros(10)
+    cache["c"] = np.zeros(10)
+    assert cache.nbytes == 240
+    # Access 'a' so that 'b' becomes the least recently used
+    cache["a"]
+    cache["d"] = np.zeros(10)
+    assert "b" not in cache
+    assert set(cache) == {"a", "c", "d"}
+    assert cache.nbytes == 240
+
+
+def test_lazy_values_are_not_counted():
+    import dask.array as da
+
+    cache = FieldCache(max_bytes=10)
+    cache["a"] = da.zeros(100)
+    cache["b"] = da.zeros(100)
+    assert cache.nbytes == 0
+    assert len(cache) == 2
+
+
+def test_spill_to_disk(tmp_path):
+    cache = FieldCache(max_bytes=100, spill_dir=tmp_path)
+    a = np.arange(10, dtype=float)
+    cache["a"] = a
+    cache["b"] = np.ones(10)
+    assert cache.nbytes == 80
+    assert isinstance(cache["a"], np.memmap)
+    assert np.array_equal(cache["a"], a)
+    assert len(list(cache.spill_dir.iterdir())) == 1
+
+    cache.clear()
+    assert len(cache) == 0
+    assert len(list(cache.spill_dir.iterdir())) == 0
+
+    spill_dir = cache.spill_dir
+    del cache
+    gc.collect()
+    assert not spill_dir.exists()
+
+
+def test_mechanics_cache():
+    u = np.random.random((10, 12, 5, 2))
+    m = Mechanics(fs.VectorFrameSequence(u), gradient_method="central")
+    assert m.du is m.du
+    assert m.E is m.E
+    assert m.velocity(2) is m.velocity(2)
+    assert m.velocity(1) is not m.velocity(2)
+
+    nbytes = m.cache.nbytes
+    E = m.compute(["E"])["E"]
+    assert m.cache.nbytes == nbytes + E.nbytes
+    assert m.compute(["E"])["E"] is E
+
+    # Changing the gradient method should give new fields
+    du = m.du
+    m.gradient_method = "savgol"
+    assert m.du is not du
+
+
+def test_mechanics_is_released():
+    cache = FieldCache()
+    u = np.random.random((10, 12, 5, 2))
+    m = Mechanics(fs.VectorFrameSequence(u), gradient_method="central", cache=cache)
+    m.velocity()
+    m.compute(["E"])
+    assert len(cache) > 0
+
+    ref = weakref.ref(m)
+    del m
+    gc.collect()
+    assert ref() is None
+    assert len(cache) == 0
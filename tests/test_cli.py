@@ -1,3 +1,6 @@
+import json
+from pathlib import Path
+
 from mps_motion.__main__ import app
 from typer.testing import CliRunner
 
@@ -6,3 +9,51 @@ def test_cli(TEST_FILENAME):
     runner = CliRunner()
     result = runner.invoke(app, ["analyze", TEST_FILENAME])
     assert result.exit_code == 0
+
+
+def test_analyze_directory_resumes(tmp_path, monkeypatch):
+    from mps_motion import cli
+
+    folder = tmp_path / "plate"
+    folder.joinpath("A").mkdir(parents=True)
+    for name in ["A/w1.npy", "w2.npy", "bad.npy"]:
+        folder.joinpath(name).touch()
+    # Output from an earlier run should not be analyzed
+    folder.joinpath("w2", "motion").mkdir(parents=True)
+    folder.joinpath("w2", "motion", "settings.json").touch()
+    folder.joinpath("w2", "motion", "movie.mp4").touch()
+
+    analyzed = []
+
+    def main(filename, outdir, **kwargs):
+        analyzed.append(filename.name)
+        if filename.name == "bad.npy":
+            raise ValueError("Bad file")
+        Path(outdir).mkdir(parents=True)
+        Path(outdir).joinpath("results.csv").touch()
+        return 10
+
+    monkeypatch.setattr(cli, "main", main)
+    outdir = tmp_path / "out"
+    manifest = cli.analyze_directory(folder, outdir=outdir.as_posix())
+    assert sorted(analyzed) == ["bad.npy", "w1.npy", "w2.npy"]
+    assert sorted(manifest["completed"]) == ["A/w1.npy", "w2.npy"]
+    assert list(manifest["failed"]) == ["bad.npy"]
+    assert outdir.joinpath("A", "w1", "results.csv").is_file()
+    assert json.loads(outdir.joinpath(cli.MANIFEST_NAME).read_text()) == manifest
+
+    # Only the failed file is analyzed again
+    analyzed.clear()
+    cli.analyze_directory(folder, outdir=outdir.as_posix())
+    assert analyzed == ["bad.npy"]
+
+
+def test_warmup(monkeypatch):
+    from mps_motion import utils
+
+    calls = []
+    monkeypatch.setattr(utils, "warmup", calls.append)
+    runner = CliRunner()
+    assert runner.invoke(app, ["warmup"]).exit_code == 0
+    assert runner.invoke(app, ["warmup", "--dtype", "uint8", "--dtype", "float32"]).exit_code == 0
+    assert calls == [utils.WARMUP_DTYPES, ["uint8", "float32"]]
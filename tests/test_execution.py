@@ -0,0 +1,72 @@
+import concurrent.futures
+
+import dask
+import dask.array as da
+import numpy as np
+import pytest
+from mps_motion import execution
+from mps_motion import Mechanics
+from mps_motion import OpticalFlow
+from mps_motion.execution import ExecutionConfig
+
+
+def test_execution_config_parses_values():
+    config = ExecutionConfig(scheduler="threads", memory_limit="1MB")
+    assert config.scheduler == execution.Scheduler.threads
+    assert config.memory_limit == 1_000_000
+    assert config.cache_bytes == 500_000
+
+    with pytest.raises(ValueError):
+        ExecutionConfig(scheduler="cluster")
+
+
+def test_execution_config_context():
+    config = ExecutionConfig(scheduler="synchronous", num_workers=2)
+    assert execution.get_config() is execution.DEFAULT_CONFIG
+    with config:
+        assert execution.get_config() is config
+        assert dask.config.get("scheduler") == "synchronous"
+        assert dask.config.get("num_workers") == 2
+        with execution.activate(None):
+            assert execution.get_config() is config
+    assert execution.get_config() is execution.DEFAULT_CONFIG
+    assert dask.config.get("scheduler", None) != "synchronous"
+
+
+def test_executor():
+    with execution.executor() as executor:
+        assert isinstance(executor, concurrent.futures.ProcessPoolExecutor)
+    with ExecutionConfig(scheduler="threads"), execution.executor() as executor:
+        assert isinstance(executor, concurrent.futures.ThreadPoolExecutor)
+    with ExecutionConfig(scheduler="synchronous"):
+        with execution.executor() as executor:
+            assert isinstance(executor, execution.SerialExecutor)
+            assert list(executor.map(abs, [-1, 2])) == [1, 2]
+
+
+def test_rechunk():
+    array = da.zeros((10, 10, 100, 2), chunks=(5, 5, 10, 2))
+    assert ExecutionConfig().rechunk(array) is array
+    assert ExecutionConfig(chunk_size=25).rechunk(array).chunks == ((10,), (10,), (25,) * 4, (2,))
+    # Each frame is 1600 bytes, so one worker gets chunks of 1e5 / (4 * 1600) frames
+    chunks = ExecutionConfig(num_workers=1, memory_limit=100_000).rechunk(array).chunks
+    assert chunks[2][0] == 15
+
+
+@pytest.mark.parametrize("flow_algorithm", ["farneback", "block_matching"])
+def test_optical_flow_with_execution_config(test_data, flow_algorithm):
+    config = ExecutionConfig(scheduler="synchronous", chunk_size=3, memory_limit="10MB")
+    opt_flow = OpticalFlow(test_data, flow_algorithm=flow_algorithm, execution=config)
+    assert opt_flow.data.cache.max_bytes == config.cache_bytes
+    u = opt_flow.get_displacements()
+    assert u.array.chunks[2][0] == 3
+
+    reference = OpticalFlow(test_data, flow_algorithm=flow_algorithm).get_displacements()
+    assert np.allclose(u.array_np, reference.array_np)
+
+
+def test_mechanics_with_execution_config(mech_obj):
+    config = ExecutionConfig(scheduler="synchronous", memory_limit=1000)
+    mech = Mechanics(mech_obj.u, t=mech_obj.t, execution=config)
+    assert mech.cache.max_bytes == 500
+    assert np.allclose(mech.compute(("E",))["E"], mech_obj.E.array_np)
@@ -97,3 +97,126 @@ def test_filter_vectors_par_numpy(filter_type, size, sigma):
     )
     assert filtered_vectors.shape == shape
     assert 0 < np.abs(filtered_vectors - vectors).max() < 1
+
+
+@pytest.mark.parametrize("copy", [True, False])
+def test_threshold_norm_numpy_copy(copy):
+    np.random.seed(1)
+    vectors = np.random.random((10, 9, 5, 2))
+    vectors[0, 0, 0, :] = 0.0
+    original = vectors.copy()
+
+    th_vectors = filters.threshold_norm(vectors, np, vmin=0.3, vmax=0.8, copy=copy)
+    norm = np.linalg.norm(th_vectors, axis=3)
+
+    # Zero vectors have no direction and are kept
+    assert norm[0, 0, 0] == 0.0
+    assert np.isclose(norm.flatten()[1:].min(), 0.3)
+    assert np.isclose(norm.max(), 0.8)
+    # Direction is preserved
+    assert np.allclose(
+        np.arctan2(th_vectors[..., 1], th_vectors[..., 0])[1:],
+        np.arctan2(original[..., 1], original[..., 0])[1:],
+    )
+    assert (th_vectors is vectors) is not copy
+    assert np.array_equal(vectors, original) is copy
+
+
+def test_threshold_norm_dask_lazy():
+    np.random.seed(1)
+    values = np.random.random((10, 9, 6, 2))
+    vectors = da.from_array(values, chunks=(5, 5, 3, 1))
+
+    th_vectors = filters.threshold_norm(vectors, da, vmin=0.3, vmax=0.8)
+    assert isinstance(th_vectors, da.Array)
+    assert np.allclose(
+        th_vectors.compute(),
+        filters.threshold_norm(values, np, vmin=0.3, vmax=0.8),
+    )
+    # The input is not modified
+    assert np.array_equal(vectors.compute(), values)
+
+
+@pytest.mark.parametrize("ns", [np, da])
+def test_spline_smooth(ns):
+    width = 40
+    height = 30
+    num_time_steps = 3
+    X, Y = np.meshgrid(np.arange(width), np.arange(height), indexing="ij")
+    u = np.zeros((width, height, num_time_steps, 2))
+    for t in range(num_time_steps):
+        u[:, :, t, 0] = 0.1 * X - 0.2 * t * Y
+        u[:, :, t, 1] = 0.3 * Y + t
+
+    # Linear fields should be preserved
+    smooth = filters.spline_smooth(ns.asarray(u))
+    assert isinstance(smooth, type(ns.asarray(u)))
+    assert np.allclose(smooth, u)
+
+    # While noise should be reduced
+    np.random.seed(1)
+    noise = 0.1 * np.random.standard_normal(u.shape)
+    smooth = np.asarray(filters.spline_smooth(ns.asarray(u + noise)))
+    assert np.abs(smooth - u).std() < 0.5 * noise.std()
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+@pytest.mark.parametrize(
+    "filter_type, size, sigma",
+    [
+        (filters.Filters.median, 3, None),
+        (filters.Filters.median, 5, None),
+        (filters.Filters.gaussian, None, 1),
+        (filters.Filters.gaussian, None, 0.7),
+    ],
+)
+def test_filter_vectors_par_matches_per_frame(filter_type, size, sigma, dtype):
+    # More frames than OpenCV can handle as channels in one image
+    shape = (20, 17, 70, 2)
+    np.random.seed(1)
+    vectors = np.random.random(shape).astype(dtype)
+
+    expected = np.stack(
+        [filters.filter_vectors(vectors[:, :, i, :], filter_type, size, sigma) for i in range(shape[2])],
+        axis=2,
+    )
+    filtered_numpy = filters.filter_vectors_par(vectors, filter_type, size, sigma)
+    filtered_dask = filters.filter_vectors_par(
+        da.from_array(vectors, chunks=(8, 7, 2, 2)),
+        filter_type,
+        size,
+        sigma,
+    )
+    assert isinstance(filtered_dask, da.Array)
+    tol = 1e-5 if dtype == np.float32 else 1e-10
+    assert np.allclose(filtered_numpy, expected, atol=tol)
+    assert np.allclose(filtered_dask.compute(), expected, atol=tol)
+
+
+@pytest.mark.parametrize(
+    "filter_type, options",
+    [
+        ("savgol", {"window_length": 7, "polyorder": 3}),
+        ("butterworth", {"order": 2, "cutoff": 0.3}),
+        ("median", {"size": 5}),
+    ],
+)
+def test_apply_temporal_filter(filter_type, options):
+    shape = (6, 5, 60, 2)
+    np.random.seed(1)
+    t = np.linspace(0, 2 * np.pi, shape[2])
+    signal = np.sin(t)[None, None, :, None] * np.ones(shape)
+    noisy = signal + 0.1 * np.random.standard_normal(shape)
+
+    filtered = filters.apply_temporal_filter(noisy, filter_type, options)
+    assert filtered.shape == shape
+    assert np.abs(filtered - signal).std() < np.abs(noisy - signal).std()
+
+    # Chunking in time should give the same result
+    filtered_dask = filters.apply_temporal_filter(
+        da.from_array(noisy, chunks=(3, 5, 15, 2)),
+        filter_type,
+        options,
+    )
+    assert isinstance(filtered_dask, da.Array)
+    assert np.allclose(filtered_dask.compute(), filtered, atol=1e-5)
@@ -117,6 +117,25 @@ def test_tensor_frame_sequence(ns):
     assert np.isclose(p.array, q).all()
 
 
+@pytest.mark.parametrize("ns", [np, da])
+def test_compute_eigenvectors(ns):
+    arr = ns.random.random((10, 12, 14, 2, 2))
+    # Make symmetric
+    arr = 0.5 * (arr + ns.transpose(arr, (0, 1, 2, 4, 3)))
+    x = fs.TensorFrameSequence(arr)
+
+    w = x.compute_eigenvalues()
+    v = x.compute_eigenvectors()
+    assert isinstance(w.array, type(arr))
+    assert isinstance(v.array, type(arr))
+
+    w_np, v_np = np.linalg.eigh(np.asarray(arr))
+    assert np.allclose(w.array_np, w_np)
+    # Eigenvectors are only unique up to a sign
+    dot = np.einsum("...ik,...ik->...k", v.array_np, v_np)
+    assert np.allclose(np.abs(dot), 1.0)
+
+
 @pytest.mark.skipif(MPS_NOT_FOUND, reason="MPS not found")
 @pytest.mark.parametrize("ns", [np, da])
 def test_local_averages(ns):
@@ -169,6 +188,121 @@ def test_norm(ns):
     # breakpoint()
 
 
+@pytest.mark.parametrize("ns", [np, da])
+def test_apply_mask(ns):
+    width = 10
+    height = 15
+    num_time_steps = 14
+
+    arr = 2 * ns.ones((width, height, num_time_steps, 2))
+    mask = np.zeros((width, height), dtype=bool)
+    mask[:4, :] = True
+    # Values in the masked region should not contribute to averages
+    arr[:4, :, :, :] = 100.0
+
+    x = fs.VectorFrameSequence(arr)
+    x.apply_mask(mask)
+    assert np.all(x.mask == mask)
+
+    # Mask is only stored in 2D and the data is not modified
+    assert x._array.shape == (width, height, num_time_steps, 2)
+    assert np.isclose(x.mean(), 2.0).all()
+    assert np.isclose(x.norm().mean(), 2 * np.sqrt(2)).all()
+    assert np.isclose(x.x.mean(), 2.0).all()
+
+    # Masked pixels are filled with the fill value
+    x_np = x.array_np
+    assert (x_np[:4] == 0).all()
+    assert (x_np[4:] == 2).all()
+    assert (x.norm().max()[:4] == 0).all()
+
+    # Including masked pixels as zeros in the mean
+    assert np.isclose(x.mean(masked=False), 2.0 * (width - 4) / width).all()
+
+
+@pytest.mark.parametrize("ns", [np, da])
+def test_mask_propagation(ns):
+    width = 10
+    height = 15
+    num_time_steps = 6
+    np.random.seed(1)
+    arr = ns.random.random((width, height, num_time_steps, 2))
+    mask = np.zeros((width, height), dtype=bool)
+    mask[:4, :] = True
+
+    x = fs.VectorFrameSequence(arr, mask=mask)
+    derived = [
+        x.norm(),
+        x.x,
+        x.y,
+        x + x,
+        x - x,
+        2 * x,
+        x.threshold_norm(0.2, 0.8),
+        x.filter(filters.Filters.median, size=3),
+        x.norm().threshold(0.2, 0.8),
+        x.norm().filter(filters.Filters.median, size=3),
+    ]
+    for y in derived:
+        assert y.mask is not None
+        assert np.array_equal(y.mask, mask)
+
+    # Combining masks
+    other_mask = np.zeros_like(mask)
+    other_mask[:, :2] = True
+    z = x + fs.VectorFrameSequence(arr, mask=other_mask)
+    assert np.array_equal(z.mask, mask | other_mask)
+
+
+def test_mask_is_copied():
+    mask = np.zeros((10, 15), dtype=bool)
+    x = fs.FrameSequence(np.ones((10, 15, 3)), mask=mask)
+    mask[0, 0] = True
+    assert not x.mask.any()
+    with pytest.raises(ValueError):
+        x.mask[0, 0] = True
+
+
+def test_filter_ignores_masked_values():
+    arr = np.ones((10, 15, 3, 2))
+    mask = np.zeros((10, 15), dtype=bool)
+    mask[:4, :] = True
+    # Outliers in the masked region should not leak into the tissue
+    arr[:4, :, :, :] = 1000.0
+    x = fs.VectorFrameSequence(arr, mask=mask)
+    y = x.filter(filters.Filters.gaussian, sigma=1.0)
+    assert y.array_np[4:].max() <= 1.0 + 1e-12
+
+
+def test_mask_equality():
+    arr = np.ones((10, 15, 3))
+    mask = np.zeros((10, 15), dtype=bool)
+    mask[0, 0] = True
+    assert fs.FrameSequence(arr) != fs.FrameSequence(arr, mask=mask)
+    assert fs.FrameSequence(arr, mask=mask) == fs.FrameSequence(arr, mask=mask)
+
+
+@pytest.mark.parametrize("suffix", [".h5", ".npy"])
+def test_save_load_mask(suffix, tmp_path):
+    arr = np.random.random((10, 15, 3))
+    mask = np.zeros((10, 15), dtype=bool)
+    mask[:4, :] = True
+    x = fs.FrameSequence(arr, mask=mask)
+    path = (tmp_path / "test").with_suffix(suffix)
+    x.save(path)
+
+    new_x = fs.FrameSequence.from_file(path)
+    assert np.array_equal(new_x.mask, mask)
+    assert np.allclose(new_x.mean(), x.mean())
+    new_x.cleanup()
+
+
+def test_apply_mask_invalid_shape():
+    x = fs.FrameSequence(np.ones((10, 15, 3)))
+    with pytest.raises(ValueError):
+        x.apply_mask(np.zeros((15, 10), dtype=bool))
+
+
 @pytest.mark.parametrize(
     "ns, limits",
     product([np, da], [(0.4, 0.6), (None, 0.6), (0.4, None), (0.5, 0.5), (None, None)]),
@@ -268,6 +402,27 @@ def test_filter_VectorFrameSequence(filter_type, size, sigma):
     assert 0 < np.abs(filtered_vectors - vectors).max() < 1
 
 
+def test_filter_VectorFrameSequence_temporal():
+    shape = (10, 9, 30, 2)
+    np.random.seed(1)
+    vectors = np.random.random(shape)
+    u = fs.VectorFrameSequence(da.from_array(vectors, chunks=(5, 9, 10, 2)))
+
+    options = {"window_length": 5, "polyorder": 2}
+    u_filt = u.filter(filter_type=None, temporal_filter="savgol", temporal_options=options)
+    assert np.allclose(
+        u_filt.array_np,
+        filters.apply_temporal_filter(vectors, "savgol", options),
+    )
+
+    u_filt = u.filter(size=3, temporal_filter="median")
+    expected = filters.apply_temporal_filter(
+        filters.filter_vectors_par(vectors, filters.Filters.median, size=3),
+        "median",
+    )
+    assert np.allclose(u_filt.array_np, expected)
+
+
 @pytest.mark.parametrize(
     "filter_type, size, sigma",
     [
@@ -0,0 +1,36 @@
+import json
+import subprocess
+import sys
+
+import mps_motion
+import pytest
+
+# Modules that take long to import and should only be imported when used
+HEAVY_MODULES = ["ap_features", "cv2", "dask", "dask_image", "matplotlib", "mps", "numba", "scipy"]
+
+
+def imported_modules(code):
+    code += "; import sys, json; print(json.dumps(sorted(sys.modules)))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    modules = json.loads(result.stdout.splitlines()[-1])
+    return {m.split(".")[0] for m in modules}
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "import mps_motion",
+        "from mps_motion import FLOW_ALGORITHMS, ExecutionConfig",
+        "from mps_motion.__main__ import app",
+    ],
+)
+def test_import_is_lazy(code):
+    assert imported_modules(code).isdisjoint(HEAVY_MODULES)
+
+
+def test_lazy_attributes():
+    assert "OpticalFlow" in dir(mps_motion)
+    assert mps_motion.OpticalFlow is mps_motion.motion_tracking.OpticalFlow
+    assert mps_motion.FLOW_ALGORITHMS is mps_motion.motion_tracking.FLOW_ALGORITHMS
+    with pytest.raises(AttributeError):
+        mps_motion.not_a_module
@@ -87,6 +87,14 @@ def test_principal_strain(mech_obj):
     assert np.allclose(e2[:, :, 1], eig.max())
 
 
+def test_principal_directions(mech_obj):
+    E = mech_obj.E.array_np
+    w = mech_obj.principal_strain.array_np
+    v = mech_obj.principal_directions.array_np
+    # E v = lambda v
+    assert np.allclose(E @ v, v * w[..., None, :])
+
+
 @pytest.mark.parametrize("dx", [1.0, 0.5, 2.0])
 def test_dx(dx):
     # f(x, y) = (x / width - y / height & y / height - x / width)
@@ -121,6 +129,61 @@ def test_dx(dx):
     assert da.isclose(m.du[:, :, :, 1, 1], a22 / dx).all().compute()
 
 
+@pytest.mark.parametrize("method", ["central", "savgol"])
+def test_finite_difference_gradient(method):
+    width = 20
+    height = 24
+    num_time_steps = 3
+    dx = 0.5
+
+    X, Y = np.meshgrid(dx * np.arange(width), dx * np.arange(height), indexing="ij")
+    u = np.zeros((width, height, num_time_steps, 2))
+    for t in range(num_time_steps):
+        u[:, :, t, 0] = (t + 1) * (0.1 * X - 0.2 * Y)
+        u[:, :, t, 1] = (t + 1) * (0.3 * X + 0.05 * Y**2)
+
+    # Use several chunks to check the halos between chunks
+    U = fs.VectorFrameSequence(da.from_array(u, chunks=(7, 9, 1, 2)), dx=dx)
+    m = Mechanics(U, gradient_method=method)
+    du = m.du.array_np
+
+    factor = np.arange(1, num_time_steps + 1)[None, None, :]
+    assert np.allclose(du[:, :, :, 0, 0], 0.1 * factor)
+    assert np.allclose(du[:, :, :, 1, 0], -0.2 * factor)
+    assert np.allclose(du[:, :, :, 0, 1], 0.3 * factor)
+    assert np.allclose(du[:, :, :, 1, 1], 0.1 * Y[:, :, None] * factor)
+
+
+@pytest.mark.parametrize("method", ["spline", "central"])
+def test_compute_fused(method):
+    width = 12
+    height = 14
+    num_time_steps = 5
+    np.random.seed(2)
+    u = np.random.random((width, height, num_time_steps, 2))
+    mask = np.zeros((width, height), dtype=bool)
+    mask[:4, :] = True
+
+    U = fs.VectorFrameSequence(da.from_array(u, chunks=(6, 7, 2, 2)), scale=2.0)
+    U.apply_mask(mask)
+    m = Mechanics(U, gradient_method=method)
+
+    fields = ["du", "E", "principal_strain", "E_mean", "principal_strain_max"]
+    result = m.compute(fields)
+    assert set(result) == set(fields)
+
+    assert np.allclose(result["du"], m.du.array_np)
+    assert np.allclose(result["E"], m.E.array_np)
+    assert np.allclose(result["principal_strain"], m.principal_strain.array_np)
+    assert np.allclose(result["E_mean"], m.E.mean().compute())
+    assert np.allclose(result["principal_strain_max"], m.principal_strain.max().compute())
+
+
+def test_compute_unknown_field(mech_obj):
+    with pytest.raises(ValueError):
+        mech_obj.compute(["strain"])
+
+
 def test_velocity(mech_obj):
     v = mech_obj.velocity() * 1000
     assert np.isclose(
@@ -153,6 +216,102 @@ def test_compute_displacement(mech_obj):
     assert da.isclose(u, mech_obj.u.array).all().compute()
 
 
+def test_compute_displacement_ref_index(mech_obj):
+    ref_index = 2
+    v = mech_obj.velocity()
+    u = mechanics.compute_displacement(v.array, mech_obj.t, ref_index=ref_index)
+    u_ref = mech_obj.u.array_np - mech_obj.u.array_np[:, :, ref_index : ref_index + 1, :]
+    assert np.allclose(u.compute(), u_ref)
+
+
+@pytest.mark.parametrize("spacing", [1, 2, 3])
+@pytest.mark.parametrize("method", ["rectangle", "trapezoid"])
+def test_compute_displacement_linear_in_time(spacing, method):
+    width = 5
+    height = 6
+    t = np.array([0.0, 1.0, 2.5, 3.0, 4.5, 6.0, 6.5])
+    np.random.seed(3)
+    a = np.random.random((width, height, 1, 2))
+    u = a * t[None, None, :, None]
+
+    v = mechanics.compute_velocity(u, t, spacing=spacing)
+    U = mechanics.compute_displacement(v, t, spacing=spacing, method=method)
+    assert np.allclose(U.compute(), u)
+
+
+def test_grid_labels():
+    labels = mechanics.grid_labels((4, 6), 2, 3)
+    assert np.array_equal(
+        labels,
+        [
+            [1, 1, 2, 2, 3, 3],
+            [1, 1, 2, 2, 3, 3],
+            [4, 4, 5, 5, 6, 6],
+            [4, 4, 5, 5, 6, 6],
+        ],
+    )
+
+
+def test_regional_traces():
+    width = 10
+    height = 12
+    num_time_steps = 6
+    np.random.seed(4)
+    u = np.random.random((width, height, num_time_steps, 2))
+    mask = np.zeros((width, height), dtype=bool)
+    mask[:2, :] = True
+
+    U = fs.VectorFrameSequence(da.from_array(u, chunks=(5, 6, 2, 2)))
+    U.apply_mask(mask)
+    m = Mechanics(U, gradient_method="central")
+
+    labels = mechanics.grid_labels((width, height), 2, 2)
+    labels[5:, 6:] = 0  # Background
+    traces = m.regional_traces(
+        labels,
+        fields=["u", "v", "E"],
+        stats=["mean", "max"],
+        percentiles=[90],
+    )
+
+    E = m.E.array_np
+    v = m.velocity().array_np
+    for i, label in enumerate([1, 2, 3]):
+        region = (labels == label) & ~mask
+        assert np.allclose(traces["u"]["mean"][i], u[region].mean(0))
+        assert np.allclose(traces["u"]["max"][i], u[region].max(0))
+        assert np.allclose(traces["u"]["p90"][i], np.percentile(u[region], 90, axis=0))
+        assert np.allclose(traces["v"]["mean"][i], v[region].mean(0))
+        assert np.allclose(traces["E"]["mean"][i], E[region].mean(0))
+
+    assert traces["E"]["mean"].shape == (3, num_time_steps, 2, 2)
+    assert traces["v"]["max"].shape == (3, num_time_steps - 1, 2)
+
+
+def test_mask_propagates_to_derived_fields():
+    width = 10
+    height = 12
+    num_time_steps = 5
+    np.random.seed(1)
+    u = np.random.random((width, height, num_time_steps, 2))
+    mask = np.zeros((width, height), dtype=bool)
+    mask[:, :6] = True
+
+    U = fs.VectorFrameSequence(u)
+    U.apply_mask(mask)
+    m = Mechanics(U)
+
+    for field in [m.du, m.F, m.E, m.velocity(), m.principal_strain]:
+        assert np.array_equal(field.mask, mask)
+
+    # Averages should only be taken over the tissue pixels
+    v = m.velocity().array.compute()
+    assert np.allclose(m.velocity().mean().compute(), v[~mask].mean(0))
+    assert np.allclose(m.velocity().norm().mean().compute(), np.linalg.norm(v, axis=3)[~mask].mean(0))
+    E = m.E.array.compute()
+    assert np.allclose(m.E.x.mean().compute(), E[:, :, :, 1, 1][~mask].mean(0))
+
+
 def test_shapes():
     width = 10
     height = 12
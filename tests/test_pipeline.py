@@ -0,0 +1,64 @@
+import json
+
+from mps_motion import pipeline
+
+
+def run_stages(outdir, calls, a=1, b=2, overwrite=False):
+    checkpoints = pipeline.Checkpoints(outdir, overwrite=overwrite)
+
+    def stage(name, value, inputs, upstream=()):
+        path = checkpoints.path(f"{name}.json")
+
+        def compute():
+            calls.append(name)
+            return value
+
+        return checkpoints.run(
+            name,
+            inputs=inputs,
+            compute=compute,
+            save=lambda v: path.write_text(json.dumps(v)),
+            load=lambda: pipeline.load_json(path),
+            upstream=upstream,
+        )
+
+    x = stage("first", 10 * a, {"a": a})
+    return stage("second", x + b, {"b": b}, upstream=["first"])
+
+
+def test_checkpoints_reuse_stages(tmp_path):
+    calls = []
+    assert run_stages(tmp_path, calls) == 12
+    assert calls == ["first", "second"]
+
+    calls.clear()
+    assert run_stages(tmp_path, calls) == 12
+    assert calls == []
+
+    # Only the stage with a changed setting is recomputed
+    assert run_stages(tmp_path, calls, b=3) == 13
+    assert calls == ["second"]
+
+    # Changes in upstream stages propagate
+    calls.clear()
+    assert run_stages(tmp_path, calls, a=2, b=3) == 23
+    assert calls == ["first", "second"]
+
+    calls.clear()
+    run_stages(tmp_path, calls, a=2, b=3, overwrite=True)
+    assert calls == ["first", "second"]
+
+
+def test_checkpoints_missing_artifact(tmp_path):
+    calls = []
+    run_stages(tmp_path, calls)
+    tmp_path.joinpath("second.json").unlink()
+
+    calls.clear()
+    assert run_stages(tmp_path, calls) == 12
+    assert calls == ["second"]
+
+
+def test_fingerprint():
+    assert pipeline.fingerprint({"a": 1, "b": 2}) == pipeline.fingerprint({"b": 2, "a": 1})
+    assert pipeline.fingerprint({"a": 1}) != pipeline.fingerprint({"a": 2})
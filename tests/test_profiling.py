@@ -0,0 +1,54 @@
+import json
+
+import numpy as np
+from mps_motion import filters
+from mps_motion import OpticalFlow
+from mps_motion import profiling
+
+
+def test_stage_is_noop_without_profiler():
+    with profiling.stage("outside"):
+        pass
+    with profiling.Profiler() as profiler:
+        pass
+    assert profiler.stages == []
+
+
+def test_nested_stages(tmp_path):
+    with profiling.Profiler() as profiler:
+        with profiling.stage("outer", num_frames=10):
+            with profiling.stage("inner"):
+                np.ones(1000).sum()
+
+    assert [s.name for s in profiler.stages] == ["outer/inner", "outer"]
+    outer = profiler.stages[1]
+    assert outer.wall_time >= profiler.stages[0].wall_time
+    assert outer.frames_per_second == 10 / outer.wall_time
+    assert profiler.stages[0].frames_per_second is None
+    assert "outer/inner" in profiler.summary()
+
+    path = tmp_path / "timings.json"
+    profiler.save(path)
+    stages = json.loads(path.read_text())["stages"]
+    assert stages[1]["name"] == "outer"
+    assert stages[1]["num_frames"] == 10
+    assert set(stages[1]) >= {"wall_time", "cpu_time", "peak_rss", "bytes_read", "bytes_written"}
+
+
+def test_filters_report_stages():
+    vectors = np.random.random((10, 10, 5, 2))
+    with profiling.Profiler() as profiler:
+        filters.filter_vectors_par(vectors, filter_type="gaussian", sigma=1.0)
+        filters.apply_temporal_filter(vectors, filter_type="median")
+
+    assert [s.name for s in profiler.stages] == ["filter_vectors", "temporal_filter"]
+    assert profiler.stages[0].num_frames == 5
+
+
+def test_optical_flow_reports_stages(test_data):
+    with profiling.Profiler() as profiler:
+        OpticalFlow(test_data, flow_algorithm="farneback").get_displacements().array_np
+
+    names = [s.name for s in profiler.stages]
+    assert "uint8" in names
+    assert "farneback" in names
@@ -0,0 +1,83 @@
+import os
+
+import dask.array as da
+import numpy as np
+import pytest
+from mps_motion import readers
+
+
+@pytest.fixture
+def frames():
+    np.random.seed(1)
+    return np.random.randint(0, 1000, size=(20, 30, 10)).astype(np.uint16)
+
+
+@pytest.fixture
+def mps_npy(tmp_path, frames):
+    path = tmp_path / "recording.npy"
+    np.save(
+        path,
+        dict(
+            frames=frames,
+            time_stamps=10.0 * np.arange(frames.shape[2]),
+            info=dict(um_per_pixel=0.5, time_unit="ms", dt=10.0),
+        ),
+    )
+    return path
+
+
+def test_time_window():
+    t = 10.0 * np.arange(10)
+    assert readers.time_window(t) == slice(0, 10)
+    assert readers.time_window(t, 15, 45) == slice(2, 5)
+    assert readers.time_window(t, end_t=1000) == slice(0, 10)
+
+
+def test_npy_reader_is_memmapped(tmp_path, frames):
+    path = tmp_path / "frames.npy"
+    np.save(path, frames)
+    assert readers.is_memmappable(path)
+
+    reader = readers.open_reader(path)
+    assert isinstance(reader, readers.NpyReader)
+    selection = reader.read(x=slice(2, 5), t=slice(1, 3))
+    assert isinstance(selection, np.memmap)
+    assert np.all(selection == frames[2:5, :, 1:3])
+
+
+def test_load_data_crops(mps_npy, frames):
+    assert not readers.is_memmappable(mps_npy)
+    data = readers.load_data(mps_npy, start_x=2, end_x=12, start_y=5, start_t=20, end_t=60)
+    assert np.all(data.frames == frames[2:12, 5:, 2:6])
+    # The selection does not keep the full recording alive
+    assert data.frames.base is None
+    assert np.all(data.time_stamps == [20, 30, 40, 50])
+    assert data.info["um_per_pixel"] == 0.5
+    assert (data.info["size_x"], data.info["size_y"], data.info["num_frames"]) == (10, 25, 4)
+
+
+def test_h5_cache(mps_npy, frames):
+    data = readers.load_data(mps_npy, start_x=2, end_x=12, start_t=20, cache=True)
+    cache_path = readers.cache_path(mps_npy)
+    assert cache_path.is_file()
+    assert isinstance(data.frames, da.Array)
+    assert np.all(data.frames.compute() == frames[2:12, :, 2:])
+    assert data.info["um_per_pixel"] == 0.5
+
+    # The cache is reused as long as the recording is unchanged
+    mtime = cache_path.stat().st_mtime_ns
+    reader = readers.open_reader(mps_npy, cache=True)
+    assert isinstance(reader, readers.H5Reader)
+    assert cache_path.stat().st_mtime_ns == mtime
+    reader.close()
+
+    stat = mps_npy.stat()
+    os.utime(mps_npy, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    readers.open_reader(mps_npy, cache=True).close()
+    assert cache_path.stat().st_mtime_ns != mtime
+
+
+def test_mps_reader(mps_npy, frames):
+    reader = readers.MPSReader(mps_npy)
+    assert reader.shape == frames.shape
+    assert np.all(reader.read(y=slice(3, 4)) == frames[:, 3:4, :])
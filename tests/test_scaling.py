@@ -1,4 +1,7 @@
+import cv2
+import dask.array as da
 import numpy as np
+import pytest
 from mps_motion import Mechanics
 from mps_motion import OpticalFlow
 from mps_motion import scaling
@@ -17,6 +20,31 @@ def test_resize_data():
     assert np.isclose(scaled_data.time_stamps, times).all()
 
 
+def test_resize_data_is_cached():
+    np.random.seed(1)
+    frames = np.random.random((40, 30, 5))
+    times = np.arange(frames.shape[-1])
+    data = utils.MPSData(frames=frames, time_stamps=times, info=dict(um_per_pixel=1.0))
+
+    scaled = scaling.resize_data(data, 0.5)
+    assert scaling.resize_data(data, 0.5).frames is scaled.frames
+    assert scaling.resize_data(data, 0.25).frames.shape == (10, 7, 5)
+    assert scaling.resize_data(data, 0.5, interpolation_method="nearest").frames is not scaled.frames
+    assert len(data.cache) == 3
+    assert not scaled.frames.flags.writeable
+
+    # The cache should not grow beyond its budget
+    data = utils.MPSData(
+        frames=frames,
+        time_stamps=times,
+        info=dict(um_per_pixel=1.0),
+        max_cache_bytes=scaled.frames.nbytes,
+    )
+    scaling.resize_data(data, 0.5)
+    scaling.resize_data(data, 0.25)
+    assert data.cache.nbytes <= scaled.frames.nbytes
+
+
 def test_resize_frames_displacement():
     width = 10
     height = 15
@@ -56,6 +84,79 @@ def test_resize_frames_displacement():
     # plt.show()
 
 
+@pytest.mark.parametrize("interpolation_method", ["nearest", "area"])
+@pytest.mark.parametrize("ns", [np, da])
+def test_resize_frames_batched(ns, interpolation_method):
+    # More frames than OpenCV can handle as channels in one image
+    np.random.seed(1)
+    frames = np.random.random((30, 20, 200)).astype(np.float32)
+
+    resized = scaling.resize_frames(
+        ns.asarray(frames),
+        scale=0.5,
+        interpolation_method=interpolation_method,
+    )
+    assert isinstance(resized, type(ns.asarray(frames)))
+
+    expected = np.stack(
+        [
+            cv2.resize(
+                frames[:, :, i],
+                (10, 15),
+                interpolation=scaling.INTERPOLATION_METHODS[interpolation_method],
+            )
+            for i in range(frames.shape[2])
+        ],
+        axis=-1,
+    )
+    assert np.allclose(np.asarray(resized), expected, atol=1e-6)
+
+
+@pytest.mark.parametrize("ns", [np, da])
+def test_resize_vectors(ns):
+    np.random.seed(1)
+    vectors = np.random.random((30, 20, 5, 2))
+    resized = scaling.resize_vectors(ns.asarray(vectors), (15, 10))
+    assert isinstance(resized, type(ns.asarray(vectors)))
+    assert resized.shape == (15, 10, 5, 2)
+    assert np.allclose(
+        resized[:, :, :, 1],
+        scaling.resize_frames(vectors[:, :, :, 1], new_shape=(15, 10)),
+    )
+
+
+@pytest.mark.parametrize("interpolation_method", ["nearest", "linear", "cubic"])
+def test_interpolate_lk_flow(interpolation_method):
+    from scipy.interpolate import griddata
+
+    size_x = 25
+    size_y = 20
+    num_frames = 3
+    np.random.seed(1)
+    ref_points = np.random.random((40, 1, 2)) * [size_y, size_x]
+    disp = np.random.random((40, 2, num_frames))
+
+    disp_full = scaling.interpolate_lk_flow(
+        disp,
+        ref_points,
+        size_x=size_x,
+        size_y=size_y,
+        interpolation_method=interpolation_method,
+    )
+    assert disp_full.shape == (size_y, size_x, 2, num_frames)
+
+    grid_x, grid_y = np.meshgrid(np.arange(size_x), np.arange(size_y))
+    for i in range(num_frames):
+        for j in range(2):
+            expected = griddata(
+                ref_points.squeeze(),
+                disp[:, j, i],
+                (grid_y, grid_x),
+                method=interpolation_method,
+            )
+            assert np.allclose(disp_full[:, :, j, i], expected, equal_nan=True)
+
+
 def _test_resize_frames_units():
     """This is a visual test"""
     import matplotlib.pyplot as plt
@@ -0,0 +1,99 @@
+import subprocess
+import sys
+
+import dask.array as da
+import numpy as np
+import pytest
+from mps_motion import block_matching
+from mps_motion import filters
+from mps_motion import frame_sequence
+from mps_motion import scaling
+from mps_motion import utils
+
+
+def test_to_uint8_does_not_overflow():
+    img = np.linspace(0, 1000, 100).reshape(10, 10)
+    img_uint8 = utils.to_uint8(img)
+    assert img_uint8.dtype == np.uint8
+    assert img_uint8.min() == 0
+    assert img_uint8.max() == 255
+    assert (np.diff(img_uint8.ravel().astype(int)) >= 0).all()
+
+
+def test_to_uint8_clips_to_range():
+    img = np.array([[-10.0, 0.0, 5.0, 10.0, 20.0]])
+    assert np.all(utils.to_uint8(img, vmin=0, vmax=10) == [[0, 0, 128, 255, 255]])
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 64])
+def test_to_uint8_frames(chunk_size):
+    np.random.seed(1)
+    frames = 100 * np.random.random((12, 10, 7))
+    expected = np.stack([utils.to_uint8(f, 0, frames.max()) for f in np.rollaxis(frames, 2)], axis=2)
+    assert np.all(utils.to_uint8(frames, chunk_size=chunk_size) == expected)
+
+    frames_dask = utils.to_uint8(da.from_array(frames, chunks=(12, 10, 2)))
+    assert isinstance(frames_dask, da.Array)
+    assert np.all(frames_dask.compute() == expected)
+
+
+def test_intensity_range():
+    frames = np.arange(1000, dtype=float).reshape(10, 10, 10)
+    assert utils.intensity_range(frames) == (0.0, 999.0)
+    assert utils.intensity_range(da.from_array(frames)) == (0.0, 999.0)
+    vmin, vmax = utils.intensity_range(frames, percentiles=(1, 99))
+    assert 0 < vmin < vmax < 999
+
+
+def test_frames_to_uint8_shares_range():
+    np.random.seed(2)
+    frames = np.random.random((10, 10, 4))
+    reference_image = 2 * frames[:, :, 0]
+    frames_uint8, reference_uint8 = utils.frames_to_uint8(frames, reference_image)
+    # The reference is brighter than the frames, so it is clipped
+    assert reference_uint8.max() == 255
+    assert np.all(frames_uint8[:, :, 0] <= reference_uint8)
+
+    frames_uint8 = frames_uint8.astype(np.uint8)
+    assert utils.frames_to_uint8(frames_uint8, reference_uint8)[0] is frames_uint8
+
+
+def test_mps_data_frames_uint8_is_cached():
+    np.random.seed(3)
+    frames = np.random.random((20, 20, 5))
+    data = utils.MPSData(frames=frames, time_stamps=np.arange(5), info=dict(um_per_pixel=1.0))
+
+    frames_uint8 = data.frames_uint8()
+    assert frames_uint8.dtype == np.uint8
+    assert data.frames_uint8() is frames_uint8
+    assert data.frames_uint8((1, 99)) is not frames_uint8
+    assert not frames_uint8.flags.writeable
+
+    # Resized data shares the cache with the original data
+    scaled_uint8 = scaling.resize_data(data, 0.5).frames_uint8()
+    assert scaling.resize_data(data, 0.5).frames_uint8() is scaled_uint8
+    assert scaled_uint8.shape == (10, 10, 5)
+
+
+@pytest.mark.parametrize(
+    "kernel",
+    [
+        block_matching._flow,
+        frame_sequence.sum_along_time,
+        frame_sequence.reduce_sliding_window,
+        filters._clamp_norm,
+    ],
+)
+def test_numba_kernels_are_cached_on_disk(kernel):
+    pytest.importorskip("numba")
+    assert type(kernel._cache).__name__ == "FunctionCache"
+
+
+def test_jit_without_numba():
+    code = (
+        "import sys; sys.modules['numba'] = None; from mps_motion import utils; "
+        "f = utils.jit(lambda x: 2 * x); g = utils.jit(nopython=True, cache=True)(lambda x: x + 1); "
+        "print(f(2), g(2))"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.split()[-2:] == ["4", "3"]
@@ -0,0 +1,81 @@
+import time
+
+import cv2
+import dask.array as da
+import numpy as np
+import pytest
+from mps_motion import frame_sequence as fs
+from mps_motion import visu
+from mps_motion.execution import ExecutionConfig
+
+
+def count_frames(path):
+    video = cv2.VideoCapture(path.as_posix())
+    num_frames = 0
+    while video.read()[0]:
+        num_frames += 1
+    video.release()
+    return num_frames
+
+
+def test_time_chunks():
+    assert visu.time_chunks(np.zeros((2, 2, 5)), chunk_size=2) == [(0, 2), (2, 4), (4, 5)]
+    array = da.zeros((2, 2, 5), chunks=(2, 2, 3))
+    assert visu.time_chunks(array) == [(0, 3), (3, 5)]
+    frames = list(visu.iter_frames(array))
+    assert len(frames) == 5
+    assert frames[0].shape == (2, 2)
+
+
+def test_render_frames_keeps_order():
+    def render(i):
+        # Later frames finish first
+        time.sleep(0.01 * (10 - i))
+        return i
+
+    items = ((i,) for i in range(10))
+    assert list(visu.render_frames(render, items, num_workers=4)) == list(range(10))
+    with ExecutionConfig(scheduler="synchronous"):
+        assert list(visu.render_frames(render, [(1,), (2,)])) == [1, 2]
+
+
+def test_cached_lut_and_grid():
+    assert visu.colormap_lut("bwr") is visu.colormap_lut("bwr")
+    assert visu.colormap_lut("bwr").shape == (1, 256, 3)
+    image = np.arange(256, dtype=np.uint8).reshape(16, 16)
+    assert np.array_equal(
+        visu.apply_custom_colormap(image, "bwr"),
+        visu.apply_custom_colormap(image, visu.plt.get_cmap("bwr")),
+    )
+    y, x = visu.quiver_grid((32, 48), 16)
+    assert visu.quiver_grid((32, 48), 16)[0] is y
+    assert np.array_equal(x, [8, 24, 40, 8, 24, 40])
+
+
+def test_video_writer_checks_shape(tmp_path):
+    with visu.VideoWriter(tmp_path / "video", fps=10, width=8, height=6) as writer:
+        assert writer.path.suffix == ".mp4"
+        with pytest.raises(ValueError):
+            writer.write(np.zeros((8, 6, 3), dtype=np.uint8))
+        writer.write(np.zeros((6, 8, 3), dtype=np.uint8))
+
+
+@pytest.mark.parametrize("convert", [True, False])
+def test_quiver_video(test_data, tmp_path, convert):
+    u = np.random.random(test_data.frames.shape + (2,))
+    vectors = fs.VectorFrameSequence(da.from_array(u, chunks=(-1, -1, 3, -1)))
+    visu.quiver_video(test_data, vectors, tmp_path / "quiver", step=4, convert=convert)
+
+    path = tmp_path / "quiver.mp4"
+    assert count_frames(path) == test_data.num_frames
+    width = cv2.VideoCapture(path.as_posix()).get(cv2.CAP_PROP_FRAME_WIDTH)
+    assert width == (test_data.size_x if convert else test_data.size_y)
+
+
+def test_hsv_and_heatmap_videos(tmp_path):
+    u = da.random.random((20, 30, 7, 2), chunks=(-1, -1, 2, -1))
+    visu.hsv_video(tmp_path / "hsv", u)
+    assert count_frames(tmp_path / "hsv.mp4") == 7
+
+    visu.heatmap(tmp_path / "heatmap", u[..., 0], transpose=True)
+    assert count_frames(tmp_path / "heatmap.mp4") == 7